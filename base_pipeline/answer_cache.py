@@ -0,0 +1,178 @@
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+from dynamic_cache_index import DynamicCacheIndex
+from embedding_cache import shared_embedding_cache
+from cache_metrics import shared_cache_metrics
+
+# Minimum cosine similarity between a question and a cached one for the cached answer to be returned
+DEFAULT_ANSWER_SIMILARITY = 0.95
+
+# Final answers kept, least recently used ones are dropped first
+DEFAULT_MAX_ANSWERS = 2000
+
+def tools_key(tools: List) -> str:
+    """Fingerprint of a tool set, independent of the order of the tool descriptions."""
+    return hashlib.sha256('\n'.join(sorted(str(tool) for tool in tools)).encode('utf-8')).hexdigest()
+
+class AnswerCache:
+    def __init__(self,
+                 dim: int = 1024,
+                 similarity_threshold: float = DEFAULT_ANSWER_SIMILARITY,
+                 max_answers: int = DEFAULT_MAX_ANSWERS):
+        """
+            Semantic cache of the final answers of SUPERVISOR_AGENT.run.
+
+            Answers are stored under the embedding of their question, together with the key of the
+            document they were computed on and the fingerprint of the tool set that produced them.
+            A lookup only matches answers for the same document and tools, so changing either
+            invalidates them.
+
+            Args:
+                dim (int, optional): Dimension of the question embeddings. Defaults to 1024.
+                similarity_threshold (float, optional): Minimum cosine similarity of a cached question.
+                                                        Defaults to DEFAULT_ANSWER_SIMILARITY.
+                max_answers (int, optional): Capacity, least recently used answers are evicted.
+                                             Defaults to DEFAULT_MAX_ANSWERS.
+
+            Attributes:
+                hits (int): Lookups answered from the cache
+                misses (int): Lookups that had to run the agents
+        """
+        self.dim = dim
+        self.similarity_threshold = similarity_threshold
+        self.index = DynamicCacheIndex(dim=dim, batch_size=1, max_entries=max_answers, eviction_policy='lru',
+                                       filter_fields=('document_key', 'tools_key'), name='answers')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        try:
+            embedding = np.asarray(
+                shared_embedding_cache.get_text_embedding(self.index.text_embed_model, str(query)),
+                dtype=np.float32)
+        except Exception as e:
+            print(f"Error embedding question for the answer cache: {e}")
+            return None
+        if embedding.shape[0] != self.dim:
+            print(f"Answer cache dimension mismatch. Expected {self.dim}, got {embedding.shape[0]}")
+            return None
+        return embedding
+
+    def lookup(self, query: str, document_key: str, tools_key: str,
+               similarity_threshold: Optional[float] = None) -> Optional[Dict]:
+        """
+        Find the answer to an equivalent question on the same document with the same tools.
+
+        Args:
+            query (str): The user's question
+            document_key (str): Key of the document, see cache_registry.document_key
+            tools_key (str): Fingerprint of the tool set, see `tools_key`
+            similarity_threshold (float, optional): Overrides the cache's similarity threshold
+
+        Returns:
+            Optional[Dict]: 'query', 'answer', 'scratchpad', 'similarity' and 'timestamp' of the
+                            cached answer, or None on a miss
+        """
+        if similarity_threshold is None:
+            similarity_threshold = self.similarity_threshold
+        embedding = self._embed(query)
+        results = []
+        if embedding is not None and len(self.index):
+            results = self.index.search(embedding, k=1,
+                                        filters={'document_key': document_key, 'tools_key': tools_key})
+
+        with self._lock:
+            if not results or 1.0 - results[0][1] < similarity_threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        chunk_id, distance, result = results[0]
+        metadata = result['original_metadata']
+        self.index.record_hit(chunk_id)
+        return {
+            'query': metadata.get('query'),
+            'answer': metadata.get('answer'),
+            'scratchpad': metadata.get('scratchpad', ''),
+            'similarity': 1.0 - distance,
+            'timestamp': metadata.get('timestamp'),
+        }
+
+    def store(self, query: str, answer: str, scratchpad: str, document_key: str, tools_key: str) -> bool:
+        """
+        Cache the final answer to a question.
+
+        Args:
+            query (str): The user's question
+            answer (str): The final response
+            scratchpad (str): Tool calls and responses the answer was built from
+            document_key (str): Key of the document
+            tools_key (str): Fingerprint of the tool set
+
+        Returns:
+            bool: True if the answer was stored
+        """
+        if not answer:
+            return False
+        embedding = self._embed(query)
+        if embedding is None:
+            return False
+
+        metadata = {
+            'query': str(query),
+            'answer': str(answer),
+            'scratchpad': str(scratchpad or ''),
+            'document_key': document_key,
+            'tools_key': tools_key,
+            'timestamp': datetime.now().isoformat(),
+        }
+        return self.index.add_embedding(embedding, metadata, flush=True) is not None
+
+    def invalidate(self, document_key: Optional[str] = None, tools_key: Optional[str] = None) -> int:
+        """
+        Drop cached answers of a document and/or a tool set, every answer if neither is given.
+
+        Args:
+            document_key (str, optional): Only drop answers on this document
+            tools_key (str, optional): Only drop answers produced with this tool set
+
+        Returns:
+            int: Number of answers dropped
+        """
+        stale = [chunk_id for chunk_id, metadata in list(self.index.metadata.items())
+                 if (document_key is None or metadata.get('document_key') == document_key)
+                 and (tools_key is None or metadata.get('tools_key') == tools_key)]
+        return sum(self.index.remove(chunk_id) for chunk_id in stale)
+
+    def get_stats(self) -> Dict:
+        """
+        Size and hit-rate statistics.
+
+        Returns:
+            Dict: Answers, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'answers': len(self.index),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# Answer cache shared by every SUPERVISOR_AGENT of the process, created on first use
+_shared_answer_cache = None
+_shared_answer_cache_lock = threading.Lock()
+
+def get_shared_answer_cache() -> AnswerCache:
+    """The process-wide AnswerCache, created on first use so that importing this module needs no API key."""
+    global _shared_answer_cache
+    with _shared_answer_cache_lock:
+        if _shared_answer_cache is None:
+            _shared_answer_cache = AnswerCache()
+            shared_cache_metrics.register_collector('answer_cache', _shared_answer_cache.get_stats)
+        return _shared_answer_cache
@@ -0,0 +1,288 @@
+import argparse
+import time
+import numpy as np
+from datetime import datetime
+from dynamic_cache_index import DynamicCacheIndex, HNSW_CONFIG_PATH, update_hnsw_config
+from embedding_quantizer import STORAGE_TYPES
+
+
+def random_embeddings(n, dim, seed=0):
+    """
+    Generate unit-norm random embeddings standing in for Jina vectors.
+
+    Args:
+        n (int): Number of embeddings.
+        dim (int): Dimension of each embedding.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: Array of shape (n, dim).
+    """
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def fill_cache(cache, vectors):
+    """
+    Load `vectors` into `cache` with a single flush so that filling does not dominate the benchmark.
+    """
+    batch_size = cache.batch_size
+    cache.batch_size = len(vectors) + 1
+    for i, vector in enumerate(vectors):
+        cache.add_embedding(vector, {'query': f'query {i}', 'chunk': f'chunk {i}'})
+    cache.process_pending_additions(force=True)
+    cache.batch_size = batch_size
+
+
+def benchmark_flush_latency(cache_sizes=(1000, 5000, 10000, 20000), dim=1024, batch_size=16,
+                            flushes=10, modes=('rebuild', 'incremental')):
+    """
+    Measure how long flushing one batch of new memory entries takes as the cache grows.
+
+    Args:
+        cache_sizes (tuple): Number of entries already in the cache before measuring.
+        dim (int): Embedding dimension. Defaults to 1024, as used by RAGAGENT.
+        batch_size (int): Entries per flush. Defaults to 16, as used by RAGAGENT.
+        flushes (int): Number of flushes timed per cache size.
+        modes (tuple): Index modes of DynamicCacheIndex to compare.
+
+    Returns:
+        list[dict]: One row per (mode, cache size) with mean, p50 and max flush latency in ms.
+    """
+    results = []
+    for size in cache_sizes:
+        vectors = random_embeddings(size + flushes * batch_size, dim)
+        for mode in modes:
+            cache = DynamicCacheIndex(dim=dim, batch_size=batch_size, index_mode=mode,
+                                      exact_search_threshold=0)
+            fill_cache(cache, vectors[:size])
+
+            latencies = []
+            for flush in range(flushes):
+                start = size + flush * batch_size
+                for vector in vectors[start:start + batch_size - 1]:
+                    cache.add_embedding(vector)
+                tic = time.perf_counter()
+                # The last add of a batch triggers the flush
+                cache.add_embedding(vectors[start + batch_size - 1])
+                latencies.append((time.perf_counter() - tic) * 1000)
+
+            results.append({
+                'mode': mode,
+                'cache_size': size,
+                'mean_ms': float(np.mean(latencies)),
+                'p50_ms': float(np.median(latencies)),
+                'max_ms': float(np.max(latencies)),
+            })
+    return results
+
+
+def benchmark_exact_vs_hnsw(cache_sizes=(128, 256, 512, 1024, 2048, 4096, 8192), dim=1024,
+                            queries=50, k=5):
+    """
+    Compare the exact NumPy search path of DynamicCacheIndex with the HNSW path.
+
+    Args:
+        cache_sizes (tuple): Cache sizes to measure.
+        dim (int): Embedding dimension. Defaults to 1024.
+        queries (int): Number of timed queries per cache size.
+        k (int): Neighbours retrieved per query.
+
+    Returns:
+        list[dict]: One row per cache size with the mean exact query latency, the HNSW build time
+        and mean HNSW query latency in ms, and the recall@k of HNSW against the exact results.
+    """
+    results = []
+    for size in cache_sizes:
+        vectors = random_embeddings(size, dim)
+        query_vectors = random_embeddings(queries, dim, seed=1)
+
+        exact = DynamicCacheIndex(dim=dim, exact_search_threshold=size + 1)
+        fill_cache(exact, vectors)
+        hnsw = DynamicCacheIndex(dim=dim, exact_search_threshold=0)
+        tic = time.perf_counter()
+        fill_cache(hnsw, vectors)
+        build_ms = (time.perf_counter() - tic) * 1000
+
+        exact_ms, hnsw_ms, hits = [], [], 0
+        for query_vector in query_vectors:
+            tic = time.perf_counter()
+            exact_ids = {chunk_id for chunk_id, _, _ in exact.search(query_vector, k)}
+            exact_ms.append((time.perf_counter() - tic) * 1000)
+
+            tic = time.perf_counter()
+            hnsw_ids = {chunk_id for chunk_id, _, _ in hnsw.search(query_vector, k)}
+            hnsw_ms.append((time.perf_counter() - tic) * 1000)
+            hits += len(exact_ids & hnsw_ids)
+
+        results.append({
+            'cache_size': size,
+            'exact_query_ms': float(np.mean(exact_ms)),
+            'hnsw_build_ms': build_ms,
+            'hnsw_query_ms': float(np.mean(hnsw_ms)),
+            'hnsw_recall': hits / (queries * min(k, size)),
+        })
+    return results
+
+
+def recommend_exact_search_threshold(results, searches_per_flush=4):
+    """
+    Pick the exact_search_threshold for DynamicCacheIndex from `benchmark_exact_vs_hnsw` results.
+
+    Between two flushes of the cache the graph is rebuilt once and queried `searches_per_flush`
+    times, while the exact path only pays for its queries. The threshold is the first measured
+    cache size at which the graph becomes the cheaper option.
+
+    Args:
+        results (list[dict]): Output of `benchmark_exact_vs_hnsw`.
+        searches_per_flush (int): Memory lookups expected between two flushes. Defaults to 4.
+
+    Returns:
+        int: Recommended threshold.
+    """
+    for row in sorted(results, key=lambda row: row['cache_size']):
+        exact_cost = searches_per_flush * row['exact_query_ms']
+        hnsw_cost = row['hnsw_build_ms'] + searches_per_flush * row['hnsw_query_ms']
+        if hnsw_cost < exact_cost:
+            return row['cache_size']
+    return 2 * max(row['cache_size'] for row in results)
+
+
+def write_exact_search_threshold(threshold, path=HNSW_CONFIG_PATH, **details):
+    """
+    Save a recommended exact_search_threshold where DynamicCacheIndex loads it at construction,
+    next to the HNSW parameters written by hnsw_tuning.py.
+
+    Args:
+        threshold (int): Output of `recommend_exact_search_threshold`.
+        path (str, optional): Config file. Defaults to HNSW_CONFIG_PATH.
+        **details: Extra information recorded with the threshold, e.g. the measured sizes.
+    """
+    update_hnsw_config({
+        'exact_search_threshold': int(threshold),
+        'exact_search_benchmark': {'measured_at': datetime.now().isoformat(), **details},
+    }, path)
+
+
+def perturbed_queries(vectors, n, distances, seed=2):
+    """
+    Generate queries at a given cosine distance from randomly chosen `vectors`, standing in for
+    rephrasings of cached queries.
+
+    Args:
+        vectors (np.ndarray): Unit-norm cached embeddings.
+        n (int): Number of queries.
+        distances (tuple): (low, high) range the cosine distance of every query is drawn from.
+        seed (int, optional): Random seed. Defaults to 2.
+
+    Returns:
+        np.ndarray: Array of shape (n, dim).
+    """
+    rng = np.random.default_rng(seed)
+    base = vectors[rng.integers(0, len(vectors), n)]
+    noise = random_embeddings(n, vectors.shape[1], seed=seed + 1)
+    # Direction orthogonal to the cached vector, mixed in to reach the drawn distance
+    noise -= np.einsum('ij,ij->i', noise, base)[:, None] * base
+    noise /= np.linalg.norm(noise, axis=1, keepdims=True)
+    cosine = 1.0 - rng.uniform(distances[0], distances[1], n)
+    return (cosine[:, None] * base + np.sqrt(1.0 - cosine ** 2)[:, None] * noise).astype(np.float32)
+
+
+def benchmark_quantization(cache_size=4096, dim=1024, queries=200, k=5, storages=STORAGE_TYPES,
+                           max_distance=0.3):
+    """
+    Compare the storage formats of DynamicCacheIndex on the exact search path.
+
+    Half of the queries are perturbations of cached vectors at cosine distances around
+    `max_distance`, the other half are unrelated vectors. A query is a memory hit when its best
+    result is closer than `max_distance`, as in RAGAGENT.check_memory_and_retrieve.
+
+    Args:
+        cache_size (int): Number of cached entries.
+        dim (int): Embedding dimension. Defaults to 1024, as used by RAGAGENT.
+        queries (int): Number of queries.
+        k (int): Neighbours retrieved per query, 5 as in RAGAGENT.
+        storages (tuple): Storage formats to compare, the first one is the reference.
+        max_distance (float): Hit threshold. Defaults to 0.3, RAGAGENT's MAX_DISTANCE.
+
+    Returns:
+        list[dict]: One row per storage format with the bytes held per vector, mean query latency
+        in ms, recall@k against the reference, hit rate, and the fraction of queries whose hit
+        decision and matched entry agree with the reference.
+    """
+    vectors = random_embeddings(cache_size, dim)
+    query_vectors = np.vstack([perturbed_queries(vectors, queries - queries // 2, (0.1, 0.5)),
+                               random_embeddings(queries // 2, dim, seed=4)])
+
+    results, reference = [], None
+    for storage in storages:
+        cache = DynamicCacheIndex(dim=dim, storage=storage, exact_search_threshold=cache_size + 1,
+                                  pq_train_size=min(1024, cache_size))
+        fill_cache(cache, vectors)
+
+        tic = time.perf_counter()
+        found = cache.search_batch(query_vectors, k)
+        query_ms = (time.perf_counter() - tic) * 1000 / len(query_vectors)
+
+        ids = [[chunk_id for chunk_id, _, _ in hits] for hits in found]
+        # Id of the matched entry, or None on a memory miss
+        matches = [hits[0][0] if hits and hits[0][1] < max_distance else None for hits in found]
+        if reference is None:
+            reference = (ids, matches)
+
+        results.append({
+            'storage': storage,
+            'bytes_per_vector': cache.resident_bytes() / cache_size,
+            'query_ms': query_ms,
+            'recall': sum(len(set(a) & set(b)) for a, b in zip(ids, reference[0])) / (len(ids) * k),
+            'hit_rate': sum(match is not None for match in matches) / len(matches),
+            'hit_agreement': sum(a == b for a, b in zip(matches, reference[1])) / len(matches),
+        })
+    return results
+
+
+def print_results(results):
+    print(f"\n{'mode':<12}{'cache size':>12}{'mean ms':>12}{'p50 ms':>12}{'max ms':>12}")
+    for row in results:
+        print(f"{row['mode']:<12}{row['cache_size']:>12}{row['mean_ms']:>12.2f}"
+              f"{row['p50_ms']:>12.2f}{row['max_ms']:>12.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark DynamicCacheIndex flush latency")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 10000, 20000])
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--flushes', type=int, default=10)
+    parser.add_argument('--exact', action='store_true',
+                        help="Compare the exact and HNSW search paths instead of flush latency")
+    parser.add_argument('--storage', action='store_true',
+                        help="Compare the storage formats of the exact search path instead of flush latency")
+    parser.add_argument('--searches-per-flush', type=int, default=4,
+                        help="Memory lookups expected between two flushes, with --exact")
+    parser.add_argument('--output', default=HNSW_CONFIG_PATH, help="Config the threshold is written to, with --exact")
+    parser.add_argument('--dry-run', action='store_true', help="Print the threshold without writing it, with --exact")
+    args = parser.parse_args()
+
+    if args.storage:
+        print(f"\n{'storage':<10}{'cache size':>12}{'bytes/vec':>12}{'query ms':>10}{'recall':>10}"
+              f"{'hit rate':>10}{'agreement':>11}")
+        for size in args.sizes:
+            for row in benchmark_quantization(size, args.dim):
+                print(f"{row['storage']:<10}{size:>12}{row['bytes_per_vector']:>12.1f}{row['query_ms']:>10.3f}"
+                      f"{row['recall']:>10.3f}{row['hit_rate']:>10.3f}{row['hit_agreement']:>11.3f}")
+    elif args.exact:
+        results = benchmark_exact_vs_hnsw(args.sizes, args.dim)
+        print(f"\n{'cache size':>12}{'exact ms':>12}{'build ms':>12}{'hnsw ms':>12}{'recall':>10}")
+        for row in results:
+            print(f"{row['cache_size']:>12}{row['exact_query_ms']:>12.3f}{row['hnsw_build_ms']:>12.2f}"
+                  f"{row['hnsw_query_ms']:>12.3f}{row['hnsw_recall']:>10.3f}")
+        threshold = recommend_exact_search_threshold(results, args.searches_per_flush)
+        print(f"\nRecommended exact_search_threshold: {threshold}")
+        if not args.dry_run:
+            write_exact_search_threshold(threshold, args.output, dim=args.dim, sizes=args.sizes,
+                                         searches_per_flush=args.searches_per_flush)
+            print(f"Threshold written to {args.output}")
+    else:
+        print_results(benchmark_flush_latency(args.sizes, args.dim, args.batch_size, args.flushes))
@@ -0,0 +1,171 @@
+import bisect
+import threading
+import weakref
+from typing import Callable, Dict, Tuple
+
+# Upper bounds of the distance histograms, in cosine distance
+DISTANCE_BUCKETS = (0.05, 0.1, 0.15, 0.2, 0.25, 0.3, 0.4, 0.5, 0.75, 1.0, 2.0)
+
+# Upper bounds of the duration histograms, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        """
+            Distribution of observed values over fixed buckets, as in Prometheus.
+
+            Args:
+                buckets (Tuple[float, ...]): Increasing bucket upper bounds, values above the last
+                                             one fall in an implicit +Inf bucket
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self) -> Dict:
+        """Cumulative bucket counts keyed by upper bound, sum and count."""
+        cumulative, total = {}, 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative['+Inf' if bound == float('inf') else str(bound)] = total
+        return {'buckets': cumulative, 'sum': self.sum, 'count': self.count}
+
+class CacheMetrics:
+    def __init__(self):
+        """
+            Process-wide counters, histograms and gauges of the semantic caches.
+
+            Counters and histograms are identified by a name and keyword labels. Gauges of the
+            registered DynamicCacheIndex instances (entries, bytes, pending additions) and the
+            statistics of registered collectors are read when a snapshot is taken.
+        """
+        self._counters = {}
+        self._histograms = {}
+        self._indexes = weakref.WeakSet()
+        self._collectors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> Tuple:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels) -> None:
+        """
+        Add to a counter.
+
+        Args:
+            name (str): Counter name
+            amount (float, optional): Increment. Defaults to 1.
+            **labels: Label values, e.g. path='retrieve'
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DURATION_BUCKETS, **labels) -> None:
+        """
+        Record a value in a histogram.
+
+        Args:
+            name (str): Histogram name
+            value (float): Observed value
+            buckets (Tuple[float, ...], optional): Bucket bounds, used when the histogram is created.
+                                                   Defaults to DURATION_BUCKETS.
+            **labels: Label values
+        """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def register_index(self, index) -> None:
+        """Report the size of a DynamicCacheIndex, labelled by its `name`, until it is garbage collected."""
+        with self._lock:
+            self._indexes.add(index)
+
+    def register_collector(self, name: str, collector: Callable[[], Dict]) -> None:
+        """
+        Include the statistics returned by `collector` in every snapshot, under `name`.
+
+        Args:
+            name (str): Section of the snapshot
+            collector (Callable[[], Dict]): Returns the current statistics, e.g. EmbeddingCache.get_stats
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def _index_gauges(self) -> Dict:
+        with self._lock:
+            indexes = list(self._indexes)
+        gauges = {}
+        for index in indexes:
+            entry = gauges.setdefault(index.name, {'indexes': 0, 'entries': 0, 'bytes': 0, 'pending': 0})
+            entry['indexes'] += 1
+            entry['entries'] += len(index)
+            entry['bytes'] += index.resident_bytes()
+            entry['pending'] += len(index.pending_additions)
+        return gauges
+
+    def snapshot(self) -> Dict:
+        """
+        Current value of every metric.
+
+        Returns:
+            Dict: 'counters' and 'histograms', each a list of {'name', 'labels', ...} entries,
+                  'indexes' with the gauges of every index name, and one section per collector
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{'name': name, 'labels': dict(labels), **histogram.snapshot()}
+                          for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0])]
+            collectors = dict(self._collectors)
+
+        snapshot = {'counters': counters, 'histograms': histograms, 'indexes': self._index_gauges()}
+        for name, collector in collectors.items():
+            try:
+                snapshot[name] = collector()
+            except Exception as e:
+                snapshot[name] = {'error': str(e)}
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """
+        Counters, histograms and index gauges in the Prometheus text exposition format.
+
+        Returns:
+            str: Exposition text
+        """
+        def labels_text(labels):
+            return '{' + ','.join(f'{key}="{value}"' for key, value in labels.items()) + '}' if labels else ''
+
+        snapshot = self.snapshot()
+        lines = []
+        for counter in snapshot['counters']:
+            lines.append(f"{counter['name']}{labels_text(counter['labels'])} {counter['value']}")
+        for histogram in snapshot['histograms']:
+            for bound, count in histogram['buckets'].items():
+                lines.append(f"{histogram['name']}_bucket{labels_text({**histogram['labels'], 'le': bound})} {count}")
+            lines.append(f"{histogram['name']}_sum{labels_text(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{histogram['name']}_count{labels_text(histogram['labels'])} {histogram['count']}")
+        for name, gauges in snapshot['indexes'].items():
+            for gauge, value in gauges.items():
+                lines.append(f"cache_{gauge}{labels_text({'index': name})} {value}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        """Drop every counter and histogram."""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+# Metrics shared by every cache of the process
+shared_cache_metrics = CacheMetrics()
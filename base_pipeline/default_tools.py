@@ -36,10 +36,11 @@ def rag_agent(query, agent) -> str:
         new_agent = RAGAGENT(llm=llm, embedding_dim=1024, thought_agent_prompt=thought_agent_prompt, reasoning_agent_prompt=reasoning_agent_prompt, max_steps=10, path = agent.path)
         new_agent.engine = RetrieverQueryEngine.from_args(agent.retriever, llm=llm)
         new_agent.retriever = agent.retriever
+        agent.release_memory()
         agent = new_agent
         
     res = agent.run(query ,True)
-    score = chat_llm.invoke(CONFIDENCE_PROMPT.format(steps = agent.agent_input, answer = res)).content
+    score = chat_llm.invoke(CONFIDENCE_PROMPT.format(steps = agent.scratchpad_input('confidence'), answer = res)).content
     if agent.cache_index.process_pending_additions():
       pass
     return str(res) + ", Confidence Score : " + str(score), agent
@@ -1,17 +1,184 @@
 import nmslib
 from typing import List, Dict, Tuple, Optional
 import json
+import hashlib
+import operator
 from tqdm import tqdm
 import numpy as np
 from llama_index.embeddings.jinaai import JinaEmbedding
+from embedding_cache import shared_embedding_cache
+from embedding_quantizer import STORAGE_TYPES, make_quantizer
+from cache_metrics import shared_cache_metrics
 import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# Version of the on-disk layout written by DynamicCacheIndex.save_index
+INDEX_FORMAT_VERSION = 1
+
+# Metadata fields stored as their own string columns, everything else goes into a JSON column
+METADATA_COLUMNS = ('query', 'query_type', 'original_query', 'chunk', 'timestamp')
+
+# Below this many entries an exact NumPy scan beats building and querying an HNSW graph. Used
+# when HNSW_CONFIG_PATH holds no threshold measured by cache_benchmark.py --exact
+DEFAULT_EXACT_SEARCH_THRESHOLD = 4096
+
+# Spaces the exact search path can reproduce distances for
+EXACT_SEARCH_SPACES = ('cosinesimil', 'l2')
+
+# Policies used to pick entries to evict once a bounded cache is over capacity
+EVICTION_POLICIES = ('lru', 'lfu', 'ttl')
+
+# Insert-time deduplication modes: 'hash' merges chunks with the same normalized text,
+# 'near' also merges entries whose embeddings are within a cosine similarity threshold
+DEDUP_MODES = (None, 'hash', 'near')
+
+# Metadata fields copied into the `aliases` of the entry a duplicate is merged into
+ALIAS_FIELDS = ('query', 'query_type', 'original_query', 'timestamp')
+
+# Per-row bookkeeping arrays, kept aligned with the rows of the embedding matrix
+ROW_FIELDS = (('_row_ids', np.int64), ('_tombstoned', bool), ('_inserted_at', np.float64),
+              ('_last_access', np.float64), ('_hit_counts', np.int64), ('_norms', np.float32),
+              ('_code_scales', np.float32))
+
+# Recommended HNSW parameters written by hnsw_tuning.py, and exact search threshold written by
+# cache_benchmark.py, loaded by every DynamicCacheIndex
+HNSW_CONFIG_PATH = os.getenv('HNSW_CONFIG_PATH',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hnsw_config.json'))
+
+# Graph construction parameters used when no tuned config exists
+DEFAULT_INDEX_PARAMS = {'post': 2}
+
+# Metadata fields backed by an inverted index of ids for filtered searches
+DEFAULT_FILTER_FIELDS = ('query_type',)
+
+# Comparisons allowed in range filters on 'timestamp'
+RANGE_OPERATORS = {'gt': operator.gt, 'gte': operator.ge, 'lt': operator.lt, 'lte': operator.le}
+
+# Rows decoded at once by the compressed scan, bounding its temporary float32 memory
+QUANTIZED_SCAN_TILE = 4096
+
+def content_hash(text: str) -> str:
+    """Hash of a chunk text after lowercasing and collapsing whitespace."""
+    return hashlib.sha1(' '.join(str(text).lower().split()).encode('utf-8')).hexdigest()
+
+def load_hnsw_config(path: str = HNSW_CONFIG_PATH) -> Dict:
+    """
+    Read the HNSW parameters recommended by hnsw_tuning.py and the exact search threshold
+    recommended by cache_benchmark.py.
+
+    Args:
+        path (str, optional): Config file. Defaults to HNSW_CONFIG_PATH.
+
+    Returns:
+        Dict: nmslib 'index_params' and 'query_params', and 'exact_search_threshold' if one was
+              measured, empty if there is no usable config
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        loaded = {'index_params': dict(config.get('index_params', {})),
+                  'query_params': dict(config.get('query_params', {}))}
+        if config.get('exact_search_threshold') is not None:
+            loaded['exact_search_threshold'] = int(config['exact_search_threshold'])
+        return loaded
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"Ignoring unreadable HNSW config {path}: {e}")
+        return {}
+
+def update_hnsw_config(updates: Dict, path: str = HNSW_CONFIG_PATH) -> None:
+    """
+    Merge `updates` into the config file, keeping the values written by the other tuning script.
+
+    Args:
+        updates (Dict): Top-level keys to set
+        path (str, optional): Config file. Defaults to HNSW_CONFIG_PATH.
+    """
+    config = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            config = {}
+    config.update(updates)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+class _ReadWriteLock:
+    """Lock shared by any number of readers or held by a single writer. Waiting writers go first."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
 
 class DynamicCacheIndex:
     def __init__(self,
                  dim: int = 768,
                  index_type: str = 'hnsw',
                  space: str = 'cosinesimil',
-                 batch_size: int = 32):
+                 batch_size: int = 32,
+                 index_mode: str = 'rebuild',
+                 max_segments: int = 8,
+                 background_rebuild: bool = False,
+                 initial_capacity: int = 256,
+                 exact_search_threshold: Optional[int] = None,
+                 max_entries: Optional[int] = None,
+                 eviction_policy: str = 'lru',
+                 ttl_seconds: Optional[float] = None,
+                 compaction_ratio: float = 0.25,
+                 dedup_mode: Optional[str] = None,
+                 near_duplicate_threshold: float = 0.98,
+                 background_indexing: bool = False,
+                 indexing_interval: float = 1.0,
+                 search_pending: bool = False,
+                 storage: str = 'float32',
+                 rescore_factor: int = 4,
+                 pq_subspaces: int = 64,
+                 pq_train_size: int = 1024,
+                 filter_fields: Tuple[str, ...] = DEFAULT_FILTER_FIELDS,
+                 prefilter_ratio: float = 0.1,
+                 index_params: Optional[Dict] = None,
+                 query_params: Optional[Dict] = None,
+                 provider_limits=None,
+                 name: str = 'cache'):
         
         """
             Initialize a Dynamic Cache Index for efficient semantic searching and embedding storage.
@@ -23,31 +190,190 @@ class DynamicCacheIndex:
                                         Defaults to 'cosinesimil' (cosine similarity).
                 batch_size (int, optional): Number of embeddings to process in a single batch. 
                                             Defaults to 32.
+                index_mode (str, optional): 'rebuild' recreates the whole graph on every flush,
+                                            'incremental' indexes each flushed batch as a small
+                                            delta graph next to the main one. Defaults to 'rebuild'.
+                max_segments (int, optional): Number of delta graphs tolerated in incremental mode
+                                              before they are consolidated into the main graph.
+                                              Defaults to 8.
+                background_rebuild (bool, optional): Consolidate delta graphs on a background
+                                                     thread instead of during the flush.
+                                                     Defaults to False.
+                initial_capacity (int, optional): Number of embedding rows preallocated before the
+                                                  storage first has to grow. Defaults to 256.
+                exact_search_threshold (int, optional): Caches with fewer entries are searched with an
+                                                        exact vectorized scan and no graph is built for
+                                                        them. Only used for the 'cosinesimil' and 'l2'
+                                                        spaces. Defaults to the measured threshold at
+                                                        HNSW_CONFIG_PATH, or
+                                                        DEFAULT_EXACT_SEARCH_THRESHOLD without one.
+                max_entries (int, optional): Maximum number of live entries. Once a flush takes the
+                                             cache over this size, entries are evicted according to
+                                             `eviction_policy`. Defaults to None (unbounded).
+                eviction_policy (str, optional): 'lru' evicts the least recently hit entries, 'lfu'
+                                                 the least frequently hit ones and 'ttl' the oldest
+                                                 by their `timestamp` metadata. Defaults to 'lru'.
+                ttl_seconds (float, optional): Entries whose `timestamp` is older than this are
+                                               expired regardless of the policy. Defaults to None.
+                compaction_ratio (float, optional): Fraction of tombstoned rows at which the storage
+                                                    and graphs are compacted. Defaults to 0.25.
+                dedup_mode (str, optional): 'hash' attaches a chunk whose normalized text is already
+                                            cached to the existing entry as a query alias instead of
+                                            embedding it again. 'near' additionally merges flushed
+                                            entries into any entry with a cosine similarity of at
+                                            least `near_duplicate_threshold`. Defaults to None.
+                near_duplicate_threshold (float, optional): Cosine similarity above which 'near' mode
+                                                            treats two entries as duplicates.
+                                                            Defaults to 0.98.
+                background_indexing (bool, optional): Embed and index pending additions on a
+                                                      background thread. Searches never flush, they
+                                                      read the last published state. Defaults to False.
+                indexing_interval (float, optional): Seconds the background indexer waits before
+                                                     flushing a batch that is not full yet. Defaults to 1.0.
+                search_pending (bool, optional): Also scan pending entries whose embedding is already
+                                                 known (precomputed or embedded but not yet published)
+                                                 exactly on every search. Defaults to False.
+                storage (str, optional): In-memory format of the vectors scanned by the exact search
+                                         path: 'float32', 'float16', 'int8' (one scale per vector)
+                                         or 'pq' (product quantization). With a compressed format the
+                                         full-precision vectors are kept in a memory-mapped temporary
+                                         file, only read to rescore candidates and build graphs.
+                                         Defaults to 'float32'.
+                rescore_factor (int, optional): With compressed storage, the k * rescore_factor closest
+                                                candidates by approximate distance are rescored
+                                                exactly. Defaults to 4.
+                pq_subspaces (int, optional): Bytes per vector of 'pq' storage, must divide `dim`.
+                                              Defaults to 64.
+                pq_train_size (int, optional): Live entries needed before the 'pq' codebooks are
+                                               trained, smaller caches are scanned at full precision.
+                                               Defaults to 1024.
+                filter_fields (tuple, optional): Metadata fields kept in an inverted index of ids, so
+                                                 that filtering on them does not scan the metadata.
+                                                 Defaults to DEFAULT_FILTER_FIELDS.
+                prefilter_ratio (float, optional): Filtered searches matching at most this fraction of
+                                                   the cache scan the matching entries exactly, less
+                                                   selective ones filter the graph results, fetching
+                                                   more neighbours until k match. Defaults to 0.1.
+                index_params (Dict, optional): nmslib graph construction parameters such as M and
+                                               efConstruction. Defaults to the tuned config at
+                                               HNSW_CONFIG_PATH, or DEFAULT_INDEX_PARAMS without one.
+                query_params (Dict, optional): nmslib query time parameters such as efSearch.
+                                               Defaults to the tuned config at HNSW_CONFIG_PATH, or
+                                               nmslib's defaults without one.
+                provider_limits (ProviderLimits, optional): Caps the concurrent embedding requests, each
+                                                            one holds an 'embedding' slot. Defaults to
+                                                            None (not capped).
+                name (str, optional): Label of the index in the cache metrics, shared by the indexes
+                                      of the same role. Defaults to 'cache'.
 
             Attributes:
                 dim (int): Dimension of embeddings
                 batch_size (int): Batch size for processing embeddings
                 metadata (dict): Storage for metadata associated with embeddings
-                embeddings (list): List of stored embedding vectors
-                id_counter (int): Unique identifier for each embedding
+                embeddings (np.ndarray): Zero-copy float32 view of the stored embedding vectors,
+                                         row i holding the embedding of chunk id i
+                id_counter (int): Unique identifier for each embedding, never reused after eviction
                 index_created (bool): Flag indicating if the index has been created
-                pending_additions (list): Temporary storage for embeddings to be added
+                pending_additions (list): Temporary storage for embeddings (or raw text still to be
+                                          embedded) to be added
                 text_embed_model (object): Embedding model for text conversion
+                segments (list): Delta graphs (graph, first_row, end_row) not yet merged into the main graph
+                tombstones (set): Ids of evicted entries whose rows have not been compacted away yet
+                id_redirects (dict): Ids handed out for entries that were merged into another entry,
+                                     mapped to the id of that entry
+                stats (dict): Search, hit, eviction, expiration and compaction counters
 
             Raises:
-                ValueError: If initialization of the embedding model fails
+                ValueError: If initialization of the embedding model fails, or if the index mode,
+                            eviction policy or storage format is unknown
         """
+        if index_mode not in ('rebuild', 'incremental'):
+            raise ValueError(f"Unknown index mode: {index_mode}")
+        if eviction_policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {eviction_policy}")
+        if dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {dedup_mode}")
+        if dedup_mode == 'near' and space != 'cosinesimil':
+            raise ValueError("Near-duplicate detection requires the 'cosinesimil' space")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown storage type: {storage}")
+        if storage != 'float32' and space not in EXACT_SEARCH_SPACES:
+            raise ValueError(f"Compressed storage requires one of the spaces {EXACT_SEARCH_SPACES}")
+
         self.dim = dim
         self.batch_size = batch_size
+        self.index_type = index_type
+        self.space = space
+        self.index_mode = index_mode
+        self.max_segments = max_segments
+        self.background_rebuild = background_rebuild
+        config = load_hnsw_config() if None in (exact_search_threshold, index_params, query_params) else {}
+        if exact_search_threshold is None:
+            exact_search_threshold = config.get('exact_search_threshold', DEFAULT_EXACT_SEARCH_THRESHOLD)
+        self.exact_search_threshold = exact_search_threshold if space in EXACT_SEARCH_SPACES else 0
+        self.max_entries = max_entries
+        self.eviction_policy = eviction_policy
+        self.ttl_seconds = ttl_seconds
+        self.compaction_ratio = compaction_ratio
+        self.dedup_mode = dedup_mode
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.storage = storage
+        self.rescore_factor = rescore_factor
+        self.pq_subspaces = pq_subspaces
+        self.pq_train_size = pq_train_size
+        self.filter_fields = tuple(filter_fields)
+        self.prefilter_ratio = prefilter_ratio
+        self._field_index = {field: {} for field in self.filter_fields}
+        if index_params is None:
+            index_params = config.get('index_params', DEFAULT_INDEX_PARAMS)
+        if query_params is None:
+            query_params = config.get('query_params', {})
+        self.index_params = dict(index_params)
+        self.query_params = dict(query_params)
+        self.name = name
+        # The 'pq' quantizer is only set once its codebooks are trained
+        self.quantizer = make_quantizer(storage, dim, pq_subspaces)
+        if self.quantizer is not None and not self.quantizer.trained:
+            self.quantizer = None
         self.metadata = {}
-        self.embeddings = []
         self.id_counter = 0
+        self._row_count = 0
+        self._embedding_matrix = self._allocate_matrix(max(initial_capacity, 1))
+        self._codes = self._allocate_codes(max(initial_capacity, 1))
+        for field, dtype in ROW_FIELDS:
+            setattr(self, field, np.zeros(max(initial_capacity, 1), dtype=dtype))
+        self._id_to_row = {}
+        self.tombstones = set()
+        self._hash_to_id = {}
+        self.id_redirects = {}
+        self.stats = {'searches': 0, 'hits': 0, 'evictions': 0, 'expirations': 0, 'compactions': 0,
+                      'duplicates': 0}
         self.index_created = False
         self.pending_additions = []
         self.text_embed_model = None
+        self.provider_limits = provider_limits
 
         # Initializing the HNSW index
         self.index = nmslib.init(method=index_type, space=space)
+        self.indexed_upto = 0
+        self.segments = []
+        self._rebuild_thread = None
+
+        # Searches hold the read side of `_state_lock`, publishing new rows or graphs the write side.
+        # Flushes are serialized by `_flush_lock` and the queue itself is guarded by `_pending_lock`.
+        self._state_lock = _ReadWriteLock()
+        self._flush_lock = threading.RLock()
+        self._pending_lock = threading.RLock()
+        # Hit counts, access times and `stats` are updated by concurrent searches, under the read
+        # side of `_state_lock` plus this lock. It is taken last and nothing is acquired under it.
+        self._counter_lock = threading.Lock()
+        self._staged = []
+        self.background_indexing = background_indexing
+        self.indexing_interval = indexing_interval
+        self.search_pending = search_pending
+        self._indexing_event = threading.Event()
+        self._stop_indexing = threading.Event()
+        self._indexer_thread = None
 
         # Initializing the embedding model
         if not self.text_embed_model:
@@ -56,6 +382,97 @@ class DynamicCacheIndex:
           except Exception as e:
               print("Failed to initialize embedding model during retry: ", e)
 
+        shared_cache_metrics.register_index(self)
+        if background_indexing:
+            self.start_background_indexing()
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """Stored embeddings as a (num_rows, dim) float32 view of the preallocated matrix."""
+        return self._embedding_matrix[:self._row_count]
+
+    def __len__(self) -> int:
+        """Number of live (flushed and not evicted) entries."""
+        return self._row_count - len(self.tombstones)
+
+    def _reserve(self, rows: int) -> None:
+        """Make room for `rows` more embeddings, doubling the matrix capacity when it is full."""
+        needed = self._row_count + rows
+        capacity = self._embedding_matrix.shape[0]
+        if needed <= capacity:
+            return
+
+        capacity = max(needed, 2 * capacity)
+        grown = self._allocate_matrix(capacity)
+        grown[:self._row_count] = self._embedding_matrix[:self._row_count]
+        self._embedding_matrix = grown
+        if self._codes is not None:
+            codes = self._allocate_codes(capacity)
+            codes[:self._row_count] = self._codes[:self._row_count]
+            self._codes = codes
+        for field, dtype in ROW_FIELDS:
+            column = np.zeros(capacity, dtype=dtype)
+            column[:self._row_count] = getattr(self, field)[:self._row_count]
+            setattr(self, field, column)
+
+    def _allocate_matrix(self, capacity: int) -> np.ndarray:
+        """Uninitialized storage for `capacity` full-precision embeddings."""
+        if self.storage == 'float32':
+            return np.empty((capacity, self.dim), dtype=np.float32)
+        # With compressed storage the full-precision vectors are only read back to rescore
+        # candidates and build graphs, so they live in an anonymous file instead of in memory
+        return np.memmap(tempfile.TemporaryFile(), dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+
+    def _allocate_codes(self, capacity: int) -> Optional[np.ndarray]:
+        """Storage for `capacity` compressed vectors, None for 'float32' storage."""
+        if self.storage == 'float32':
+            return None
+        quantizer = self.quantizer or make_quantizer(self.storage, self.dim, self.pq_subspaces)
+        return np.zeros((capacity, quantizer.code_width), dtype=quantizer.code_dtype)
+
+    def _encode_rows(self, quantizer, matrix: np.ndarray, count: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Compress the first `count` rows of `matrix` tile by tile."""
+        codes = np.zeros((max(count, 1), quantizer.code_width), dtype=quantizer.code_dtype)
+        scales = np.ones(max(count, 1), dtype=np.float32)
+        for start in range(0, count, QUANTIZED_SCAN_TILE):
+            end = min(start + QUANTIZED_SCAN_TILE, count)
+            codes[start:end], scales[start:end] = quantizer.encode(matrix[start:end])
+        return codes, scales
+
+    def _train_quantizer(self, matrix: np.ndarray, live_rows: np.ndarray):
+        """
+        Quantizer for `storage`, trained on a sample of `live_rows` of `matrix` if it needs training.
+
+        Returns:
+            Optional[object]: The quantizer, or None if the rows are too few to train it
+        """
+        quantizer = make_quantizer(self.storage, self.dim, self.pq_subspaces)
+        if quantizer is None or quantizer.trained:
+            return quantizer
+        if len(live_rows) < self.pq_train_size:
+            return None
+        sample = np.sort(np.random.default_rng(0).choice(live_rows, min(len(live_rows), 4 * self.pq_train_size),
+                                                         replace=False))
+        quantizer.fit(np.asarray(matrix[sample], dtype=np.float32))
+        return quantizer
+
+    def _maybe_train_quantizer(self) -> None:
+        """Train the 'pq' codebooks once the cache holds `pq_train_size` live entries and encode every row."""
+        if self.storage == 'float32' or self.quantizer is not None:
+            return
+        quantizer = self._train_quantizer(self._embedding_matrix,
+                                          np.flatnonzero(~self._tombstoned[:self._row_count]))
+        if quantizer is None:
+            return
+
+        print("Training product quantizer...")
+        count = self._row_count
+        codes, scales = self._encode_rows(quantizer, self._embedding_matrix, count)
+        with self._state_lock.write():
+            self._codes[:count] = codes[:count]
+            self._code_scales[:count] = scales[:count]
+            self.quantizer = quantizer
+
     def _init_embedding_model(self) -> None:
         """Initialize the embedding model with error handling"""
         try:
@@ -66,6 +483,7 @@ class DynamicCacheIndex:
             self.text_embed_model = JinaEmbedding(
                 api_key=jina_api_key,
                 model="jina-embeddings-v3",
+                embed_batch_size=max(self.batch_size, 10),
             )
         except Exception as e:
             print(f"Failed to initialize embedding model: {e}")
@@ -75,6 +493,11 @@ class DynamicCacheIndex:
         """
         Process and add pending embeddings to the HNSW index in batches.
 
+        Pending raw text chunks are embedded first with a single batched embedding request.
+        In 'near' dedup mode, entries close enough to a cached or earlier pending entry are then
+        merged into it as query aliases. The new rows are published to searches before any graph
+        work starts, see `_maintain_index` for how they are indexed.
+
         Args:
             force (bool, optional): Force processing even if batch is not full. 
                                     Defaults to False.
@@ -89,64 +512,690 @@ class DynamicCacheIndex:
             return False
 
         try:
-            batches = [self.pending_additions[i:i + self.batch_size]
-                      for i in range(0, len(self.pending_additions), self.batch_size)]
+            with self._flush_lock:
+                started = time.perf_counter()
+                with self._pending_lock:
+                    taken = list(self.pending_additions)
+                    first_id = self.id_counter
+
+                if taken:
+                    # Every pending entry keeps the id `_enqueue` promised for it
+                    pending = [(first_id + i, embedding, metadata)
+                               for i, (embedding, metadata) in enumerate(self._embed_pending(taken))]
+                    self._staged = pending
+                    if self.dedup_mode == 'near':
+                        pending = self._merge_near_duplicates(pending)
+                    self._publish(pending, len(taken))
+                    self._staged = []
+
+                self._maintain_index()
+                if taken:
+                    shared_cache_metrics.observe('cache_flush_seconds', time.perf_counter() - started,
+                                                 index=self.name)
+            return True
+
+        except Exception as e:
+            self._staged = []
+            print(f"Error processing pending additions: {e}")
+            return False
+
+    def _publish(self, pending: List[Tuple[int, np.ndarray, Dict]], taken: int) -> None:
+        """
+        Store embedded entries and make them visible to searches, removing the first `taken`
+        entries from the queue.
+
+        Rows past `_row_count` are invisible to searches, so they are filled without holding the
+        state lock, which is only taken to grow the storage and to publish the new row count.
+        """
+        with self._state_lock.write():
+            self._reserve(len(pending))
+
+        batches = [pending[i:i + self.batch_size]
+                  for i in range(0, len(pending), self.batch_size)]
+
+        first_row = self._row_count
+        row = first_row
+        now = time.time()
+        with tqdm(total=len(batches), desc="Processing batches") as pbar:
+            for batch in batches:
+                rows = np.arange(row, row + len(batch))
+                matrix = np.vstack([embedding for _, embedding, _ in batch]).astype(np.float32)
+                self._embedding_matrix[rows] = matrix
+                self._norms[rows] = np.linalg.norm(matrix, axis=1)
+                if self.quantizer is not None:
+                    self._codes[rows], self._code_scales[rows] = self.quantizer.encode(matrix)
+                self._row_ids[rows] = [chunk_id for chunk_id, _, _ in batch]
+                self._tombstoned[rows] = False
+                self._inserted_at[rows] = [self._timestamp_of(metadata, now) for _, _, metadata in batch]
+                self._last_access[rows] = now
+                self._hit_counts[rows] = 0
+                row += len(batch)
+                pbar.update(1)
+
+        with self._state_lock.write(), self._pending_lock:
+            for offset, (chunk_id, _, metadata) in enumerate(pending):
+                self.metadata[chunk_id] = metadata
+                self._id_to_row[chunk_id] = first_row + offset
+                self._index_fields(chunk_id, metadata)
+            self._row_count = row
+            self.id_counter += taken
+            del self.pending_additions[:taken]
+
+    def _maintain_index(self) -> None:
+        """
+        Evict, compact and index after new rows were published.
+
+        While the cache is smaller than `exact_search_threshold` no graph is built at all.
+        In 'rebuild' mode the whole graph is recreated over every row.
+        In 'incremental' mode only the rows not indexed yet are, as a delta graph that is
+        searched alongside the main graph until the next consolidation.
+        New graphs are built without holding the state lock and swapped in when ready; until
+        then, rows no graph covers yet are searched exactly.
+        """
+        self._maybe_train_quantizer()
+        self.evict()
+        if self.tombstones and len(self.tombstones) >= self.compaction_ratio * self._row_count:
+            # Compaction rebuilds whatever graph the cache needs
+            self.compact()
+            return
+
+        if self._row_count < self.exact_search_threshold:
+            # Small caches are searched exactly, the graph is built once they outgrow the threshold
+            return
+
+        if self.index_mode == 'incremental':
+            self._add_segment(self._indexed_end(), self._row_count)
+        elif not self.index_created or self._indexed_end() < self._row_count:
+            print("Creating index...")
+            self.rebuild_index()
+        print("Index updated successfully")
 
-            with tqdm(total=len(batches), desc="Processing batches") as pbar:
-                for batch in batches:
-                    for embedding, metadata in batch:
-                        if not isinstance(embedding, np.ndarray):
-                            embedding = np.array(embedding)
+    def _indexed_end(self) -> int:
+        """First row not covered by the main graph or a delta graph."""
+        return self.segments[-1][2] if self.segments else self.indexed_upto
 
-                        if embedding.shape[0] != self.dim:
-                            raise ValueError(f"Embedding dimension mismatch. Expected {self.dim}, got {embedding.shape[0]}")
+    def _embed_pending(self, pending: List[Tuple]) -> List[Tuple[np.ndarray, Dict]]:
+        """
+        Embed the raw text entries of `pending` in one batched request and validate every vector.
 
-                        self.index.addDataPoint(self.id_counter, embedding)
-                        self.metadata[self.id_counter] = metadata
-                        self.embeddings.append(embedding)
-                        self.id_counter += 1
-                    pbar.update(1)
+        Nothing is modified, so a failed request leaves the queue (and the ids promised to callers) intact.
+        """
+        texts = [item for item, _ in pending if isinstance(item, str)]
+        if texts:
+            if not self.text_embed_model:
+                self._init_embedding_model()
+            with self._embedding_call():
+                text_embeddings = iter(self.text_embed_model.get_text_embedding_batch(texts))
 
-            # Clear pending additions
-            self.pending_additions = []
+        embedded = []
+        for item, metadata in pending:
+            embedding = next(text_embeddings) if isinstance(item, str) else item
+            embedding = np.asarray(embedding, dtype=np.float32)
 
-            # Recreate index with progress tracking
-            print("Creating index...")
-            self.index.createIndex(
-                {'post': 2},
-                print_progress=True
-            )
-            self.index_created = True
-            print("Index updated successfully")
-            return True
+            if embedding.shape[0] != self.dim:
+                raise ValueError(f"Embedding dimension mismatch. Expected {self.dim}, got {embedding.shape[0]}")
 
-        except Exception as e:
-            print(f"Error processing pending additions: {e}")
+            embedded.append((embedding, metadata))
+        return embedded
+
+    def _embedding_call(self):
+        """Context holding an 'embedding' slot of `provider_limits`, if any, for one embedding request."""
+        return self.provider_limits.acquire('embedding') if self.provider_limits is not None else nullcontext()
+
+    def _merge_near_duplicates(self, pending: List[Tuple[int, np.ndarray, Dict]]) -> List[Tuple[int, np.ndarray, Dict]]:
+        """
+        Merge embedded pending entries into cached or earlier pending entries with a cosine
+        similarity of at least `near_duplicate_threshold`, returning the entries still to be stored.
+        """
+        if not pending:
+            return pending
+
+        matrix = np.vstack([embedding for _, embedding, _ in pending])
+        max_distance = 1.0 - self.near_duplicate_threshold
+
+        cached = [(None, float('inf'))] * len(pending)
+        if len(self) > 0:
+            with self._state_lock.read():
+                cached = [(ids[0] if ids else None, distances[0] if ids else float('inf'))
+                          for ids, distances in self._nearest_batch(matrix, 1)]
+
+        normalized = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+        similarities = normalized @ normalized.T
+
+        pending_metadata = {chunk_id: metadata for chunk_id, _, metadata in pending}
+        kept = []
+        for i, (chunk_id, _, metadata) in enumerate(pending):
+            target = cached[i][0] if cached[i][1] <= max_distance else None
+            if target is None:
+                target = next((pending[j][0] for j in kept
+                               if similarities[i, j] >= self.near_duplicate_threshold), None)
+            if target is None:
+                kept.append(i)
+                continue
+
+            target_metadata = self.metadata[target] if target in self.metadata else pending_metadata[target]
+            self._add_alias(target_metadata, metadata, target)
+            self.id_redirects[chunk_id] = target
+            self._count('duplicates')
+
+        return [pending[i] for i in kept]
+
+    def _add_alias(self, target_metadata: Dict, metadata: Dict, target_id: Optional[int] = None) -> None:
+        """Record the query of a duplicate entry in the `aliases` of the entry it is merged into."""
+        alias = {field: metadata[field] for field in ALIAS_FIELDS if field in metadata}
+        if not alias or alias.get('query') == target_metadata.get('query'):
+            return
+        aliases = target_metadata.setdefault('aliases', [])
+        if alias.get('query') not in [existing.get('query') for existing in aliases]:
+            aliases.append(alias)
+            # Pending entries are indexed with their aliases once published
+            if target_id in self.metadata:
+                self._index_fields(target_id, {'aliases': [alias]})
+
+    def _index_fields(self, chunk_id: int, metadata: Dict) -> None:
+        """Add an entry to the inverted index of every filter field, under its own and its aliases' values."""
+        for field, values in self._field_index.items():
+            for entry in [metadata] + metadata.get('aliases', []):
+                value = entry.get(field)
+                if isinstance(value, (str, int, float, bool)):
+                    values.setdefault(value, set()).add(chunk_id)
+
+    def _unindex_fields(self, chunk_id: int, metadata: Dict) -> None:
+        """Remove an entry from the inverted indexes."""
+        for field, values in self._field_index.items():
+            for entry in [metadata] + metadata.get('aliases', []):
+                ids = values.get(entry.get(field)) if isinstance(entry.get(field), (str, int, float, bool)) else None
+                if ids is not None:
+                    ids.discard(chunk_id)
+                    if not ids:
+                        del values[entry.get(field)]
+
+    @staticmethod
+    def _to_epoch(value) -> float:
+        """Epoch seconds of a datetime, ISO 8601 string or number."""
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if isinstance(value, str):
+            return datetime.fromisoformat(value).timestamp()
+        return float(value)
+
+    @staticmethod
+    def _filter_values(condition) -> List:
+        """Values an equality filter accepts."""
+        return list(condition) if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+
+    def _matches(self, metadata: Dict, filters: Dict) -> bool:
+        """Whether an entry satisfies `filters`, checked on its metadata (used for pending entries)."""
+        for field, condition in filters.items():
+            if isinstance(condition, dict):
+                timestamp = self._timestamp_of(metadata, time.time())
+                if not all(RANGE_OPERATORS[op](timestamp, self._to_epoch(bound)) for op, bound in condition.items()):
+                    return False
+            else:
+                values = self._filter_values(condition)
+                if not any(entry.get(field) in values for entry in [metadata] + metadata.get('aliases', [])):
+                    return False
+        return True
+
+    def _matching_ids(self, filters: Dict) -> set:
+        """
+        Ids of the live entries satisfying `filters`. Equality filters on `filter_fields` are answered
+        by the inverted indexes, 'timestamp' ranges by the insertion times and any other field by
+        scanning the metadata.
+
+        Raises:
+            ValueError: If a range filter targets another field than 'timestamp' or uses an unknown operator
+        """
+        allowed = None
+        for field, condition in filters.items():
+            if isinstance(condition, dict):
+                if field != 'timestamp':
+                    raise ValueError(f"Range filters are only supported on 'timestamp', got '{field}'")
+                unknown = set(condition) - set(RANGE_OPERATORS)
+                if unknown:
+                    raise ValueError(f"Unknown range operators: {sorted(unknown)}")
+                mask = ~self._tombstoned[:self._row_count]
+                for op, bound in condition.items():
+                    mask &= RANGE_OPERATORS[op](self._inserted_at[:self._row_count], self._to_epoch(bound))
+                ids = set(self._row_ids[:self._row_count][mask].tolist())
+            elif field in self._field_index:
+                index = self._field_index[field]
+                ids = set().union(*(index.get(value, ()) for value in self._filter_values(condition)))
+            else:
+                ids = {chunk_id for chunk_id, metadata in self.metadata.items()
+                       if self._matches(metadata, {field: condition})}
+
+            allowed = ids if allowed is None else allowed & ids
+            if not allowed:
+                break
+        return allowed or set()
+
+    def _entry_metadata(self, chunk_id: Optional[int]) -> Optional[Dict]:
+        """Metadata of a live or still pending entry, or None if there is no such entry."""
+        if chunk_id is None:
+            return None
+        if chunk_id in self.metadata:
+            return self.metadata[chunk_id]
+        position = chunk_id - self.id_counter
+        if 0 <= position < len(self.pending_additions):
+            return self.pending_additions[position][1]
+        return None
+
+    def _resolve(self, chunk_id: int) -> int:
+        """Id of the entry `chunk_id` was merged into, or `chunk_id` itself."""
+        return self.id_redirects.get(int(chunk_id), int(chunk_id))
+
+    @staticmethod
+    def _timestamp_of(metadata: Dict, default: float) -> float:
+        """Epoch seconds of the `timestamp` metadata of an entry, or `default` if it has none."""
+        try:
+            return datetime.fromisoformat(str(metadata['timestamp'])).timestamp()
+        except (KeyError, ValueError):
+            return default
+
+    def _build_graph(self, first_row: int, end_row: int):
+        """Build a standalone HNSW graph over the stored embeddings in rows [first_row, end_row)."""
+        return self._new_graph(self.embeddings[first_row:end_row], self._row_ids[first_row:end_row])
+
+    def _new_graph(self, matrix: np.ndarray, ids: np.ndarray):
+        """Build an HNSW graph over `matrix` labelled by `ids`, with the configured parameters."""
+        graph = nmslib.init(method=self.index_type, space=self.space)
+        graph.addDataPointBatch(matrix, ids)
+        graph.createIndex(self.index_params)
+        if self.query_params:
+            graph.setQueryTimeParams(self.query_params)
+        return graph
+
+    def _add_segment(self, first_row: int, end_row: int) -> None:
+        """
+        Index the embeddings in rows [first_row, end_row) without touching the main graph.
+
+        The first flush builds the main graph itself. Later flushes add a delta graph, and once
+        more than `max_segments` deltas exist they are consolidated by `rebuild_index`.
+        """
+        if end_row <= first_row:
+            return
+
+        if not self.index_created:
+            graph = self._build_graph(0, end_row)
+            with self._state_lock.write():
+                self.index = graph
+                self.indexed_upto = end_row
+                self.index_created = True
+            return
+
+        graph = self._build_graph(first_row, end_row)
+        with self._state_lock.write():
+            self.segments.append((graph, first_row, end_row))
+            degraded = len(self.segments) > self.max_segments
+
+        if degraded:
+            self.rebuild_index(background=self.background_rebuild)
+
+    def rebuild_index(self, background: bool = False) -> None:
+        """
+        Consolidate the main graph and all delta graphs into a single freshly built graph.
+
+        Args:
+            background (bool, optional): Build the new graph on a background thread. Searches keep
+                                         using the current graphs until the new one is swapped in.
+                                         Defaults to False.
+        """
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            if background:
+                return
+            self._rebuild_thread.join()
+
+        if len(self.embeddings) == 0:
+            return
+
+        def _rebuild():
+            while True:
+                started = time.perf_counter()
+                end_row = len(self.embeddings)
+                graph = self._build_graph(0, end_row)
+                shared_cache_metrics.observe('cache_rebuild_seconds', time.perf_counter() - started,
+                                             index=self.name)
+                with self._state_lock.write():
+                    self.index = graph
+                    self.indexed_upto = end_row
+                    self.segments = [segment for segment in self.segments if segment[1] >= end_row]
+                    self.index_created = True
+                    degraded = len(self.segments) > self.max_segments
+                # Flushes that happened while building may already have degraded the new graph
+                if not (background and degraded):
+                    break
+
+        if background:
+            self._rebuild_thread = threading.Thread(target=_rebuild, daemon=True)
+            self._rebuild_thread.start()
+        else:
+            _rebuild()
+
+    def _knn(self, query_vector: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """
+        Query the main graph and every delta graph, returning the merged top-k ids and distances.
+        """
+        return self._knn_batch(np.asarray(query_vector, dtype=np.float32)[None, :], k, num_threads=1)[0]
+
+    def _knn_batch(self, query_matrix: np.ndarray, k: int,
+                   num_threads: int = 4) -> List[Tuple[List[int], List[float]]]:
+        """
+        Batched `_knn`, using nmslib's threaded batch query on every graph.
+
+        Tombstoned entries stay in the graphs until compaction, so every graph is asked for
+        enough extra neighbours to still return k live ones. Published rows that no graph covers
+        yet are scanned exactly. Callers hold the read side of the state lock.
+        """
+        graphs = [(self.index, self.indexed_upto)]
+        graphs += [(graph, end_row - first_row) for graph, first_row, end_row in self.segments]
+        tombstones = set(self.tombstones)
+
+        candidates = [([], []) for _ in range(len(query_matrix))]
+        for graph, size in graphs:
+            if size == 0:
+                continue
+            graph_k = min(k + len(tombstones), size)
+            graph_results = graph.knnQueryBatch(query_matrix, k=graph_k, num_threads=num_threads)
+            for (ids, distances), (graph_ids, graph_distances) in zip(candidates, graph_results):
+                for chunk_id, distance in zip(graph_ids, graph_distances):
+                    if int(chunk_id) not in tombstones:
+                        ids.append(int(chunk_id))
+                        distances.append(float(distance))
+
+        unindexed_rows = np.arange(self._indexed_end(), self._row_count)
+        unindexed = ([([], [])] * len(query_matrix) if not len(unindexed_rows)
+                     else self._exact_knn_batch(query_matrix, k, unindexed_rows))
+        return self._merge_results(candidates, unindexed, k)
+
+    @staticmethod
+    def _merge_results(results: List[Tuple[List[int], List[float]]],
+                       other: List[Tuple[List[int], List[float]]], k: int) -> List[Tuple[List[int], List[float]]]:
+        """Merge two per-query (ids, distances) result lists, keeping the k closest of each query."""
+        merged = []
+        for (ids, distances), (other_ids, other_distances) in zip(results, other):
+            ids, distances = list(ids) + list(other_ids), list(distances) + list(other_distances)
+            order = np.argsort(distances, kind='stable')[:k]
+            merged.append(([ids[i] for i in order], [distances[i] for i in order]))
+        return merged
+
+    def _enqueue(self, item, metadata: Dict, flush: bool = False) -> int:
+        """
+        Queue an embedding or raw text chunk and return the id it will be stored under.
+
+        Queued entries are assigned consecutive ids in order, so the returned id stays valid
+        once the entry is flushed into the index. An entry merged into another one at flush
+        time ('near' dedup mode) is reachable through `id_redirects`.
+        """
+        with self._pending_lock:
+            chunk_id = self.id_counter + len(self.pending_additions)
+            self.pending_additions.append((item, metadata))
+
+        self._schedule_flush(flush)
+        return chunk_id
+
+    def _schedule_flush(self, flush: bool = False) -> None:
+        """Process the pending additions once a batch is full, or right away if `flush` is set."""
+        if not (flush or len(self.pending_additions) >= self.batch_size):
+            return
+        if self.background_indexing:
+            self._indexing_event.set()
+        else:
+            self.process_pending_additions()
+
+    def start_background_indexing(self) -> None:
+        """
+        Start the background indexer thread. It flushes the pending additions whenever a batch is
+        full, or `indexing_interval` seconds after the last flush, and publishes the new rows and
+        graphs while searches keep reading the previous state.
+        """
+        self.background_indexing = True
+        if self._indexer_thread is not None and self._indexer_thread.is_alive():
+            return
+        self._stop_indexing.clear()
+        self._indexer_thread = threading.Thread(target=self._indexing_loop, daemon=True)
+        self._indexer_thread.start()
+
+    def stop_background_indexing(self, flush: bool = True) -> None:
+        """
+        Stop the background indexer thread and return to flushing on the caller's thread.
+
+        Args:
+            flush (bool, optional): Process the remaining pending additions before returning.
+                                    Defaults to True.
+        """
+        self._stop_indexing.set()
+        self._indexing_event.set()
+        if self._indexer_thread is not None:
+            self._indexer_thread.join()
+            self._indexer_thread = None
+        self.background_indexing = False
+        if flush and self.pending_additions:
+            self.process_pending_additions(force=True)
+
+    def wait_until_indexed(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the background indexer has published every pending addition.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if nothing is pending anymore, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending_additions:
+            if not self.background_indexing:
+                return self.process_pending_additions(force=True)
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._indexing_event.set()
+            time.sleep(0.01)
+        # The indexer may still be evicting or building graphs for the last batch
+        if not self._flush_lock.acquire(timeout=-1 if deadline is None else max(deadline - time.monotonic(), 0)):
             return False
+        self._flush_lock.release()
+        return True
+
+    def _indexing_loop(self) -> None:
+        while not self._stop_indexing.is_set():
+            self._indexing_event.wait(self.indexing_interval)
+            self._indexing_event.clear()
+            if self.pending_additions and not self._stop_indexing.is_set():
+                # Failures are reported by process_pending_additions, the batch is retried later
+                self.process_pending_additions(force=True)
+
+    def _exact_knn_batch(self, query_matrix: np.ndarray, k: int,
+                         rows: Optional[np.ndarray] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Exact k-nearest neighbours of every query row over all live embeddings (or the live ones
+        among `rows`), with the same distances nmslib reports.
+        """
+        if self.quantizer is not None:
+            return self._quantized_knn_batch(query_matrix, k, rows)
+
+        if rows is not None:
+            rows = rows[~self._tombstoned[rows]]
+        elif self.tombstones:
+            rows = np.flatnonzero(~self._tombstoned[:self._row_count])
+
+        if rows is None:
+            return self._exact_knn(query_matrix, self.embeddings, self._row_ids[:self._row_count], k)
+        return self._exact_knn(query_matrix, self._embedding_matrix[rows], self._row_ids[rows], k)
+
+    def _exact_knn(self, query_matrix: np.ndarray, matrix: np.ndarray, ids: np.ndarray,
+                   k: int) -> List[Tuple[List[int], List[float]]]:
+        """Exact k-nearest neighbours of every query row among the rows of `matrix`, labelled by `ids`."""
+        if matrix.shape[0] == 0:
+            return [([], []) for _ in range(len(query_matrix))]
+
+        distances = self._distances(query_matrix, query_matrix @ matrix.T, np.linalg.norm(matrix, axis=1))
+        top, top_distances = self._top_k(distances, k)
+        return [([int(i) for i in ids[row_top]], [float(d) for d in row_distances])
+                for row_top, row_distances in zip(top, top_distances)]
+
+    def _quantized_knn_batch(self, query_matrix: np.ndarray, k: int,
+                             rows: Optional[np.ndarray] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        `_exact_knn_batch` over the compressed vectors: the k * rescore_factor closest candidates by
+        approximate distance are rescored with their full-precision vectors, so returned distances
+        are exact and only the candidate set is approximate.
+        """
+        if rows is None:
+            rows = np.flatnonzero(~self._tombstoned[:self._row_count])
+        else:
+            rows = rows[~self._tombstoned[rows]]
+        if len(rows) == 0:
+            return [([], []) for _ in range(len(query_matrix))]
+
+        products = np.hstack([self.quantizer.inner_products(query_matrix, self._codes[tile], self._code_scales[tile])
+                              for tile in (rows[start:start + QUANTIZED_SCAN_TILE]
+                                           for start in range(0, len(rows), QUANTIZED_SCAN_TILE))])
+        candidates, _ = self._top_k(self._distances(query_matrix, products, self._norms[rows]),
+                                    k * self.rescore_factor)
+
+        results = []
+        for query_vector, query_candidates in zip(query_matrix, candidates):
+            candidate_rows = np.sort(rows[query_candidates])
+            results += self._exact_knn(query_vector[None, :], self._embedding_matrix[candidate_rows],
+                                       self._row_ids[candidate_rows], k)
+        return results
+
+    def _distances(self, query_matrix: np.ndarray, products: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """nmslib distances of every query to every row, from their inner `products` and the row `norms`."""
+        query_norms = np.linalg.norm(query_matrix, axis=1)
+        if self.space == 'cosinesimil':
+            return 1.0 - products / np.maximum(np.outer(query_norms, norms), np.finfo(np.float32).tiny)
+        # nmslib's 'l2' space reports squared euclidean distances
+        return np.maximum(query_norms[:, None] ** 2 + norms[None, :] ** 2 - 2.0 * products, 0.0)
+
+    @staticmethod
+    def _top_k(distances: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Columns of the k smallest distances of every row and those distances, closest first."""
+        k = min(k, distances.shape[1])
+        if k < distances.shape[1]:
+            top = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(distances.shape[1]), (len(distances), 1))
+        top_distances = np.take_along_axis(distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_distances, order, axis=1)
+
+    def _pending_knn_batch(self, query_matrix: np.ndarray, k: int,
+                           filters: Optional[Dict] = None) -> List[Tuple[List[int], List[float]]]:
+        """
+        Exact k-nearest neighbours among pending entries whose embedding is already known: the
+        batch the indexer is publishing and precomputed embeddings still in the queue.
+        """
+        with self._pending_lock:
+            staged = list(self._staged)
+            staged_ids = {chunk_id for chunk_id, _, _ in staged}
+            entries = [(chunk_id, embedding, metadata) for chunk_id, embedding, metadata in staged]
+            entries += [(self.id_counter + position, item, metadata)
+                        for position, (item, metadata) in enumerate(self.pending_additions)
+                        if not isinstance(item, str) and self.id_counter + position not in staged_ids]
+        entries = [(chunk_id, embedding) for chunk_id, embedding, metadata in entries
+                   if not filters or self._matches(metadata, filters)]
+
+        if not entries:
+            return [([], []) for _ in range(len(query_matrix))]
+        ids = np.array([chunk_id for chunk_id, _ in entries], dtype=np.int64)
+        matrix = np.vstack([embedding for _, embedding in entries]).astype(np.float32)
+        return self._exact_knn(query_matrix, matrix, ids, k)
+
+    def _nearest(self, query_vector: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        """Route a k-NN query to the exact scan for small caches and to the HNSW graphs otherwise."""
+        return self._nearest_batch(np.asarray(query_vector, dtype=np.float32)[None, :], k, num_threads=1)[0]
+
+    def _nearest_batch(self, query_matrix: np.ndarray, k: int, num_threads: int = 4,
+                       include_pending: bool = False,
+                       filters: Optional[Dict] = None) -> List[Tuple[List[int], List[float]]]:
+        """Batched `_nearest`, optionally restricted to entries matching `filters` and also scanning pending entries exactly."""
+        exact = not self.index_created or self._row_count < self.exact_search_threshold
+        if filters:
+            results = self._filtered_knn_batch(query_matrix, k, num_threads, filters, exact)
+        elif exact:
+            results = self._exact_knn_batch(query_matrix, k)
+        else:
+            results = self._knn_batch(query_matrix, k, num_threads)
+        if include_pending:
+            results = self._merge_results(results, self._pending_knn_batch(query_matrix, k, filters), k)
+        return results
+
+    def _filtered_knn_batch(self, query_matrix: np.ndarray, k: int, num_threads: int, filters: Dict,
+                            exact: bool) -> List[Tuple[List[int], List[float]]]:
+        """
+        k-nearest neighbours among the entries matching `filters`.
+
+        Selective filters, and every filter on caches searched exactly, pre-filter: only the
+        matching rows are scanned. Otherwise the graph results are post-filtered, fetching twice
+        as many neighbours as the filter's selectivity suggests and doubling until k match.
+        """
+        allowed = self._matching_ids(filters)
+        if not allowed:
+            return [([], []) for _ in range(len(query_matrix))]
+
+        if exact or len(allowed) <= self.prefilter_ratio * len(self):
+            rows = np.sort(np.fromiter((self._id_to_row[chunk_id] for chunk_id in allowed),
+                                       dtype=np.int64, count=len(allowed)))
+            return self._exact_knn_batch(query_matrix, k, rows)
+
+        wanted = min(k, len(allowed))
+        fetch = min(len(self), 2 * int(np.ceil(k * len(self) / len(allowed))))
+        while True:
+            results = []
+            for ids, distances in self._knn_batch(query_matrix, fetch, num_threads):
+                kept = [i for i, chunk_id in enumerate(ids) if chunk_id in allowed][:k]
+                results.append(([ids[i] for i in kept], [distances[i] for i in kept]))
+            if fetch >= len(self) or all(len(ids) >= wanted for ids, _ in results):
+                return results
+            fetch = min(len(self), 2 * fetch)
+
+    def add_embedding(self, embedding, metadata: Dict = None, flush: bool = False) -> Optional[int]:
+        """
+        Queue a precomputed embedding for insertion into the index.
+
+        Args:
+            embedding (list or np.ndarray): Embedding vector of size `dim`
+            metadata (dict, optional): Metadata stored alongside the embedding
+            flush (bool, optional): Process the pending additions right away. Defaults to False.
 
-    def add_chunk(self, chunk: str, query_metadata: str = None) -> Optional[int]:
+        Returns:
+            Optional[int]: Identifier the embedding will be stored under, or None if it is invalid
+        """
+        if not isinstance(embedding, (list, np.ndarray)):
+            print("Invalid embedding format")
+            return None
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+
+        if embedding.shape[0] != self.dim:
+            print(f"Embedding dimension mismatch. Expected {self.dim}, got {embedding.shape[0]}")
+            return None
+
+        return self._enqueue(embedding, metadata or {}, flush)
+
+    def add_chunk(self, chunk: str, query_metadata: str = None, flush: bool = False) -> Optional[int]:
         """
         Add a text chunk to the dynamic cache index with embedded representation.
 
+        The chunk is queued as raw text and embedded together with the rest of the pending
+        batch when it is flushed.
+
         Args:
             chunk (str): Text chunk to be embedded and indexed
             query_metadata (str, optional): Metadata associated with the chunk, 
                                             can be JSON string or dictionary
+            flush (bool, optional): Embed and index the pending batch right away. Defaults to False.
 
         Returns:
             Optional[int]: Unique identifier for the added chunk, or None if addition fails
-
-        Raises:
-            ValueError: For invalid embedding format or dimension mismatch
         """
         if not chunk:
             print("Empty chunk")
             return None
 
         try:
-            if not self.text_embed_model:
-                self._init_embedding_model()
-
             chunk_str = str(chunk)
 
             metadata = {}
@@ -166,28 +1215,27 @@ class DynamicCacheIndex:
             if 'chunk' not in metadata:
                 metadata['chunk'] = chunk_str
 
-            chunk_embedding = self.text_embed_model.get_text_embedding(chunk_str)
-
-            if not isinstance(chunk_embedding, (list, np.ndarray)):
-                raise ValueError("Invalid embedding format")
-
-            if isinstance(chunk_embedding, list):
-                chunk_embedding = np.array(chunk_embedding)
-
-            # Validate embedding dimension
-            if chunk_embedding.shape[0] != self.dim:
-                raise ValueError(f"Embedding dimension mismatch. Expected {self.dim}, got {chunk_embedding.shape[0]}")
-
-            self.pending_additions.append((
-                chunk_embedding,
-                metadata
-            ))
-
-            # Process if batch size reached
-            if len(self.pending_additions) >= self.batch_size:
-                self.process_pending_additions()
-
-            return self.id_counter
+            if not self.dedup_mode:
+                return self._enqueue(chunk_str, metadata, flush)
+
+            chunk_hash = content_hash(chunk_str)
+            with self._pending_lock:
+                duplicate_id = self._hash_to_id.get(chunk_hash)
+                if duplicate_id is not None:
+                    duplicate_id = self._resolve(duplicate_id)
+                duplicate_metadata = self._entry_metadata(duplicate_id)
+                if duplicate_metadata is not None:
+                    self._add_alias(duplicate_metadata, metadata, duplicate_id)
+                    self._count('duplicates')
+                    chunk_id = duplicate_id
+                else:
+                    metadata['content_hash'] = chunk_hash
+                    chunk_id = self.id_counter + len(self.pending_additions)
+                    self._hash_to_id[chunk_hash] = chunk_id
+                    self.pending_additions.append((chunk_str, metadata))
+
+            self._schedule_flush(flush)
+            return chunk_id
 
         except Exception as e:
             print(f"Error adding chunk: {e}")
@@ -195,13 +1243,28 @@ class DynamicCacheIndex:
 
     def search(self,
               query_vector: np.ndarray,
-              k: int = 5) -> List[Tuple[int, float, Dict]]:
+              k: int = 5,
+              include_pending: Optional[bool] = None,
+              filters: Optional[Dict] = None) -> List[Tuple[int, float, Dict]]:
         """
-        Perform a k-nearest neighbors search on the HNSW index.
+        Perform a k-nearest neighbors search on the cache.
+
+        Caches smaller than `exact_search_threshold` are scanned exactly, larger ones are
+        searched through the HNSW index. Both paths return results in the same format.
+        With background indexing the search never waits for pending additions to be embedded,
+        it reads the last published state of the cache.
 
         Args:
             query_vector (np.ndarray): Embedding vector to search against the index
             k (int, optional): Number of top neighbors to retrieve. Defaults to 5.
+            include_pending (bool, optional): Also scan pending entries with a known embedding
+                                              exactly. Defaults to `search_pending`.
+            filters (Dict, optional): Conditions every result must satisfy, all of them:
+                                      {'query_type': 'retrieval'} for one value,
+                                      {'query_type': ['retrieval', 'original']} for any of several
+                                      (matching aliases too), and {'timestamp': {'gte': ..., 'lt': ...}}
+                                      for a range of insertion times given as datetimes, ISO strings
+                                      or epoch seconds. Defaults to None.
 
         Returns:
             List[Tuple[int, float, Dict]]: A list of tuples containing:
@@ -225,93 +1288,512 @@ class DynamicCacheIndex:
 
         try:
             # Process any pending additions
-            if self.pending_additions:
+            if self.pending_additions and not self.background_indexing:
                 if not self.process_pending_additions():
                     print("Failed to process pending additions")
                     return []
 
-            if not self.index_created or len(self.embeddings) == 0:
-                print("Index not created or empty")
-                return []
+            self._expire()
+            self._count('searches')
+            if include_pending is None:
+                include_pending = self.search_pending
+            with self._state_lock.read():
+                available = len(self) + (len(self.pending_additions) if include_pending else 0)
+                if available == 0:
+                    print("Index not created or empty")
+                    return []
 
-            k = min(k, len(self.embeddings))
-            ids, distances = self.index.knnQuery(query_vector, k=k) # retrieves the closest node and top k neighbours in the graph
+                # retrieves the closest node and top k neighbours
+                (ids, distances), = self._nearest_batch(np.asarray(query_vector, dtype=np.float32)[None, :],
+                                                         min(k, available), num_threads=1,
+                                                         include_pending=include_pending, filters=filters)
+                return [self._format_result(chunk_id, distance) for chunk_id, distance in zip(ids, distances)]
 
-            results = []
-            for i, chunk_id in enumerate(ids):
-                metadata = self.metadata.get(int(chunk_id), {})
+        except Exception as e:
+            print(f"Error during search: {e}")
+            return []
 
-                result_metadata = {
-                    'query': metadata.get('query', 'No query found'),
-                    'chunk': metadata.get('chunk', 'No chunk found'),
-                    'query_type': metadata.get('query_type', 'unknown'),
-                    'original_metadata': metadata
-                }
+    def search_batch(self,
+                     query_matrix: np.ndarray,
+                     k: int = 5,
+                     num_threads: int = 4,
+                     include_pending: Optional[bool] = None,
+                     filters: Optional[Dict] = None) -> List[List[Tuple[int, float, Dict]]]:
+        """
+        Perform a k-nearest neighbors search for several query vectors in one call.
 
-                results.append((
-                    int(chunk_id),
-                    float(distances[i]),
-                    result_metadata
-                ))
+        Small caches are scanned exactly with a single matrix product, larger ones use nmslib's
+        threaded batch query on the HNSW graphs.
 
-            return results
+        Args:
+            query_matrix (np.ndarray): Array of shape (num_queries, dim), one query vector per row
+            k (int, optional): Number of top neighbors to retrieve per query. Defaults to 5.
+            num_threads (int, optional): Threads used for the HNSW batch query. Defaults to 4.
+            include_pending (bool, optional): Also scan pending entries with a known embedding
+                                              exactly. Defaults to `search_pending`.
+            filters (Dict, optional): Conditions every result must satisfy, see `search`. Defaults to None.
 
+        Returns:
+            List[List[Tuple[int, float, Dict]]]: For every query, the same results `search` returns
+        """
+        try:
+            query_matrix = np.atleast_2d(np.asarray(query_matrix, dtype=np.float32))
         except Exception as e:
-            print(f"Error during search: {e}")
+            print(f"Failed to convert query matrix to numpy array: {e}")
             return []
 
-    def save_index(self, filename: str, save_data: bool = True) -> None:
+        if query_matrix.shape[1] != self.dim:
+            print(f"Query vector dimension mismatch. Expected {self.dim}, got {query_matrix.shape[1]}")
+            return [[] for _ in range(len(query_matrix))]
+
+        try:
+            # Process any pending additions
+            if self.pending_additions and not self.background_indexing:
+                if not self.process_pending_additions():
+                    print("Failed to process pending additions")
+                    return [[] for _ in range(len(query_matrix))]
+
+            self._expire()
+            self._count('searches', len(query_matrix))
+            if include_pending is None:
+                include_pending = self.search_pending
+            with self._state_lock.read():
+                available = len(self) + (len(self.pending_additions) if include_pending else 0)
+                if available == 0 or len(query_matrix) == 0:
+                    print("Index not created or empty")
+                    return [[] for _ in range(len(query_matrix))]
+
+                return [[self._format_result(chunk_id, distance) for chunk_id, distance in zip(ids, distances)]
+                        for ids, distances in self._nearest_batch(query_matrix, min(k, available), num_threads,
+                                                                  include_pending, filters)]
+
+        except Exception as e:
+            print(f"Error during batch search: {e}")
+            return [[] for _ in range(len(query_matrix))]
+
+    def _format_result(self, chunk_id: int, distance: float) -> Tuple[int, float, Dict]:
+        """Build the (id, distance, metadata) tuple returned by the search methods."""
+        metadata = self._entry_metadata(int(chunk_id)) or {}
+
+        result_metadata = {
+            'query': metadata.get('query', 'No query found'),
+            'chunk': metadata.get('chunk', 'No chunk found'),
+            'query_type': metadata.get('query_type', 'unknown'),
+            'original_metadata': metadata
+        }
+        return int(chunk_id), float(distance), result_metadata
+
+    def record_hit(self, chunk_id: int) -> None:
+        """
+        Record that a search result was used as a memory hit, refreshing it for LRU and LFU eviction.
+
+        Args:
+            chunk_id (int): Identifier of the entry that was used
+        """
+        with self._state_lock.read(), self._counter_lock:
+            row = self._id_to_row.get(self._resolve(chunk_id))
+            if row is None or self._tombstoned[row]:
+                return
+            self._last_access[row] = time.time()
+            self._hit_counts[row] += 1
+            self.stats['hits'] += 1
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        """Add `amount` to a `stats` counter."""
+        with self._counter_lock:
+            self.stats[name] += amount
+
+    def get_entry(self, chunk_id: int) -> Optional[Dict]:
+        """
+        Metadata of an entry by id, without searching. Ids of entries merged into another one
+        resolve to that entry.
+
+        Args:
+            chunk_id (int): Identifier returned by `add_chunk` or `add_embedding`
+
+        Returns:
+            Optional[Dict]: Metadata of the live or still pending entry, or None if it was removed
+        """
+        with self._pending_lock:
+            return self._entry_metadata(self._resolve(chunk_id))
+
+    def remove(self, chunk_id: int) -> bool:
+        """
+        Tombstone an entry. It disappears from searches and `metadata` right away, its row is
+        reclaimed by the next `compact`.
+
+        Args:
+            chunk_id (int): Identifier of the entry to remove
+
+        Returns:
+            bool: True if a live entry was removed, False otherwise
+        """
+        with self._state_lock.write():
+            chunk_id = self._resolve(chunk_id)
+            row = self._id_to_row.get(chunk_id)
+            if row is None or self._tombstoned[row]:
+                return False
+
+            self._tombstoned[row] = True
+            self.tombstones.add(chunk_id)
+            metadata = self.metadata.pop(chunk_id, {})
+            self._unindex_fields(chunk_id, metadata)
+            if self._hash_to_id.get(metadata.get('content_hash')) == chunk_id:
+                del self._hash_to_id[metadata['content_hash']]
+        return True
+
+    def _expire(self) -> int:
+        """Tombstone every entry older than `ttl_seconds`, returning how many were expired."""
+        if self.ttl_seconds is None:
+            return 0
+
+        cutoff = time.time() - self.ttl_seconds
+        with self._state_lock.read():
+            rows = np.flatnonzero((self._inserted_at[:self._row_count] < cutoff)
+                                  & ~self._tombstoned[:self._row_count])
+            expired = self._row_ids[rows].tolist()
+        for chunk_id in expired:
+            self.remove(chunk_id)
+        if expired:
+            self._count('expirations', len(expired))
+        return len(expired)
+
+    def evict(self) -> int:
+        """
+        Expire stale entries and, if the cache holds more than `max_entries`, evict the surplus
+        according to `eviction_policy`.
+
+        Returns:
+            int: Number of entries expired or evicted
+        """
+        removed = self._expire()
+        if self.max_entries is None or len(self) <= self.max_entries:
+            return removed
+
+        with self._state_lock.read(), self._counter_lock:
+            live_rows = np.flatnonzero(~self._tombstoned[:self._row_count])
+            if self.eviction_policy == 'lru':
+                order = np.argsort(self._last_access[live_rows], kind='stable')
+            elif self.eviction_policy == 'lfu':
+                order = np.lexsort((self._last_access[live_rows], self._hit_counts[live_rows]))
+            else:
+                order = np.argsort(self._inserted_at[live_rows], kind='stable')
+            evicted = self._row_ids[live_rows[order[:max(len(live_rows) - self.max_entries, 0)]]].tolist()
+
+        for chunk_id in evicted:
+            self.remove(chunk_id)
+        self._count('evictions', len(evicted))
+        return removed + len(evicted)
+
+    def compact(self) -> None:
+        """
+        Drop the rows of tombstoned entries from storage and rebuild the graphs without them.
+
+        Chunk ids are preserved, only their storage rows move.
         """
-        Save the current index and its associated metadata to disk.
+        with self._flush_lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            self._rebuild_thread.join()
+        if not self.tombstones:
+            return
+
+        live_rows = np.flatnonzero(~self._tombstoned[:self._row_count])
+        count = len(live_rows)
+        capacity = max(count, 1)
+
+        matrix = self._allocate_matrix(capacity)
+        matrix[:count] = self._embedding_matrix[live_rows]
+        codes = None
+        if self._codes is not None:
+            codes = self._allocate_codes(capacity)
+            codes[:count] = self._codes[live_rows]
+        columns = {}
+        for field, dtype in ROW_FIELDS:
+            columns[field] = np.zeros(capacity, dtype=dtype)
+            columns[field][:count] = getattr(self, field)[live_rows]
+
+        built = count > 0 and count >= self.exact_search_threshold
+        if built:
+            index = self._new_graph(matrix[:count], columns['_row_ids'][:count])
+        else:
+            index = nmslib.init(method=self.index_type, space=self.space)
+
+        with self._state_lock.write():
+            self._embedding_matrix = matrix
+            self._codes = codes
+            for field, column in columns.items():
+                setattr(self, field, column)
+            self._row_count = count
+            self._id_to_row = {int(chunk_id): row for row, chunk_id in enumerate(self._row_ids[:count])}
+            self.tombstones = set()
+            self.segments = []
+            self.index = index
+            self.indexed_upto = count if built else 0
+            self.index_created = built
+
+        self._count('compactions')
+
+    def get_stats(self) -> Dict:
+        """
+        Cache size and counters, for sizing `max_entries` per deployment.
+
+        Returns:
+            Dict: Live entries, tombstoned rows, capacity, policy, hit rate and the `stats` counters
+        """
+        with self._counter_lock:
+            stats = dict(self.stats)
+        return {
+            'entries': len(self),
+            'tombstones': len(self.tombstones),
+            'pending': len(self.pending_additions),
+            'background_indexing': self.background_indexing,
+            'max_entries': self.max_entries,
+            'eviction_policy': self.eviction_policy,
+            'storage': self.storage,
+            'resident_bytes': self.resident_bytes(),
+            'hit_rate': stats['hits'] / stats['searches'] if stats['searches'] else 0.0,
+            **stats,
+        }
+
+    def resident_bytes(self) -> int:
+        """
+        Memory held by the stored vectors: the embedding matrix for 'float32' storage, the
+        compressed codes (and 'pq' codebooks) otherwise. The HNSW graphs are not included.
+
+        Returns:
+            int: Size in bytes
+        """
+        if self.storage == 'float32':
+            return int(self._embedding_matrix.nbytes)
+        codebooks = getattr(self.quantizer, 'codebooks', None)
+        return int(self._codes.nbytes + self._norms.nbytes + self._code_scales.nbytes
+                   + (codebooks.nbytes if codebooks is not None else 0))
+
+    def save_index(self, path: str, save_data: bool = True) -> None:
+        """
+        Save the index, embeddings, metadata and pending additions to a snapshot directory.
+
+        The directory holds:
+            - manifest.json: format version, index settings, file names and the ids merged into
+              other entries
+            - embeddings.npy: the float32 embedding matrix, memory-mappable on load
+            - metadata.arrow: uncompressed Arrow IPC table, one row per embedding row, in row order
+            - graph.bin: the HNSW graph, saved without its data points
+            - pending.json: additions that were queued but not yet flushed
+
+        The manifest is written last, so an interrupted save never produces a loadable snapshot.
+        `path` used to be the base name of an nmslib index file and a `<path>_metadata.json`
+        file, snapshots in that former layout cannot be loaded.
 
         Args:
-            filename (str): Base filename for saving the index
-            save_data (bool, optional): Whether to save additional index data. 
-                                        Defaults to True.
+            path (str): Directory to write the snapshot to, created if missing
+            save_data (bool, optional): Kept for callers of the former layout. The embeddings are
+                                        always saved, to embeddings.npy, so it has no effect.
 
         Raises:
             Exception: If there are issues during index or metadata saving
         """
         try:
-            self.index.saveIndex(filename, save_data)
-
-            metadata_file = f"{filename}_metadata.json"
-            with open(metadata_file, 'w') as f:
-                json.dump({str(k): v for k, v in self.metadata.items()}, f)
-
-            print(f"Index saved to {filename}")
-            print(f"Metadata saved to {metadata_file}")
+            with self._flush_lock:
+                self._save_snapshot(path)
+            print(f"Index saved to {path}")
 
         except Exception as e:
             print(f"Error saving index: {e}")
             raise
 
-    def load_index(self, filename: str) -> None:
+    def _save_snapshot(self, path: str) -> None:
+        import pyarrow as pa
+        from pyarrow import feather
+
+        os.makedirs(path, exist_ok=True)
+
+        # Only live rows are saved, and delta graphs are not part of the saved graph
+        if self.tombstones:
+            self.compact()
+        if self.segments or (self.index_created and self._indexed_end() < self._row_count):
+            self.rebuild_index()
+
+        with self._state_lock.read():
+            count = self._row_count
+            np.save(os.path.join(path, 'embeddings.npy'), self.embeddings)
+
+            records = []
+            for chunk_id in self._row_ids[:count]:
+                chunk_id = int(chunk_id)
+                metadata = self.metadata.get(chunk_id, {})
+                record = {'id': chunk_id}
+                extra = {}
+                for key, value in metadata.items():
+                    if key in METADATA_COLUMNS and isinstance(value, str):
+                        record[key] = value
+                    else:
+                        extra[key] = value
+                record['extra'] = json.dumps(extra, default=str) if extra else None
+                records.append(record)
+
+            schema = pa.schema([('id', pa.int64())] +
+                               [(column, pa.string()) for column in METADATA_COLUMNS + ('extra',)])
+            feather.write_feather(pa.Table.from_pylist(records, schema=schema),
+                                  os.path.join(path, 'metadata.arrow'), compression='uncompressed')
+
+            graph_file = None
+            if self.index_created and count:
+                graph_file = 'graph.bin'
+                self.index.saveIndex(os.path.join(path, graph_file), save_data=False)
+
+            with self._pending_lock:
+                pending_additions = list(self.pending_additions)
+            pending = []
+            for item, metadata in pending_additions:
+                pending.append({
+                    'text': item if isinstance(item, str) else None,
+                    'embedding': None if isinstance(item, str) else np.asarray(item).tolist(),
+                    'metadata': metadata,
+                })
+            with open(os.path.join(path, 'pending.json'), 'w') as f:
+                json.dump(pending, f, default=str)
+
+            manifest = {
+                'format_version': INDEX_FORMAT_VERSION,
+                'dim': self.dim,
+                'index_type': self.index_type,
+                'space': self.space,
+                'count': count,
+                'next_id': self.id_counter,
+                'embeddings': 'embeddings.npy',
+                'metadata': 'metadata.arrow',
+                'graph': graph_file,
+                'pending': 'pending.json',
+                'id_redirects': {str(chunk_id): target for chunk_id, target in self.id_redirects.items()},
+                'saved_at': datetime.now().isoformat(),
+            }
+            manifest_file = os.path.join(path, 'manifest.json')
+            with open(manifest_file + '.tmp', 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(manifest_file + '.tmp', manifest_file)
+
+    def load_index(self, path: str, mmap: bool = True) -> None:
         """
-        Load a previously saved index and its metadata from disk.
+        Load a snapshot written by `save_index`, replacing the current contents of the cache.
+
+        With `mmap` the embedding matrix is memory-mapped read-only, so loading does not read it
+        into memory and several processes can share one snapshot through the page cache. The
+        mapping is copied into private memory the first time new entries are flushed.
+
+        Caches smaller than `exact_search_threshold` are searched by scanning that mapping and
+        their saved graph is not loaded. nmslib keeps its own copy of the vectors of a graph, so
+        larger caches hold the embeddings twice: the mapping and the graph's copy.
 
         Args:
-            filename (str): Base filename of the index to be loaded
+            path (str): Snapshot directory
+            mmap (bool, optional): Memory-map the embeddings instead of reading them. Defaults to True.
 
         Raises:
+            ValueError: If the snapshot format or index settings do not match this cache
             Exception: If there are issues during index or metadata loading
         """
+        from pyarrow import feather
+
         try:
-            self.index.loadIndex(filename)
+            with open(os.path.join(path, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+
+            if manifest.get('format_version') != INDEX_FORMAT_VERSION:
+                raise ValueError(f"Unsupported index format version: {manifest.get('format_version')}")
+            if manifest['dim'] != self.dim or manifest['space'] != self.space:
+                raise ValueError(f"Snapshot was saved with dim={manifest['dim']}, space={manifest['space']}, "
+                                 f"expected dim={self.dim}, space={self.space}")
 
-            metadata_file = f"{filename}_metadata.json"
-            with open(metadata_file, 'r') as f:
-                self.metadata = {int(k): v for k, v in json.load(f).items()}
+            count = manifest['count']
+            embeddings = np.load(os.path.join(path, manifest['embeddings']),
+                                 mmap_mode='r' if mmap else None)
 
-            self.index_created = True
-            print(f"Index loaded from {filename}")
-            print(f"Metadata loaded from {metadata_file}")
+            metadata = {}
+            row_ids = np.zeros(max(count, 1), dtype=np.int64)
+            table = feather.read_table(os.path.join(path, manifest['metadata']), memory_map=True)
+            for row_number, row in enumerate(table.to_pylist()):
+                entry = {column: row[column] for column in METADATA_COLUMNS if row[column] is not None}
+                if row['extra']:
+                    entry.update(json.loads(row['extra']))
+                metadata[row['id']] = entry
+                row_ids[row_number] = row['id']
+
+            index = nmslib.init(method=self.index_type, space=self.space)
+            # A graph copies the vectors into nmslib, small caches are scanned from the mapping
+            graph = manifest['graph'] if count >= self.exact_search_threshold else None
+            if graph:
+                index.addDataPointBatch(embeddings, row_ids[:count])
+                index.loadIndex(os.path.join(path, graph), load_data=False)
+                if self.query_params:
+                    index.setQueryTimeParams(self.query_params)
+
+            # Hit statistics are not persisted, every entry starts as accessed at its insertion time
+            now = time.time()
+            columns = {field: np.zeros(max(count, 1), dtype=dtype) for field, dtype in ROW_FIELDS}
+            columns['_row_ids'] = row_ids
+            columns['_inserted_at'][:count] = [self._timestamp_of(metadata[int(chunk_id)], now)
+                                               for chunk_id in row_ids[:count]]
+            columns['_last_access'][:count] = columns['_inserted_at'][:count]
+            for start in range(0, count, QUANTIZED_SCAN_TILE):
+                columns['_norms'][start:start + QUANTIZED_SCAN_TILE] = np.linalg.norm(
+                    embeddings[start:min(start + QUANTIZED_SCAN_TILE, count)], axis=1)
+
+            # Compressed vectors are not persisted, they are encoded again from the embeddings
+            quantizer = None
+            codes = self._allocate_codes(max(count, 1))
+            if self.storage != 'float32':
+                quantizer = self._train_quantizer(embeddings, np.arange(count))
+                if quantizer is not None:
+                    codes, columns['_code_scales'] = self._encode_rows(quantizer, embeddings, count)
+
+            pending = []
+            with open(os.path.join(path, manifest['pending']), 'r') as f:
+                for item in json.load(f):
+                    if item['text'] is not None:
+                        pending.append((item['text'], item['metadata']))
+                    else:
+                        pending.append((np.asarray(item['embedding'], dtype=np.float32), item['metadata']))
+
+            with self._flush_lock, self._state_lock.write(), self._pending_lock:
+                self._embedding_matrix = embeddings
+                self._codes = codes
+                self.quantizer = quantizer
+                for field, column in columns.items():
+                    setattr(self, field, column)
+                self._row_count = count
+                self._id_to_row = {int(chunk_id): row for row, chunk_id in enumerate(row_ids[:count])}
+                self.tombstones = set()
+                self.id_counter = manifest.get('next_id', count)
+                self.metadata = metadata
+                self.pending_additions = pending
+                self._staged = []
+                self.id_redirects = {int(chunk_id): target
+                                     for chunk_id, target in manifest.get('id_redirects', {}).items()}
+                self._hash_to_id = {}
+                for chunk_id, entry in list(metadata.items()) + [(self.id_counter + position, entry)
+                                                                 for position, (_, entry) in enumerate(pending)]:
+                    if 'content_hash' in entry:
+                        self._hash_to_id[entry['content_hash']] = chunk_id
+                self._field_index = {field: {} for field in self.filter_fields}
+                for chunk_id, entry in metadata.items():
+                    self._index_fields(chunk_id, entry)
+                self.index = index
+                self.segments = []
+                self.indexed_upto = count if graph else 0
+                self.index_created = bool(graph)
+
+            print(f"Index loaded from {path}")
 
         except Exception as e:
             print(f"Error loading index: {e}")
             raise
 
-    def query_and_cache(self, query: str, threshold: float = 0.8, k: int = 5) -> Optional[List[Tuple[int, float, Dict]]]:
+    def query_and_cache(self, query: str, threshold: float = 0.8, k: int = 5,
+                        filters: Optional[Dict] = None) -> Optional[List[Tuple[int, float, Dict]]]:
         """
         Execute a semantic search query and retrieve cached or similar results.
 
@@ -319,6 +1801,7 @@ class DynamicCacheIndex:
             query (str): Text query to search in the index
             threshold (float, optional): Similarity threshold for caching. Defaults to 0.8.
             k (int, optional): Number of top results to retrieve. Defaults to 5.
+            filters (Dict, optional): Conditions every result must satisfy, see `search`. Defaults to None.
 
         Returns:
             Optional[List[Tuple[int, float, Dict]]]: List of search results with 
@@ -331,9 +1814,10 @@ class DynamicCacheIndex:
             if not self.text_embed_model:
                 self._init_embedding_model()
 
-            query_embedding = self.text_embed_model.get_text_embedding(query)
+            with self._embedding_call():
+                query_embedding = shared_embedding_cache.get_text_embedding(self.text_embed_model, query)
 
-            results = self.search(query_embedding, k)
+            results = self.search(query_embedding, k, filters=filters)
 
             if not results:
                 print(f"No results found for query: {query}")
@@ -355,7 +1839,7 @@ class DynamicCacheIndex:
 
     def get_neighbors(self, chunk_id, k=5):
         """
-        Retrieve nearest neighbors for a specific chunk in the HNSW index.
+        Retrieve nearest neighbors for a specific chunk in the cache.
 
         Args:
             chunk_id (int): Unique identifier of the chunk to find neighbors for
@@ -366,5 +1850,7 @@ class DynamicCacheIndex:
                 - neighbors (array): IDs of neighboring chunks
                 - distances (array): Distances/similarities to those neighbors
         """
-        neighbors, distances = self.index.knnQuery(self.embeddings[chunk_id], k=k)
-        return neighbors, distances
\ No newline at end of file
+        with self._state_lock.read():
+            row = self._id_to_row[self._resolve(chunk_id)]
+            neighbors, distances = self._nearest(self.embeddings[row], k=min(k, len(self)))
+        return np.array(neighbors), np.array(distances)
\ No newline at end of file
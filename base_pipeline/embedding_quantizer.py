@@ -0,0 +1,190 @@
+from typing import Tuple
+import numpy as np
+
+# Storage formats of DynamicCacheIndex, 'float32' keeps the vectors uncompressed
+STORAGE_TYPES = ('float32', 'float16', 'int8', 'pq')
+
+class Float16Quantizer:
+    def __init__(self, dim: int):
+        """
+            Half precision storage, 2 bytes per dimension.
+
+            Args:
+                dim (int): Dimension of the vectors
+        """
+        self.dim = dim
+        self.code_width = dim
+        self.code_dtype = np.float16
+        self.trained = True
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.code_width * np.dtype(self.code_dtype).itemsize
+
+    def fit(self, vectors: np.ndarray) -> None:
+        """Nothing to learn for half precision."""
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Compress vectors.
+
+        Args:
+            vectors (np.ndarray): Array of shape (n, dim)
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Codes of shape (n, code_width) and one scale per vector
+        """
+        return np.asarray(vectors, dtype=np.float16), np.ones(len(vectors), dtype=np.float32)
+
+    def inner_products(self, query_matrix: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        """
+        Approximate inner products of every query with every encoded vector.
+
+        Args:
+            query_matrix (np.ndarray): float32 array of shape (num_queries, dim)
+            codes (np.ndarray): Codes returned by `encode`
+            scales (np.ndarray): Scales returned by `encode`
+
+        Returns:
+            np.ndarray: Array of shape (num_queries, num_codes)
+        """
+        return query_matrix @ codes.astype(np.float32).T
+
+class Int8Quantizer(Float16Quantizer):
+    def __init__(self, dim: int):
+        """
+            Symmetric scalar quantization to int8 with one float32 scale per vector, so that every
+            vector uses the full [-127, 127] range.
+
+            Args:
+                dim (int): Dimension of the vectors
+        """
+        super().__init__(dim)
+        self.code_dtype = np.int8
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.code_width + np.dtype(np.float32).itemsize
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def inner_products(self, query_matrix: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        return (query_matrix @ codes.astype(np.float32).T) * scales[None, :]
+
+class ProductQuantizer(Float16Quantizer):
+    def __init__(self, dim: int, subspaces: int = 64, centroids: int = 256, iterations: int = 20, seed: int = 0):
+        """
+            Product quantization: every vector is split into `subspaces` sub-vectors, each stored
+            as the one-byte index of its nearest centroid in a codebook learnt with k-means.
+
+            Args:
+                dim (int): Dimension of the vectors, a multiple of `subspaces`
+                subspaces (int, optional): Number of sub-vectors, i.e. bytes per vector. Defaults to 64.
+                centroids (int, optional): Codebook size of every subspace, at most 256. Defaults to 256.
+                iterations (int, optional): k-means iterations. Defaults to 20.
+                seed (int, optional): Seed of the k-means initialization. Defaults to 0.
+
+            Raises:
+                ValueError: If `dim` is not a multiple of `subspaces` or `centroids` exceeds 256
+        """
+        if dim % subspaces:
+            raise ValueError(f"Dimension {dim} is not a multiple of {subspaces} PQ subspaces")
+        if not 0 < centroids <= 256:
+            raise ValueError("PQ codebooks hold at most 256 centroids")
+
+        super().__init__(dim)
+        self.subspaces = subspaces
+        self.subspace_dim = dim // subspaces
+        self.centroids = centroids
+        self.iterations = iterations
+        self.seed = seed
+        self.code_width = subspaces
+        self.code_dtype = np.uint8
+        self.codebooks = None
+        self.trained = False
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.code_width
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), self.subspaces, self.subspace_dim)
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Index of the nearest centroid of every vector."""
+        distances = np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2.0 * (vectors @ centroids.T)
+        return np.argmin(distances, axis=1)
+
+    def fit(self, vectors: np.ndarray) -> None:
+        """
+        Learn the codebook of every subspace with k-means.
+
+        Args:
+            vectors (np.ndarray): Training vectors of shape (n, dim)
+        """
+        parts = self._split(vectors)
+        rng = np.random.default_rng(self.seed)
+        centroids = min(self.centroids, len(parts))
+
+        codebooks = np.zeros((self.subspaces, centroids, self.subspace_dim), dtype=np.float32)
+        for subspace in range(self.subspaces):
+            points = parts[:, subspace]
+            codebook = points[rng.choice(len(points), centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._assign(points, codebook)
+                counts = np.bincount(assignment, minlength=centroids)
+                sums = np.zeros_like(codebook)
+                np.add.at(sums, assignment, points)
+                # Centroids without members keep their position
+                filled = counts > 0
+                codebook[filled] = sums[filled] / counts[filled, None]
+            codebooks[subspace] = codebook
+
+        self.codebooks = codebooks
+        self.trained = True
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        parts = self._split(vectors)
+        codes = np.empty((len(parts), self.subspaces), dtype=np.uint8)
+        for subspace in range(self.subspaces):
+            codes[:, subspace] = self._assign(parts[:, subspace], self.codebooks[subspace])
+        return codes, np.ones(len(parts), dtype=np.float32)
+
+    def inner_products(self, query_matrix: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        # Inner products of every query sub-vector with every centroid of its subspace
+        tables = np.einsum('qsd,scd->qsc', self._split(query_matrix), self.codebooks)
+        products = np.zeros((len(query_matrix), len(codes)), dtype=np.float32)
+        for subspace in range(self.subspaces):
+            products += tables[:, subspace, codes[:, subspace]]
+        return products
+
+def make_quantizer(storage: str, dim: int, pq_subspaces: int = 64):
+    """
+    Build the quantizer of a DynamicCacheIndex storage format.
+
+    Args:
+        storage (str): One of STORAGE_TYPES
+        dim (int): Dimension of the vectors
+        pq_subspaces (int, optional): Bytes per vector of the 'pq' format. Defaults to 64.
+
+    Returns:
+        Optional[object]: The quantizer, or None for uncompressed 'float32' storage
+
+    Raises:
+        ValueError: If the storage format is unknown
+    """
+    if storage == 'float32':
+        return None
+    if storage == 'float16':
+        return Float16Quantizer(dim)
+    if storage == 'int8':
+        return Int8Quantizer(dim)
+    if storage == 'pq':
+        return ProductQuantizer(dim, subspaces=pq_subspaces)
+    raise ValueError(f"Unknown storage type: {storage}")
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from typing import List
+from dynamic_cache_index import content_hash
+
+# Distinct normalized queries remembered, least recently used ones are dropped first
+DEFAULT_MAX_QUERIES = 16384
+
+class ExactMatchCache:
+    def __init__(self, max_queries: int = DEFAULT_MAX_QUERIES):
+        """
+            First tier of the memory cache: maps the normalized text of every query stored in memory
+            to the ids of its cache entries, so that a repeated query is answered without embedding
+            it or searching the HNSW index.
+
+            Queries are normalized as chunks are for deduplication, lowercased with whitespace
+            collapsed. The map only holds ids: callers look the entries up in the cache index, so
+            evicted or expired entries are never returned.
+
+            Args:
+                max_queries (int, optional): Maximum number of distinct queries remembered.
+                                             Defaults to DEFAULT_MAX_QUERIES.
+        """
+        self.max_queries = max_queries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, query: str, chunk_id: int) -> None:
+        """
+        Remember that `chunk_id` was stored for `query`.
+
+        Args:
+            query (str): Query text
+            chunk_id (int): Id returned by DynamicCacheIndex.add_chunk
+        """
+        key = content_hash(query)
+        with self._lock:
+            ids = self._entries.setdefault(key, [])
+            if chunk_id not in ids:
+                ids.append(chunk_id)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_queries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, query: str) -> List[int]:
+        """
+        Ids stored for a query, oldest first.
+
+        Args:
+            query (str): Query text, compared after normalization
+
+        Returns:
+            List[int]: Ids of the cache entries, empty if the query was never stored
+        """
+        key = content_hash(query)
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is None:
+                return []
+            self._entries.move_to_end(key)
+            return list(ids)
+
+    def discard(self, query: str, chunk_ids: List[int]) -> None:
+        """
+        Forget ids of a query whose entries left the cache index.
+
+        Args:
+            query (str): Query text
+            chunk_ids (List[int]): Ids to forget
+        """
+        key = content_hash(query)
+        with self._lock:
+            ids = self._entries.get(key)
+            if ids is None:
+                return
+            ids[:] = [chunk_id for chunk_id in ids if chunk_id not in chunk_ids]
+            if not ids:
+                del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        """Forget every query."""
+        with self._lock:
+            self._entries.clear()
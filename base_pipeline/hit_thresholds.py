@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Per-query-type hit thresholds written by threshold_calibration.py and loaded by every RAGAGENT
+HIT_THRESHOLDS_PATH = os.getenv('HIT_THRESHOLDS_PATH',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hit_thresholds.json'))
+
+# Memory lookup paths of RAGAGENT that can be calibrated
+LOOKUP_PATHS = ('retrieve', 'supervisor', 'query_check')
+
+def load_hit_thresholds(path: str = HIT_THRESHOLDS_PATH) -> Dict:
+    """
+    Read the hit thresholds fitted by threshold_calibration.py.
+
+    Args:
+        path (str, optional): Thresholds file. Defaults to HIT_THRESHOLDS_PATH.
+
+    Returns:
+        Dict: {lookup path: {'default': max distance or None, 'query_types': {query type: max distance}}},
+              empty if there is no usable file
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            config = json.load(f)
+        thresholds = {}
+        for lookup_path, entry in config.get('thresholds', {}).items():
+            default = entry.get('default')
+            thresholds[lookup_path] = {
+                'default': None if default is None else float(default),
+                'query_types': {str(query_type): float(value)
+                                for query_type, value in entry.get('query_types', {}).items()},
+            }
+        return thresholds
+    except (OSError, ValueError, TypeError, AttributeError) as e:
+        print(f"Ignoring unreadable hit thresholds {path}: {e}")
+        return {}
+
+class LookupLog:
+    def __init__(self, path: str):
+        """
+            Append-only JSON lines log of semantic memory lookups, replayed by threshold_calibration.py.
+
+            Every lookup is written with the distance and query type of the cache entry it matched,
+            or of the nearest one on a miss. Whether the cached chunk turned out to be sufficient is
+            written later as a separate line with the same id, as it is only known once the chunk
+            has been used.
+
+            Args:
+                path (str): Log file, created on first write
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _append(self, record: Dict) -> None:
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"Could not write to the lookup log {self.path}: {e}")
+
+    def record(self, path: str, query: str, candidate_query: str, query_type: str, distance: float,
+               threshold: float, hit: bool, chunk: Optional[str] = None) -> str:
+        """
+        Log a semantic lookup.
+
+        Args:
+            path (str): Lookup path, one of LOOKUP_PATHS
+            query (str): The query looked up
+            candidate_query (str): Query of the matched or nearest cache entry
+            query_type (str): Query type of that entry
+            distance (float): Cosine distance to that entry
+            threshold (float): Maximum distance of a hit when the lookup ran
+            hit (bool): Whether the entry was returned
+            chunk (str, optional): Chunk of the entry, needed to replay the lookup
+
+        Returns:
+            str: Id of the record, to attach its outcome to
+        """
+        record_id = uuid.uuid4().hex
+        self._append({
+            'id': record_id,
+            'timestamp': datetime.now().isoformat(),
+            'path': path,
+            'query': query,
+            'candidate_query': candidate_query,
+            'query_type': query_type,
+            'distance': float(distance),
+            'threshold': float(threshold),
+            'hit': bool(hit),
+            'chunk': chunk,
+        })
+        return record_id
+
+    def record_outcome(self, record_ids: List[str], sufficient: bool) -> None:
+        """
+        Log whether the chunks returned by earlier lookups answered their query.
+
+        Args:
+            record_ids (List[str]): Ids returned by `record`
+            sufficient (bool): True if llm_response_if_memory_hit_found answered from the chunk
+        """
+        for record_id in record_ids:
+            self._append({'id': record_id, 'sufficient': bool(sufficient)})
+
+def read_lookup_log(path: str) -> List[Dict]:
+    """
+    Read a lookup log, with the outcome of every lookup merged into its record.
+
+    Args:
+        path (str): Log file written by LookupLog
+
+    Returns:
+        List[Dict]: Lookup records in log order, 'sufficient' is None when no outcome was logged
+    """
+    records, outcomes = {}, {}
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Line cut short by a crash
+                continue
+            if 'path' in entry:
+                records[entry['id']] = {**entry, 'sufficient': None}
+            elif 'sufficient' in entry:
+                outcomes[entry['id']] = entry['sufficient']
+    for record_id, sufficient in outcomes.items():
+        if record_id in records:
+            records[record_id]['sufficient'] = sufficient
+    return list(records.values())
+
+# One LookupLog per file, so that agents logging to the same file share its lock
+_lookup_logs = {}
+_lookup_logs_lock = threading.Lock()
+
+def get_lookup_log(path: str) -> LookupLog:
+    """The process-wide LookupLog writing to `path`."""
+    path = os.path.abspath(path)
+    with _lookup_logs_lock:
+        if path not in _lookup_logs:
+            _lookup_logs[path] = LookupLog(path)
+        return _lookup_logs[path]
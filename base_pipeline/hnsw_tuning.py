@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+import nmslib
+import numpy as np
+from cache_benchmark import random_embeddings
+from dynamic_cache_index import HNSW_CONFIG_PATH, update_hnsw_config
+
+
+def clustered_embeddings(n, dim, clusters=64, spread=1.0, seed=0):
+    """
+    Generate unit-norm embeddings grouped around random topic centres, closer to real chunk
+    embeddings than isotropic noise.
+
+    Args:
+        n (int): Number of embeddings.
+        dim (int): Dimension of each embedding.
+        clusters (int, optional): Number of topic centres. Defaults to 64.
+        spread (float, optional): Norm of the noise added to the centres. Defaults to 1.0.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        np.ndarray: Array of shape (n, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centres = random_embeddings(clusters, dim, seed=seed + 1)
+    noise = random_embeddings(n, dim, seed=seed + 2) * spread
+    vectors = centres[rng.integers(0, clusters, n)] + noise
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def load_embeddings(path):
+    """
+    Load recorded embeddings from a .npy file or a snapshot directory written by
+    DynamicCacheIndex.save_index.
+
+    Args:
+        path (str): .npy file or snapshot directory.
+
+    Returns:
+        np.ndarray: float32 array of shape (n, dim).
+    """
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        embeddings = np.load(os.path.join(path, manifest['embeddings']), mmap_mode='r')
+        return np.array(embeddings[:manifest['count']], dtype=np.float32)
+    return np.load(path).astype(np.float32)
+
+
+def exact_neighbours(data, queries, k, space='cosinesimil'):
+    """
+    Ids of the exact k nearest neighbours of every query.
+
+    Args:
+        data (np.ndarray): Indexed vectors.
+        queries (np.ndarray): Query vectors.
+        k (int): Neighbours per query.
+        space (str, optional): 'cosinesimil' or 'l2'. Defaults to 'cosinesimil'.
+
+    Returns:
+        np.ndarray: Array of shape (num_queries, k).
+    """
+    if space == 'cosinesimil':
+        scores = -(queries @ data.T) / np.outer(np.linalg.norm(queries, axis=1), np.linalg.norm(data, axis=1))
+    else:
+        scores = np.einsum('ij,ij->i', data, data)[None, :] - 2.0 * (queries @ data.T)
+    return np.argsort(scores, axis=1)[:, :k]
+
+
+def sweep(data, queries, k=5, space='cosinesimil', m_values=(8, 16, 32), ef_construction_values=(100, 200, 400),
+          ef_search_values=(16, 32, 64, 128, 256)):
+    """
+    Build an HNSW graph for every (M, efConstruction) pair and query it with every efSearch.
+
+    Args:
+        data (np.ndarray): Vectors to index.
+        queries (np.ndarray): Query vectors, not part of `data`.
+        k (int, optional): Neighbours per query, 5 as in RAGAGENT. Defaults to 5.
+        space (str, optional): nmslib space. Defaults to 'cosinesimil', as used by DynamicCacheIndex.
+        m_values (tuple): Values of M to try.
+        ef_construction_values (tuple): Values of efConstruction to try.
+        ef_search_values (tuple): Values of efSearch to try.
+
+    Returns:
+        list[dict]: One row per parameter combination with the build time in ms, mean single-query
+        latency in ms and recall@k against exact search.
+    """
+    truth = exact_neighbours(data, queries, k, space)
+    results = []
+    for m in m_values:
+        for ef_construction in ef_construction_values:
+            graph = nmslib.init(method='hnsw', space=space)
+            graph.addDataPointBatch(data)
+            tic = time.perf_counter()
+            graph.createIndex({'M': m, 'efConstruction': ef_construction, 'post': 2})
+            build_ms = (time.perf_counter() - tic) * 1000
+
+            for ef_search in ef_search_values:
+                graph.setQueryTimeParams({'efSearch': ef_search})
+                hits, latencies = 0, []
+                for query, expected in zip(queries, truth):
+                    tic = time.perf_counter()
+                    ids, _ = graph.knnQuery(query, k=k)
+                    latencies.append((time.perf_counter() - tic) * 1000)
+                    hits += len(set(ids.tolist()) & set(expected.tolist()))
+
+                results.append({
+                    'M': m,
+                    'efConstruction': ef_construction,
+                    'efSearch': ef_search,
+                    'build_ms': build_ms,
+                    'query_ms': float(np.mean(latencies)),
+                    'recall': hits / (len(queries) * k),
+                })
+    return results
+
+
+def recommend(results, target_recall=0.95):
+    """
+    Pick the fastest parameters reaching `target_recall`, preferring cheaper builds on ties, or
+    the most accurate ones if none does.
+
+    Args:
+        results (list[dict]): Output of `sweep`.
+        target_recall (float, optional): Minimum acceptable recall@k. Defaults to 0.95.
+
+    Returns:
+        dict: The chosen row of `results`.
+    """
+    good = [row for row in results if row['recall'] >= target_recall]
+    if good:
+        return min(good, key=lambda row: (round(row['query_ms'], 2), row['build_ms']))
+    return max(results, key=lambda row: (row['recall'], -row['query_ms']))
+
+
+def write_config(row, path=HNSW_CONFIG_PATH, **details):
+    """
+    Write the parameters of a `sweep` row as the config DynamicCacheIndex loads at startup, keeping
+    the exact search threshold already in it.
+
+    Args:
+        row (dict): Chosen row of `sweep`.
+        path (str, optional): Config file. Defaults to HNSW_CONFIG_PATH.
+        **details: Extra information recorded next to the parameters, e.g. the data set used.
+    """
+    config = {
+        'index_params': {'M': row['M'], 'efConstruction': row['efConstruction'], 'post': 2},
+        'query_params': {'efSearch': row['efSearch']},
+        'recall': row['recall'],
+        'query_ms': row['query_ms'],
+        'build_ms': row['build_ms'],
+        'tuned_at': datetime.now().isoformat(),
+        **details,
+    }
+    update_hnsw_config(config, path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Tune the HNSW parameters of DynamicCacheIndex")
+    parser.add_argument('--embeddings', help="Recorded embeddings: a .npy file or a save_index snapshot directory")
+    parser.add_argument('--size', type=int, default=5000, help="Cache size of the synthetic data set")
+    parser.add_argument('--dim', type=int, default=1024)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--space', default='cosinesimil')
+    parser.add_argument('--target-recall', type=float, default=0.95)
+    parser.add_argument('--m', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--ef-construction', type=int, nargs='+', default=[100, 200, 400])
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[16, 32, 64, 128, 256])
+    parser.add_argument('--output', default=HNSW_CONFIG_PATH)
+    parser.add_argument('--dry-run', action='store_true', help="Print the recommendation without writing it")
+    args = parser.parse_args()
+
+    if args.embeddings:
+        vectors = load_embeddings(args.embeddings)
+        # Held-out rows stand in for incoming queries
+        np.random.default_rng(0).shuffle(vectors)
+        data, queries = vectors[args.queries:], vectors[:args.queries]
+        source = args.embeddings
+    else:
+        vectors = clustered_embeddings(args.size + args.queries, args.dim)
+        data, queries = vectors[:args.size], vectors[args.size:]
+        source = 'synthetic'
+
+    results = sweep(data, queries, args.k, args.space, args.m, args.ef_construction, args.ef_search)
+    print(f"\n{'M':>4}{'efC':>6}{'efS':>6}{'build ms':>12}{'query ms':>10}{'recall':>9}")
+    for row in results:
+        print(f"{row['M']:>4}{row['efConstruction']:>6}{row['efSearch']:>6}{row['build_ms']:>12.1f}"
+              f"{row['query_ms']:>10.3f}{row['recall']:>9.3f}")
+
+    best = recommend(results, args.target_recall)
+    print(f"\nRecommended: M={best['M']}, efConstruction={best['efConstruction']}, efSearch={best['efSearch']} "
+          f"(recall {best['recall']:.3f}, {best['query_ms']:.3f} ms per query)")
+    if not args.dry_run:
+        write_config(best, args.output, data=source, cache_size=len(data), k=args.k, space=args.space)
+        print(f"Config written to {args.output}")
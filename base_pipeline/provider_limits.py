@@ -0,0 +1,54 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Concurrent calls allowed per provider when no limits are given
+DEFAULT_PROVIDER_CONCURRENCY = {'synthesis': 4, 'query_generation': 2, 'embedding': 4}
+
+class ProviderLimits:
+    def __init__(self, limits: Optional[Dict[str, int]] = None):
+        """
+            Caps on the number of concurrent calls made to each model provider.
+
+            Providers are named after what RAGAGENT uses them for: 'synthesis' for the LLM of the
+            query engine, 'query_generation' for the utility query LLM and 'embedding' for the
+            embedding model. Each has its own API key, hence its own rate limit.
+
+            Args:
+                limits (Dict[str, int], optional): Maximum concurrent calls per provider, providers
+                                                   missing or set to 0/None are not capped.
+                                                   Defaults to DEFAULT_PROVIDER_CONCURRENCY.
+        """
+        self.limits = dict(DEFAULT_PROVIDER_CONCURRENCY if limits is None else limits)
+        self._semaphores = {provider: threading.BoundedSemaphore(limit)
+                            for provider, limit in self.limits.items() if limit}
+
+    @contextmanager
+    def acquire(self, provider: str):
+        """Block until a call to `provider` is allowed, for the duration of the `with` block."""
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+# Limits shared by every agent of the process with the same configuration
+_provider_limits = {}
+_provider_limits_lock = threading.Lock()
+
+def get_provider_limits(limits: Optional[Dict[str, int]] = None) -> ProviderLimits:
+    """
+    The process-wide ProviderLimits of a configuration, so that the caps hold across agents.
+
+    Args:
+        limits (Dict[str, int], optional): See ProviderLimits. Defaults to DEFAULT_PROVIDER_CONCURRENCY.
+
+    Returns:
+        ProviderLimits: The same instance for equal configurations
+    """
+    key = tuple(sorted((DEFAULT_PROVIDER_CONCURRENCY if limits is None else limits).items()))
+    with _provider_limits_lock:
+        if key not in _provider_limits:
+            _provider_limits[key] = ProviderLimits(dict(key))
+        return _provider_limits[key]
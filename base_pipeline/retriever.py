@@ -1,14 +1,10 @@
-import faiss
-import json
-import os
-import fitz
-import numpy as np
 from llama_index.core import Document
 from llama_index.packs.raptor import RaptorRetriever
 from llama_index.core.node_parser import SentenceSplitter
 from PyPDF2 import PdfReader, PdfWriter
 from unstructured_client.models import operations, shared
 from summary_module import summary_module
+from page_index import get_page_index
 import re
 import time
 
@@ -102,63 +98,11 @@ def retriever(path, query, top_k):
         >>> query_engine = retriever('document.pdf', 'research methodology', top_k=3)
         >>> response = query_engine.query("Summarize the key findings")
   """
-  pdf_document = fitz.open(path)
-  output_folder = "data"
-
-  metadata = {}
-  for page_num in range(len(pdf_document)):
-      page_metadata = {"text": ""}
-      page = pdf_document[page_num]
-
-      page_text = page.get_text()
-      page_metadata["text"] = page_text
-
-      metadata[f"page_{page_num + 1}"] = page_metadata
-
-  pdf_document.close()
-
-  metadata_file_path = os.path.join(output_folder, "pdf_metadata.json")
-  with open(metadata_file_path, "w", encoding="utf-8") as json_file:
-      json.dump(page_metadata, json_file, indent=4)
-
-  #constructing a FAISS vector store for text-based doc level retrieval.
-  dimension = 1024
-  index = faiss.IndexFlatL2(dimension)
-  faiss_metadata = []
-  count = 1
-  for page, content in metadata.items():
-      page_text = content["text"]
-      page_embedding = text_embed_model.get_text_embedding(page_text)
-      page_embedding = np.array([page_embedding], dtype="float32")
-      index.add(page_embedding)
-      faiss_metadata.append({
-          "page": page.split("_")[-1],
-          "text": page_text
-      })
-      count += 1
-
-  faiss.write_index(index, "faiss_index.bin")
-  with open("faiss_metadata.json", "w", encoding="utf-8") as meta_file:
-          json.dump(faiss_metadata, meta_file, indent=4)
-
-  query_embedding = query_embed_model.get_query_embedding(query)
-  query_embedding = np.array([query_embedding], dtype="float32")
-  distances, indices = index.search(query_embedding, top_k)
-
-  #doc level retrieval
-
-  results = []
-  for idx, distance in zip(indices[0], distances[0]):
-      if idx == -1:
-          continue
-      print(idx+1)
-      result_metadata = faiss_metadata[idx]
-      result_metadata["distance"] = distance
-      results.append(result_metadata)
-
-  index = faiss.read_index("faiss_index.bin")
-  with open("faiss_metadata.json", "r", encoding="utf-8") as meta_file:
-      faiss_metadata = json.load(meta_file)
+  with open(path, "rb") as f:
+    pdf_content = f.read()
+
+  #doc level retrieval over the page index shared with RAGAGENT.retrieve_docs.
+  results = get_page_index(pdf_content, text_embed_model, query_embed_model).search(query, top_k)
 
   gt_num=[]
   for result in results:
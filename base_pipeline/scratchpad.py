@@ -0,0 +1,146 @@
+import re
+from typing import Dict, List
+from cache_metrics import shared_cache_metrics
+
+# agent_input lines that start a new entry, other lines continue the entry above them
+ENTRY_PATTERN = re.compile(r'\n(?=OBSERVATION:|RETRIEVAL THOUGHT|REASONING THOUGHT|REASONING|FINAL ANSWER)')
+THOUGHT_PREFIXES = ('RETRIEVAL THOUGHT', 'REASONING THOUGHT')
+OBSERVATION_PREFIX = 'OBSERVATION:'
+
+TOKEN_BUCKETS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000)
+
+# How an observation is sent, from the full text to a reference to its step
+VERBATIM, SHORTENED, REFERENCE = range(3)
+
+
+def estimate_tokens(text):
+    """Rough token count of English text, about 1.3 tokens per word."""
+    return int(len(str(text).split()) * 1.3)
+
+
+class Scratchpad:
+    def __init__(self, token_budget: int = 3000, recent_steps: int = 2, summary_tokens: int = 60):
+        """
+            Compacts the agent input sent to the thought, reasoning and confidence prompts, which
+            otherwise grows by every retrieved chunk and is resent in full at each step.
+
+            The entries of the last `recent_steps` steps are kept verbatim. Observations of older
+            steps are shortened to their first `summary_tokens` tokens, and replaced by a reference
+            to their step if the input is still over `token_budget`. Thoughts and reasoning are
+            never compacted and an observation repeated word for word is sent once. The agent input
+            itself is left untouched, so the parsing of the last line by RAGAGENT.step still works.
+
+            Args:
+                token_budget (int, optional): Tokens of agent input aimed for per prompt. Defaults to 3000.
+                recent_steps (int, optional): Steps kept verbatim. Defaults to 2.
+                summary_tokens (int, optional): Tokens kept of a shortened observation. Defaults to 60.
+        """
+        self.token_budget = token_budget
+        self.recent_steps = max(1, recent_steps)
+        self.summary_tokens = summary_tokens
+        self.history = []
+
+    @staticmethod
+    def _entries(agent_input: str):
+        """Split the agent input into entries, each tagged with the step it belongs to."""
+        entries, step = [], 0
+        for entry in ENTRY_PATTERN.split(agent_input):
+            if entry.startswith(THOUGHT_PREFIXES):
+                step += 1
+            entries.append((entry, step))
+        return entries
+
+    def _shorten(self, body: str) -> str:
+        words = body.split()
+        max_words = max(1, int(self.summary_tokens / 1.3))
+        if len(words) <= max_words:
+            return body
+        return ' '.join(words[:max_words]) + ' ... (shortened)'
+
+    def _render(self, entry: str, step: int, mode: int) -> str:
+        body = entry[len(OBSERVATION_PREFIX):].strip()
+        if mode == SHORTENED:
+            return f"{OBSERVATION_PREFIX} {self._shorten(body)}"
+        return f"{OBSERVATION_PREFIX} (retrieved at step {step}, omitted)"
+
+    def compact(self, agent_input: str) -> str:
+        """
+        The agent input to send, within the token budget where possible.
+
+        Args:
+            agent_input (str): The full agent input
+
+        Returns:
+            str: The agent input with older observations shortened and repeats removed, unchanged if
+                 it holds no observation to compact
+        """
+        entries = self._entries(agent_input)
+        last_step = entries[-1][1] if entries else 0
+        first_recent = last_step - self.recent_steps + 1
+
+        rendered, observations, seen = [], [], {}
+        for entry, step in entries:
+            if not entry.startswith(OBSERVATION_PREFIX):
+                rendered.append(entry)
+                continue
+            key = ' '.join(entry[len(OBSERVATION_PREFIX):].split()).lower()
+            if key in seen:
+                rendered.append(f"{OBSERVATION_PREFIX} (same as an observation of step {seen[key]})")
+                continue
+            seen[key] = step
+            observations.append((len(rendered), entry, step))
+            rendered.append(entry if step >= first_recent else self._render(entry, step, SHORTENED))
+
+        # Over the budget, older observations become references then recent ones, except those of
+        # the last step, are shortened, oldest first
+        tokens = sum(estimate_tokens(text) for text in rendered)
+        downgrades = [(position, entry, step, REFERENCE) for position, entry, step in observations
+                      if step < first_recent]
+        downgrades += [(position, entry, step, SHORTENED) for position, entry, step in observations
+                       if first_recent <= step < last_step]
+        for position, entry, step, mode in downgrades:
+            if tokens <= self.token_budget:
+                break
+            text = self._render(entry, step, mode)
+            tokens += estimate_tokens(text) - estimate_tokens(rendered[position])
+            rendered[position] = text
+        return '\n'.join(rendered)
+
+    def render(self, agent_input: str, prompt: str, step: int) -> str:
+        """
+        Compact the agent input for a prompt and record the tokens it saves.
+
+        Args:
+            agent_input (str): The full agent input
+            prompt (str): Prompt the input is sent to, e.g. 'thought' or 'reasoning'
+            step (int): Step of the agent
+
+        Returns:
+            str: The compacted agent input
+        """
+        compacted = self.compact(agent_input)
+        raw_tokens, sent_tokens = estimate_tokens(agent_input), estimate_tokens(compacted)
+        self.history.append({'step': step, 'prompt': prompt, 'raw_tokens': raw_tokens, 'sent_tokens': sent_tokens})
+        shared_cache_metrics.observe('scratchpad_tokens', sent_tokens, TOKEN_BUCKETS, prompt=prompt)
+        shared_cache_metrics.increment('scratchpad_tokens_saved_total', raw_tokens - sent_tokens, prompt=prompt)
+        return compacted
+
+    def tokens_per_step(self) -> List[Dict]:
+        """
+        Tokens of agent input sent per step of the current question.
+
+        Returns:
+            List[Dict]: 'step', 'prompts', 'raw_tokens' (without compaction) and 'sent_tokens' of
+                        every step, in order
+        """
+        steps = {}
+        for record in self.history:
+            totals = steps.setdefault(record['step'], {'step': record['step'], 'prompts': 0,
+                                                       'raw_tokens': 0, 'sent_tokens': 0})
+            totals['prompts'] += 1
+            totals['raw_tokens'] += record['raw_tokens']
+            totals['sent_tokens'] += record['sent_tokens']
+        return list(steps.values())
+
+    def reset(self) -> None:
+        self.history = []
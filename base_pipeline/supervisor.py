@@ -10,6 +10,8 @@ from llama_index.core.memory import VectorMemory
 from llama_index.core.llms import ChatMessage
 import traceback
 from ragagent import RAGAGENT
+from answer_cache import get_shared_answer_cache, tools_key, DEFAULT_ANSWER_SIMILARITY
+from cache_registry import document_key
 from retriever import retriever
 from llama_index.embeddings.jinaai import JinaEmbedding
 import sys
@@ -27,7 +29,8 @@ class SUPERVISOR_AGENT:
     The supervisor agent can handle errors during code execution by utilizing mechanisms such as `api_reflection`, `code_reflection`, and `silent_reflection`.
     """
     
-    def __init__(self, tools, tools_aux, llm, tool_map, path, reflextion_limit = 10, top_k = 5, max_steps = 10):
+    def __init__(self, tools, tools_aux, llm, tool_map, path, reflextion_limit = 10, top_k = 5, max_steps = 10,
+                 use_answer_cache = True, answer_similarity = DEFAULT_ANSWER_SIMILARITY):
     
         self.tools = tools
         self.llm = llm
@@ -37,6 +40,17 @@ class SUPERVISOR_AGENT:
         self.path = path
         self.top_k = top_k
         self.max_steps = max_steps
+        # Final answers of questions asked before on the same document with the same tools,
+        # returned when a new question is at least `answer_similarity` cosine-similar
+        self.answer_cache = get_shared_answer_cache() if use_answer_cache else None
+        self.answer_similarity = answer_similarity
+        self.document_key = None
+        if self.answer_cache is not None:
+          try:
+            with open(self.path, 'rb') as f:
+              self.document_key = document_key(f.read())
+          except OSError as e:
+            print(f"Could not read {self.path} for the answer cache: {e}")
         self.agent = RAGAGENT(llm=llm, embedding_dim=1024, thought_agent_prompt=thought_agent_prompt, reasoning_agent_prompt=reasoning_agent_prompt, max_steps=max_steps, path = self.path )
         self.logs = []
         self.vector_memory = VectorMemory.from_defaults(vector_store=None,
@@ -60,50 +74,96 @@ class SUPERVISOR_AGENT:
       self.scratchpad = ""
       self.responses = []
       self.query = query
-      
-      if is_follow_up_question is False:
-          retriever_agent, page_num = retriever(self.path, query, self.top_k)
-          self.agent.page_num = page_num
-          self.agent.engine = RetrieverQueryEngine.from_args(retriever_agent, llm=llm)
-          self.agent.retriever = retriever_agent
-      else:
-          facts = self.vector_memory.get(query)
-          for i in range(len(facts)):
-            self.responses.append(facts[i].content)
-          self.scratchpad = f"Information :- {self.responses}"
-          
-      self.curr_tools = deepcopy(self.tools)
-      self.curr_tools_aux = deepcopy(self.tools_aux)
-      self.runs = 0
-
-      print("Enhanced Query : " + self.query)
-      
-      while (is_follow_up_question or self.responses == [] or self.responses[-1] != "end"):
-          agent_code, func_response = self.build_code()
-          if agent_code == None and func_response == None:
-              return None
-          self.responses.append(func_response)
-          self.scratchpad += '\n' + "Tool Call : " + str(agent_code.content) + "," + " Response : " + str(func_response)
 
-      final_response = self.llm.invoke(final_response_prompt.format_messages(query = self.query, code = self.scratchpad, responses = self.responses))
-      self.vector_memory.put(ChatMessage.from_str(final_response.content, "user"))
+      # Follow-up answers depend on the conversation, only standalone questions are cached
+      cache_keys = self.current_answer_cache_keys() if is_follow_up_question is False else None
+      cached = None
+      if cache_keys:
+          cached = self.answer_cache.lookup(query, *cache_keys, similarity_threshold=self.answer_similarity)
 
-      print("FINAL ANSWER : ", final_response.content)
-      self.logs.append([self.query, final_response.content])
+      if cached:
+          print(f"Answer cache hit (similarity {cached['similarity']:.3f}) for : {cached['query']}")
+          self.scratchpad = cached['scratchpad']
+          final_answer = cached['answer']
+      else:
+          # A follow-up to a cached answer has no retriever yet
+          if is_follow_up_question is False or self.agent.retriever is None:
+              retriever_agent, page_num = retriever(self.path, query, self.top_k)
+              self.agent.page_num = page_num
+              self.agent.engine = RetrieverQueryEngine.from_args(retriever_agent, llm=llm)
+              self.agent.retriever = retriever_agent
+          if is_follow_up_question:
+              facts = self.vector_memory.get(query)
+              for i in range(len(facts)):
+                self.responses.append(facts[i].content)
+              self.scratchpad = f"Information :- {self.responses}"
+
+          self.curr_tools = deepcopy(self.tools)
+          self.curr_tools_aux = deepcopy(self.tools_aux)
+          self.runs = 0
+
+          print("Enhanced Query : " + self.query)
+
+          while (is_follow_up_question or self.responses == [] or self.responses[-1] != "end"):
+              agent_code, func_response = self.build_code()
+              if agent_code == None and func_response == None:
+                  return None
+              self.responses.append(func_response)
+              self.scratchpad += '\n' + "Tool Call : " + str(agent_code.content) + "," + " Response : " + str(func_response)
+
+          final_response = self.llm.invoke(final_response_prompt.format_messages(query = self.query, code = self.scratchpad, responses = self.responses))
+          final_answer = final_response.content
+          if cache_keys:
+              # Tools may have been added while answering
+              cache_keys = self.current_answer_cache_keys()
+          if cache_keys:
+              self.answer_cache.store(self.query, final_answer, self.scratchpad, *cache_keys)
+
+      self.vector_memory.put(ChatMessage.from_str(final_answer, "user"))
+
+      print("FINAL ANSWER : ", final_answer)
+      self.logs.append([self.query, final_answer])
 
       feedback = input("That's that, so are there any follow up questions? ")
       if feedback.lower() == "no":
         if self.agent.cache_index.process_pending_additions():
           pass
-        return final_response.content
+        return final_answer
       else:
         if self.agent.cache_index.process_pending_additions():
           pass
+        # Suggestions are drawn from the utility queries in memory
+        self.drain_enrichment()
         print("Here are some query suggestions that you may want to ask:",self.agent.get_random_questions_from_metadata())
         query = input("Kindly enter the follow up question : ")
         sub_ans = self.run(query, True)
         return sub_ans
 
+    def drain_enrichment(self, timeout = None):
+      """
+      Wait for the memory enrichment queued by the RAG agent's steps, e.g. when the chat goes idle.
+
+      Args:
+          timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+      Returns:
+          bool: True if no enrichment job is left.
+      """
+      return self.agent.drain_enrichment(timeout)
+
+    def current_answer_cache_keys(self):
+      """
+      Keys of the answer cache for the document and the current tool set. Answers cached under
+      other keys are left to the cache's eviction, lookups never match them.
+
+      Returns:
+          tuple: (document key, tool set fingerprint), or None if the answer cache is disabled or
+                 the document could not be read.
+      """
+      if self.answer_cache is None or self.document_key is None:
+        return None
+      return self.document_key, tools_key(self.tools)
+
     def api_reflexion(self, agent_code):
       """
       Perform two tasks related to tool management:
@@ -255,6 +315,7 @@ class SUPERVISOR_AGENT:
                     if self.agent.check_query_in_memory(query):
                         chunk = self.agent.check_memory_and_retrieve_for_supervisor(query)
                         func_response = llm_response_if_memory_hit_found(query, chunk)
+                        self.agent.record_lookup_outcome(func_response is not None)
                         agent_code = AgentCode(content="rag__agent")
                     else:
                         func_response, agent = self.tool_map[func_name](*[args_list, self.agent])
@@ -338,6 +399,7 @@ class SUPERVISOR_AGENT:
                 if self.agent.check_query_in_memory(query):
                     chunk = self.agent.check_memory_and_retrieve_for_supervisor(query)
                     func_response = llm_response_if_memory_hit_found(query, chunk)
+                    self.agent.record_lookup_outcome(func_response is not None)
                     agent_code = AgentCode(content="rag__agent")
                 else:
                     func_response, agent = self.tool_map[func_name](*[args_list, self.agent])
@@ -0,0 +1,151 @@
+import argparse
+import json
+import re
+import tempfile
+import threading
+import time
+import numpy as np
+from ragagent import RAGAGENT
+from scratchpad import estimate_tokens
+
+
+class SimulatedLLM:
+    def __init__(self, call_overhead=0.3, prefill_tps=5000, output_tps=250):
+        """
+        Stand-in for the synthesis LLM whose latency grows with prompt and output length, counting
+        every call.
+
+        Args:
+            call_overhead (float, optional): Seconds of network and queueing per call. Defaults to 0.3.
+            prefill_tps (float, optional): Prompt tokens processed per second. Defaults to 5000.
+            output_tps (float, optional): Output tokens generated per second. Defaults to 250.
+        """
+        self.call_overhead = call_overhead
+        self.prefill_tps = prefill_tps
+        self.output_tps = output_tps
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, output):
+        prompt_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(output)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.output_tokens += output_tokens
+        time.sleep(self.call_overhead + prompt_tokens / self.prefill_tps + output_tokens / self.output_tps)
+        return output
+
+    def complete(self, prompt):
+        """Batched synthesis call, answered with one summary per chunk of the prompt."""
+        count = len(re.findall(r'^CHUNK \d+:', prompt, re.MULTILINE))
+        output = json.dumps({
+            'summaries': [f"Summary of chunk {i}. " + "word " * 60 for i in range(1, count + 1)],
+            'answer': "Answer to the query. " + "word " * 100,
+        })
+
+        class Completion:
+            text = self.generate(prompt, output)
+        return Completion()
+
+
+class SimulatedEngine:
+    def __init__(self, llm, chunks, top_k):
+        """Stand-in for RetrieverQueryEngine: every query retrieves `top_k` chunks and synthesizes once."""
+        self.llm = llm
+        self.context = '\n\n'.join(chunks[:top_k])
+
+    def query(self, text):
+        return self.llm.generate(f"{self.context}\n\nQuery: {text}", "Synthesized response. " + "word " * 100)
+
+
+class SimulatedRetriever:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def retrieve(self, query):
+        class Node:
+            def __init__(self, text):
+                self.text = text
+        return [Node(chunk) for chunk in self.chunks]
+
+
+def simulated_agent(mode, llm, chunks, chunk_concurrency, path):
+    """
+    A RAGAGENT built with the simulated LLM as the LLM of its query engine, whose next step is a
+    RETRIEVAL that misses the memory. Memory writes and utility query generation are skipped, only
+    synthesis is measured.
+    """
+    agent = RAGAGENT(path=path, max_steps=100, share_memory=False, chunk_concurrency=chunk_concurrency,
+                     provider_concurrency={}, background_enrichment=False, synthesis_mode=mode,
+                     synthesis_llm=llm)
+    agent.engine = SimulatedEngine(llm, chunks, top_k=len(chunks))
+    agent.retriever = SimulatedRetriever(chunks)
+    agent.prompt_thought_agent = lambda: "\nTHOUGHT : RETRIEVAL: What was the revenue growth in 2023?"
+    agent.check_memory_and_retrieve = lambda query: None
+    agent.get_existing_graph_queries = lambda: []
+    agent.add_to_memory = lambda **kwargs: True
+    agent._enrich_memory = lambda *args: None
+    return agent
+
+
+def benchmark_step_synthesis(num_chunks=5, chunk_words=700, steps=3, chunk_concurrency=(1, 4),
+                             modes=('per_chunk', 'batched'), **llm_options):
+    """
+    Measure the LLM calls, tokens and latency of the synthesis of one RETRIEVAL step.
+
+    Args:
+        num_chunks (int): Chunks returned by the retriever. Defaults to 5.
+        chunk_words (int): Words per chunk, about 900 tokens by default.
+        steps (int): Steps timed per configuration.
+        chunk_concurrency (tuple): Values of RAGAGENT.chunk_concurrency to compare.
+        modes (tuple): Synthesis modes to compare.
+        **llm_options: Latency model of SimulatedLLM.
+
+    Returns:
+        list[dict]: One row per (mode, concurrency) with LLM calls, prompt and output tokens and mean
+        latency per step in ms.
+    """
+    chunks = [f"Chunk {i}. " + "word " * chunk_words for i in range(num_chunks)]
+    document = tempfile.NamedTemporaryFile(suffix='.pdf')
+    results = []
+    for mode in modes:
+        for concurrency in chunk_concurrency:
+            llm = SimulatedLLM(**llm_options)
+            agent = simulated_agent(mode, llm, chunks, concurrency, document.name)
+            latencies = []
+            for _ in range(steps):
+                tic = time.perf_counter()
+                agent.step()
+                latencies.append((time.perf_counter() - tic) * 1000)
+            results.append({
+                'mode': mode,
+                'concurrency': concurrency,
+                'llm_calls': llm.calls / steps,
+                'prompt_tokens': llm.prompt_tokens / steps,
+                'output_tokens': llm.output_tokens / steps,
+                'step_ms': float(np.mean(latencies)),
+            })
+    document.close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark per-chunk against batched synthesis of a RETRIEVAL step")
+    parser.add_argument('--chunks', type=int, default=5)
+    parser.add_argument('--chunk-words', type=int, default=700)
+    parser.add_argument('--steps', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--call-overhead', type=float, default=0.3, help="Seconds of overhead per LLM call")
+    parser.add_argument('--prefill-tps', type=float, default=5000, help="Prompt tokens per second")
+    parser.add_argument('--output-tps', type=float, default=250, help="Output tokens per second")
+    args = parser.parse_args()
+
+    results = benchmark_step_synthesis(args.chunks, args.chunk_words, args.steps, args.concurrency,
+                                       call_overhead=args.call_overhead, prefill_tps=args.prefill_tps,
+                                       output_tps=args.output_tps)
+    print(f"\n{'mode':<11}{'workers':>8}{'LLM calls':>11}{'prompt tok':>12}{'output tok':>12}{'step ms':>10}")
+    for row in results:
+        print(f"{row['mode']:<11}{row['concurrency']:>8}{row['llm_calls']:>11.1f}{row['prompt_tokens']:>12.0f}"
+              f"{row['output_tokens']:>12.0f}{row['step_ms']:>10.0f}")
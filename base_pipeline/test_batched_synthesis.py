@@ -0,0 +1,150 @@
+import importlib
+import json
+import re
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+from cache_metrics import shared_cache_metrics
+
+THOUGHT = "\nTHOUGHT : RETRIEVAL: What was the revenue growth in 2023?"
+
+
+def synthesis_output(prompt):
+    count = len(re.findall(r'^CHUNK \d+:', prompt, re.MULTILINE))
+    return json.dumps({'summaries': [f"Summary {i}" for i in range(1, count + 1)], 'answer': "Revenue grew 12%."})
+
+
+class CompletionLLM:
+    """llama-index LLM, as the query engine uses."""
+    def __init__(self, output=synthesis_output):
+        self.output = output
+        self.calls = 0
+
+    def complete(self, prompt):
+        self.calls += 1
+        return types.SimpleNamespace(text=self.output(prompt))
+
+
+class ChatModel:
+    """LangChain chat model, as the thought and reasoning prompts use. It has no `complete`."""
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        return types.SimpleNamespace(content=synthesis_output(prompt))
+
+
+class Engine:
+    def __init__(self):
+        self.calls = 0
+
+    def query(self, text):
+        self.calls += 1
+        return "Synthesized response"
+
+
+class Retriever:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def retrieve(self, query):
+        return [types.SimpleNamespace(text=chunk) for chunk in self.chunks]
+
+
+@pytest.fixture(scope='module')
+def ragagent():
+    # utils and retriever create API clients when imported, the agent only needs their names
+    utils = types.ModuleType('utils')
+    for name in ('rephrase_prompt', 'jargon_prompt', 'text_embed_model', 'chat_llm1', 'client_unstructured',
+                 'query_embed_model'):
+        setattr(utils, name, None)
+    utils.llm = CompletionLLM()
+    retriever = types.ModuleType('retriever')
+    retriever.table_summary = retriever.image_summary = lambda *args: ''
+    with mock.patch.dict(sys.modules, {'utils': utils, 'retriever': retriever}):
+        sys.modules.pop('ragagent', None)
+        yield importlib.import_module('ragagent')
+
+
+@pytest.fixture
+def make_agent(ragagent, tmp_path):
+    document = tmp_path / 'document.pdf'
+    document.write_bytes(b'%PDF-1.4')
+
+    def make(chunks, **kwargs):
+        agent = ragagent.RAGAGENT(llm=ChatModel(), path=str(document), share_memory=False,
+                                  background_enrichment=False, **kwargs)
+        agent.engine = Engine()
+        agent.retriever = Retriever(chunks)
+        agent.prompt_thought_agent = lambda: THOUGHT
+        agent.check_memory_and_retrieve = lambda query: None
+        agent.get_existing_graph_queries = lambda: []
+        agent.add_to_memory = lambda **kwargs: True
+        agent._enrich_memory = lambda *args: None
+        return agent
+    return make
+
+
+def fallbacks(reason):
+    return sum(counter['value'] for counter in shared_cache_metrics.snapshot()['counters']
+               if counter['name'] == 'synthesis_fallbacks_total' and counter['labels'].get('reason') == reason)
+
+
+CHUNKS = [f"Chunk {i} about revenue." for i in range(5)]
+
+
+def test_synthesis_uses_the_query_engine_llm(ragagent, make_agent):
+    agent = make_agent(CHUNKS)
+    assert agent.synthesis_llm is ragagent.query_engine_llm
+    assert agent.synthesis_llm is not agent.llm
+
+
+def test_batched_step_makes_one_llm_call(ragagent, make_agent, monkeypatch):
+    engine_llm = CompletionLLM()
+    monkeypatch.setattr(ragagent, 'query_engine_llm', engine_llm)
+    agent = make_agent(CHUNKS)
+
+    agent.step()
+
+    assert engine_llm.calls == 1
+    assert agent.engine.calls == 0
+    assert agent.llm.calls == 0
+    assert agent.agent_input.count('OBSERVATION:') == len(CHUNKS) + 1
+    assert agent.agent_input.endswith('OBSERVATION: Revenue grew 12%.')
+
+
+def test_per_chunk_step_queries_the_engine_per_chunk_and_for_the_query(make_agent):
+    agent = make_agent(CHUNKS, synthesis_mode='per_chunk', synthesis_llm=CompletionLLM())
+
+    agent.step()
+
+    assert agent.synthesis_llm.calls == 0
+    assert agent.engine.calls == len(CHUNKS) + 1
+
+
+def test_chat_model_synthesis_is_invoked(make_agent):
+    agent = make_agent(CHUNKS, synthesis_llm=ChatModel())
+
+    agent.step()
+
+    assert agent.synthesis_llm.calls == 1
+    assert agent.engine.calls == 0
+
+
+def test_unusable_synthesis_falls_back_and_is_counted(make_agent):
+    errors, mismatches = fallbacks('error'), fallbacks('mismatch')
+
+    agent = make_agent(CHUNKS, synthesis_llm=CompletionLLM(output=lambda prompt: "not json"))
+    agent.step()
+    assert agent.engine.calls == len(CHUNKS) + 1
+    assert fallbacks('error') == errors + 1
+
+    agent = make_agent(CHUNKS, synthesis_llm=CompletionLLM(
+        output=lambda prompt: json.dumps({'summaries': ["only one"], 'answer': "x"})))
+    agent.step()
+    assert agent.engine.calls == len(CHUNKS) + 1
+    assert fallbacks('mismatch') == mismatches + 1
@@ -0,0 +1,83 @@
+from cache_metrics import CacheMetrics, Histogram
+
+
+class Index:
+    def __init__(self, name, entries, pending=0):
+        self.name = name
+        self.entries = entries
+        self.pending_additions = [None] * pending
+
+    def __len__(self):
+        return self.entries
+
+    def resident_bytes(self):
+        return self.entries * 64
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram((0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        histogram.observe(value)
+
+    assert histogram.snapshot() == {'buckets': {'0.1': 2, '0.5': 3, '+Inf': 4}, 'sum': 2.45, 'count': 4}
+
+
+def test_snapshot_groups_counters_by_labels():
+    metrics = CacheMetrics()
+    metrics.increment('cache_lookups_total', path='retrieve', outcome='hit')
+    metrics.increment('cache_lookups_total', outcome='hit', path='retrieve')
+    metrics.increment('cache_lookups_total', 3, path='retrieve', outcome='miss')
+
+    assert metrics.snapshot()['counters'] == [
+        {'name': 'cache_lookups_total', 'labels': {'outcome': 'hit', 'path': 'retrieve'}, 'value': 2},
+        {'name': 'cache_lookups_total', 'labels': {'outcome': 'miss', 'path': 'retrieve'}, 'value': 3},
+    ]
+
+
+def test_snapshot_reports_index_gauges_and_collectors():
+    metrics = CacheMetrics()
+    first, second, other = Index('memory', 10, pending=2), Index('memory', 5), Index('answers', 1)
+    for index in (first, second, other):
+        metrics.register_index(index)
+    metrics.register_collector('embedding_cache', lambda: {'hits': 4})
+    metrics.register_collector('broken', lambda: 1 / 0)
+
+    snapshot = metrics.snapshot()
+    assert snapshot['indexes'] == {'memory': {'indexes': 2, 'entries': 15, 'bytes': 960, 'pending': 2},
+                                   'answers': {'indexes': 1, 'entries': 1, 'bytes': 64, 'pending': 0}}
+    assert snapshot['embedding_cache'] == {'hits': 4}
+    assert 'error' in snapshot['broken']
+
+
+def test_render_prometheus():
+    metrics = CacheMetrics()
+    metrics.increment('cache_lookups_total', path='retrieve', outcome='hit')
+    metrics.observe('cache_lookup_seconds', 0.02, (0.01, 0.1), path='retrieve')
+    index = Index('memory', 3)
+    metrics.register_index(index)
+
+    assert metrics.render_prometheus().splitlines() == [
+        'cache_lookups_total{outcome="hit",path="retrieve"} 1',
+        'cache_lookup_seconds_bucket{path="retrieve",le="0.01"} 0',
+        'cache_lookup_seconds_bucket{path="retrieve",le="0.1"} 1',
+        'cache_lookup_seconds_bucket{path="retrieve",le="+Inf"} 1',
+        'cache_lookup_seconds_sum{path="retrieve"} 0.02',
+        'cache_lookup_seconds_count{path="retrieve"} 1',
+        'cache_indexes{index="memory"} 1',
+        'cache_entries{index="memory"} 3',
+        'cache_bytes{index="memory"} 192',
+        'cache_pending{index="memory"} 0',
+    ]
+
+
+def test_reset_keeps_registered_indexes():
+    metrics = CacheMetrics()
+    metrics.increment('cache_lookups_total')
+    metrics.observe('cache_lookup_seconds', 0.02)
+    index = Index('memory', 3)
+    metrics.register_index(index)
+
+    metrics.reset()
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == [] and snapshot['histograms'] == []
+    assert snapshot['indexes']['memory']['entries'] == 3
@@ -0,0 +1,274 @@
+import functools
+import json
+import os
+from contextlib import contextmanager
+
+import numpy as np
+import pytest
+
+import dynamic_cache_index
+from cache_benchmark import write_exact_search_threshold
+from dynamic_cache_index import DEFAULT_EXACT_SEARCH_THRESHOLD, DynamicCacheIndex, update_hnsw_config
+
+DIM = 16
+
+
+def vectors(count, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.standard_normal((count, DIM)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def make_cache(**kwargs):
+    kwargs.setdefault('exact_search_threshold', 0)
+    return DynamicCacheIndex(dim=DIM, **kwargs)
+
+
+def fill(cache, matrix):
+    ids = [cache.add_embedding(vector, {'query': f"query {i}", 'query_type': 'retrieval'})
+           for i, vector in enumerate(matrix)]
+    cache.process_pending_additions(force=True)
+    return ids
+
+
+def test_snapshot_round_trip(tmp_path):
+    matrix = vectors(40)
+    cache = make_cache()
+    ids = fill(cache, matrix)
+    cache.remove(ids[3])
+    pending_id = cache.add_embedding(vectors(1, seed=1)[0], {'query': "pending"})
+    cache.save_index(str(tmp_path / 'snapshot'))
+
+    loaded = make_cache()
+    loaded.load_index(str(tmp_path / 'snapshot'))
+
+    assert loaded.index_created
+    assert len(loaded) == len(cache)
+    assert loaded.get_entry(ids[3]) is None
+    assert loaded.get_entry(ids[7])['query'] == "query 7"
+    assert loaded.get_entry(pending_id)['query'] == "pending"
+    assert loaded.search(matrix[7], 1)[0][0] == ids[7]
+    # New entries continue the ids of the saved cache
+    assert loaded.add_embedding(vectors(1, seed=2)[0], {'query': "new"}) == pending_id + 1
+
+
+def test_save_index_keeps_the_save_data_argument(tmp_path):
+    cache = make_cache()
+    fill(cache, vectors(5))
+    cache.save_index(str(tmp_path / 'snapshot'), save_data=False)
+
+    assert os.path.exists(tmp_path / 'snapshot' / 'embeddings.npy')
+
+
+def test_id_redirects_survive_a_reload(tmp_path):
+    cache = make_cache(dedup_mode='near', near_duplicate_threshold=0.99)
+    matrix = vectors(10)
+    ids = fill(cache, matrix)
+    duplicate = cache.add_embedding(matrix[4], {'query': "same question, other words"}, flush=True)
+    assert cache.id_redirects == {duplicate: ids[4]}
+    cache.save_index(str(tmp_path / 'snapshot'))
+
+    with open(tmp_path / 'snapshot' / 'manifest.json') as f:
+        assert json.load(f)['id_redirects'] == {str(duplicate): ids[4]}
+
+    loaded = make_cache(dedup_mode='near', near_duplicate_threshold=0.99)
+    loaded.load_index(str(tmp_path / 'snapshot'))
+    assert loaded.id_redirects == {duplicate: ids[4]}
+    assert loaded.get_entry(duplicate)['query'] == "query 4"
+    assert [alias['query'] for alias in loaded.get_entry(ids[4])['aliases']] == ["same question, other words"]
+
+
+@pytest.mark.parametrize('threshold, graph_loaded', [(100, False), (30, True)])
+def test_graph_is_loaded_only_above_the_exact_search_threshold(tmp_path, threshold, graph_loaded):
+    matrix = vectors(50)
+    cache = make_cache()
+    ids = fill(cache, matrix)
+    cache.save_index(str(tmp_path / 'snapshot'))
+
+    loaded = make_cache(exact_search_threshold=threshold)
+    loaded.load_index(str(tmp_path / 'snapshot'))
+
+    assert loaded.index_created is graph_loaded
+    assert [result[0] for result in loaded.search(matrix[9], 3)][0] == ids[9]
+
+
+def test_incremental_flushes_add_delta_graphs_until_consolidated():
+    matrix = vectors(40)
+    cache = make_cache(index_mode='incremental', max_segments=2)
+    ids = fill(cache, matrix[:10])
+    assert cache.index_created and cache.segments == []
+
+    ids += fill(cache, matrix[10:20])
+    ids += fill(cache, matrix[20:30])
+    assert [(first, end) for _, first, end in cache.segments] == [(10, 20), (20, 30)]
+    assert cache.indexed_upto == 10
+    # Rows of the main graph and of both delta graphs are found
+    for i in (2, 15, 27):
+        assert cache.search(matrix[i], 1)[0][0] == ids[i]
+
+    ids += fill(cache, matrix[30:40])
+    assert cache.segments == []
+    assert cache.indexed_upto == 40
+    for i in (2, 15, 27, 38):
+        assert cache.search(matrix[i], 1)[0][0] == ids[i]
+
+
+def test_small_caches_are_searched_exactly():
+    matrix = vectors(50)
+    cache = make_cache(exact_search_threshold=100)
+    ids = fill(cache, matrix)
+    assert not cache.index_created
+
+    query = vectors(1, seed=3)[0]
+    distances = 1.0 - matrix @ query
+    results = cache.search(query, 5)
+    assert [result[0] for result in results] == [ids[i] for i in np.argsort(distances)[:5]]
+
+
+def test_measured_exact_search_threshold_is_loaded_at_construction(tmp_path, monkeypatch):
+    path = str(tmp_path / 'hnsw_config.json')
+    monkeypatch.setattr(dynamic_cache_index, 'load_hnsw_config',
+                        functools.partial(dynamic_cache_index.load_hnsw_config, path=path))
+    assert DynamicCacheIndex(dim=DIM).exact_search_threshold == DEFAULT_EXACT_SEARCH_THRESHOLD
+
+    update_hnsw_config({'index_params': {'M': 24, 'post': 2}, 'query_params': {'efSearch': 64}}, path)
+    write_exact_search_threshold(512, path, sizes=[256, 512])
+
+    with open(path) as f:
+        config = json.load(f)
+    assert config['exact_search_threshold'] == 512
+    assert config['index_params'] == {'M': 24, 'post': 2}
+    cache = DynamicCacheIndex(dim=DIM)
+    assert cache.exact_search_threshold == 512
+    assert cache.query_params == {'efSearch': 64}
+    assert DynamicCacheIndex(dim=DIM, exact_search_threshold=64).exact_search_threshold == 64
+
+
+@pytest.mark.parametrize('storage, options', [('float16', {}), ('int8', {}),
+                                              ('pq', {'pq_subspaces': 4, 'pq_train_size': 300})])
+def test_quantized_storage_keeps_recall_in_less_memory(storage, options):
+    matrix, queries = vectors(600), vectors(20, seed=4)
+    float32 = make_cache(exact_search_threshold=1000)
+    fill(float32, matrix)
+    cache = make_cache(exact_search_threshold=1000, storage=storage, **options)
+    ids = fill(cache, matrix)
+
+    expected = np.argsort(1.0 - queries @ matrix.T, axis=1)[:, :10]
+    found = [[result[0] for result in results] for results in cache.search_batch(queries, 10)]
+    recall = np.mean([len({ids[i] for i in row} & set(result)) / 10 for row, result in zip(expected, found)])
+
+    assert cache.quantizer is not None
+    assert recall >= 0.9
+    assert cache.resident_bytes() < float32.resident_bytes()
+
+
+@pytest.mark.parametrize('policy, kept_hits, evicted', [('lru', (0, 1), (2, 3)), ('lfu', (7, 7, 8), (0, 1))])
+def test_eviction_policies(policy, kept_hits, evicted):
+    cache = make_cache(eviction_policy=policy)
+    ids = fill(cache, vectors(10))
+    for i in kept_hits:
+        cache.record_hit(ids[i])
+
+    cache.max_entries = 8
+    assert cache.evict() == 2
+    assert len(cache) == 8
+    assert all(cache.get_entry(ids[i]) is None for i in evicted)
+    assert all(cache.get_entry(ids[i]) is not None for i in kept_hits)
+
+
+def test_ttl_expires_entries_by_their_timestamp():
+    cache = make_cache(ttl_seconds=3600)
+    old, new = vectors(2)
+    old_id = cache.add_embedding(old, {'query': "old", 'timestamp': "2020-01-01T00:00:00"})
+    new_id = cache.add_embedding(new, {'query': "new"})
+    cache.process_pending_additions(force=True)
+
+    assert cache.get_entry(old_id) is None
+    assert cache.get_entry(new_id)['query'] == "new"
+    assert cache.stats['expirations'] == 1
+
+
+def test_compaction_reclaims_tombstoned_rows_and_keeps_ids():
+    matrix = vectors(20)
+    cache = make_cache(compaction_ratio=0.25)
+    ids = fill(cache, matrix[:16])
+    for chunk_id in ids[:5]:
+        cache.remove(chunk_id)
+    ids += fill(cache, matrix[16:])
+
+    assert cache.tombstones == set()
+    assert cache.stats['compactions'] == 1
+    assert len(cache) == 15
+    for i in (5, 12, 19):
+        assert cache.search(matrix[i], 1)[0][0] == ids[i]
+    assert all(result[0] not in ids[:5] for result in cache.search(matrix[0], 15))
+
+
+def filtered_cache(exact_search_threshold):
+    matrix = vectors(60)
+    cache = make_cache(exact_search_threshold=exact_search_threshold)
+    ids = [cache.add_embedding(vector, {'query': f"query {i}", 'query_type': ('retrieval', 'original')[i % 2],
+                                        'timestamp': f"2024-01-{1 + i % 28:02d}T00:00:00"})
+           for i, vector in enumerate(matrix)]
+    cache.process_pending_additions(force=True)
+    return cache, matrix, ids
+
+
+@pytest.mark.parametrize('exact_search_threshold', [0, 1000])
+def test_filtered_search_returns_only_matching_entries(exact_search_threshold):
+    cache, matrix, ids = filtered_cache(exact_search_threshold)
+
+    results = cache.search(matrix[3], 5, filters={'query_type': 'original'})
+    assert results[0][0] == ids[3]
+    assert len(results) == 5
+    assert all(metadata['query_type'] == 'original' for _, _, metadata in results)
+
+    # The closest entry is a 'retrieval' one, so it is filtered out
+    assert ids[4] not in [result[0] for result in cache.search(matrix[4], 5, filters={'query_type': 'original'})]
+
+    results = cache.search(matrix[10], 5, filters={'query_type': ['retrieval', 'original'],
+                                                    'timestamp': {'gte': "2024-01-10", 'lt': "2024-01-20"}})
+    assert results[0][0] == ids[10]
+    assert all("2024-01-10" <= metadata['original_metadata']['timestamp'] < "2024-01-20"
+               for _, _, metadata in results)
+
+
+def test_range_filters_are_only_supported_on_timestamp():
+    cache, matrix, _ = filtered_cache(0)
+    with pytest.raises(ValueError):
+        cache._matching_ids({'query': {'gte': "a"}})
+    assert cache.search(matrix[0], 5, filters={'query': {'gte': "a"}}) == []
+
+
+class RecordingLimits:
+    def __init__(self):
+        self.held = []
+        self.calls = []
+
+    @contextmanager
+    def acquire(self, provider):
+        self.held.append(provider)
+        try:
+            yield
+        finally:
+            self.held.remove(provider)
+
+
+def test_embedding_requests_hold_an_embedding_slot():
+    limits = RecordingLimits()
+
+    class Model:
+        def get_text_embedding_batch(self, texts):
+            limits.calls.append((len(texts), list(limits.held)))
+            return list(vectors(len(texts)))
+
+    cache = make_cache(provider_limits=limits)
+    cache.text_embed_model = Model()
+    for i in range(3):
+        cache.add_chunk(f"chunk {i}", {'query': f"query {i}"})
+    # Queuing a chunk makes no request
+    assert limits.calls == []
+
+    cache.process_pending_additions(force=True)
+    assert limits.calls == [(3, ['embedding'])]
+    assert len(cache) == 3
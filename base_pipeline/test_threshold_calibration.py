@@ -0,0 +1,75 @@
+import pytest
+
+from hit_thresholds import LookupLog, load_hit_thresholds, read_lookup_log
+from threshold_calibration import THRESHOLD_MARGIN, fit_threshold, fit_thresholds, write_thresholds
+
+
+def record(path, query_type, distance, sufficient):
+    return {'path': path, 'query_type': query_type, 'distance': distance, 'sufficient': sufficient}
+
+
+def test_fit_threshold_takes_the_largest_threshold_at_the_target_precision():
+    samples = [(0.05, True), (0.1, True), (0.15, True), (0.2, False), (0.25, True), (0.3, False), (0.4, False)]
+
+    fit = fit_threshold(samples, target_precision=0.8)
+
+    # Hits up to 0.25 are 4 sufficient out of 5, the threshold falls between 0.25 and 0.3
+    assert fit['threshold'] == pytest.approx(0.275)
+    assert fit['precision'] == pytest.approx(0.8)
+    assert fit['hit_rate'] == pytest.approx(5 / 7)
+    assert fit['samples'] == 7
+
+
+def test_fit_threshold_edge_cases():
+    assert fit_threshold([(0.1, False), (0.2, False)])['threshold'] == 0.0
+    assert fit_threshold([(0.1, True), (0.2, True)])['threshold'] == pytest.approx(0.2 + THRESHOLD_MARGIN)
+    # Samples at the same distance are accepted or rejected together
+    assert fit_threshold([(0.1, True), (0.2, True), (0.2, False)], target_precision=0.9)['threshold'] == \
+        pytest.approx(0.15)
+
+
+def test_fit_thresholds_per_path_and_query_type():
+    records = ([record('retrieve', 'retrieval', 0.1 * i, i < 3) for i in range(6)]
+               + [record('retrieve', 'original', 0.05 * i, True) for i in range(6)]
+               + [record('retrieve', 'jargon', 0.1, True)]
+               + [record('supervisor', 'retrieval', 0.1, True), record('unknown_path', 'retrieval', 0.1, True)]
+               + [record('retrieve', 'retrieval', 0.01, None)])
+
+    thresholds, fits = fit_thresholds(records, target_precision=1.0, min_samples=5)
+
+    assert set(thresholds) == {'retrieve'}
+    assert thresholds['retrieve']['query_types'] == {'original': pytest.approx(0.25 + THRESHOLD_MARGIN),
+                                                     'retrieval': pytest.approx(0.25)}
+    # Over all 13 labelled lookups of the path the first miss is at 0.3
+    assert thresholds['retrieve']['default'] == pytest.approx(0.275)
+    assert {(fit['path'], fit['query_type']) for fit in fits} == {('retrieve', '*'), ('retrieve', 'original'),
+                                                                  ('retrieve', 'retrieval')}
+
+
+def test_written_thresholds_are_loaded(tmp_path):
+    path = str(tmp_path / 'hit_thresholds.json')
+    thresholds = {'retrieve': {'default': 0.2, 'query_types': {'original': 0.25}},
+                  'supervisor': {'default': None, 'query_types': {}}}
+
+    write_thresholds(thresholds, path, target_precision=0.9)
+
+    assert load_hit_thresholds(path) == thresholds
+
+
+def test_read_lookup_log_merges_outcomes(tmp_path):
+    path = str(tmp_path / 'lookups.jsonl')
+    log = LookupLog(path)
+    hit = log.record('retrieve', "revenue 2023", "revenue in 2023", 'retrieval', 0.1, 0.2, True, chunk="...")
+    miss = log.record('retrieve', "ceo name", "revenue in 2023", 'retrieval', 0.6, 0.2, False)
+    unanswered = log.record('supervisor', "margin", "gross margin", 'original', 0.15, 0.2, True)
+    log.record_outcome([hit], sufficient=True)
+    log.record_outcome([miss], sufficient=False)
+    log.record_outcome(['unknown id'], sufficient=True)
+    with open(path, 'a') as f:
+        f.write('{"id": "cut short')
+
+    records = read_lookup_log(path)
+
+    assert [entry['id'] for entry in records] == [hit, miss, unanswered]
+    assert [entry['sufficient'] for entry in records] == [True, False, None]
+    assert records[0]['chunk'] == "..." and records[0]['distance'] == 0.1
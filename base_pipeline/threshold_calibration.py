@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from hit_thresholds import HIT_THRESHOLDS_PATH, LOOKUP_PATHS, read_lookup_log
+
+# Margin added above the largest accepted distance when no farther sample bounds the threshold
+THRESHOLD_MARGIN = 1e-6
+
+
+def label_records(records, max_records=None, max_workers=4):
+    """
+    Replay logged lookups without an outcome through llm_response_if_memory_hit_found, as the
+    supervisor does on a memory hit, and record whether the chunk answered the query.
+
+    Misses are only labelled this way, so they are what lets a threshold grow beyond the one the
+    log was recorded with.
+
+    Args:
+        records (list[dict]): Output of read_lookup_log, updated in place.
+        max_records (int, optional): Maximum number of lookups to replay, nearest first.
+        max_workers (int, optional): Concurrent LLM calls. Defaults to 4.
+
+    Returns:
+        int: Number of lookups labelled.
+    """
+    from utils import llm_response_if_memory_hit_found
+
+    pending = sorted((record for record in records if record['sufficient'] is None and record.get('chunk')),
+                     key=lambda record: record['distance'])[:max_records]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = list(executor.map(lambda record: llm_response_if_memory_hit_found(record['query'], record['chunk']),
+                                      pending))
+    for record, response in zip(pending, responses):
+        record['sufficient'] = response is not None
+    return len(pending)
+
+
+def fit_threshold(samples, target_precision=0.9):
+    """
+    Largest distance threshold at which the share of sufficient chunks among hits reaches
+    `target_precision`, i.e. the one with the highest hit rate at that precision.
+
+    Args:
+        samples (list[tuple]): (distance, sufficient) pairs.
+        target_precision (float, optional): Minimum share of hits whose chunk was sufficient.
+            Defaults to 0.9.
+
+    Returns:
+        dict: 'threshold' (maximum distance of a hit, 0.0 if the precision is never reached),
+        'precision' and 'hit_rate' over the samples, and 'samples'.
+    """
+    samples = sorted(samples)
+    best = {'threshold': 0.0, 'precision': None, 'hit_rate': 0.0, 'samples': len(samples)}
+    sufficient = 0
+    for i, (distance, ok) in enumerate(samples):
+        sufficient += bool(ok)
+        # A threshold cannot separate samples at the same distance
+        if i + 1 < len(samples) and samples[i + 1][0] == distance:
+            continue
+        precision = sufficient / (i + 1)
+        if precision >= target_precision:
+            following = samples[i + 1][0] if i + 1 < len(samples) else None
+            best = {
+                'threshold': (distance + following) / 2 if following is not None else distance + THRESHOLD_MARGIN,
+                'precision': precision,
+                'hit_rate': (i + 1) / len(samples),
+                'samples': len(samples),
+            }
+    return best
+
+
+def fit_thresholds(records, target_precision=0.9, min_samples=20):
+    """
+    Fit a threshold for every lookup path and query type with enough labelled lookups, plus a
+    default per path over all of its query types.
+
+    Args:
+        records (list[dict]): Lookup records with their outcome.
+        target_precision (float, optional): See `fit_threshold`. Defaults to 0.9.
+        min_samples (int, optional): Labelled lookups needed to fit a threshold. Defaults to 20.
+
+    Returns:
+        tuple: (thresholds, fits) where thresholds is {path: {'default', 'query_types'}} as loaded
+        by load_hit_thresholds and fits lists the statistics of every fitted threshold.
+    """
+    groups = {}
+    for record in records:
+        if record['sufficient'] is None or record['path'] not in LOOKUP_PATHS:
+            continue
+        sample = (record['distance'], record['sufficient'])
+        groups.setdefault((record['path'], None), []).append(sample)
+        groups.setdefault((record['path'], record.get('query_type') or 'unknown'), []).append(sample)
+
+    thresholds, fits = {}, []
+    for (path, query_type), samples in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1] or '')):
+        if len(samples) < min_samples:
+            continue
+        fit = fit_threshold(samples, target_precision)
+        entry = thresholds.setdefault(path, {'default': None, 'query_types': {}})
+        if query_type is None:
+            entry['default'] = fit['threshold']
+        else:
+            entry['query_types'][query_type] = fit['threshold']
+        fits.append({'path': path, 'query_type': query_type or '*', **fit})
+    return thresholds, fits
+
+
+def write_thresholds(thresholds, path=HIT_THRESHOLDS_PATH, **details):
+    """
+    Write fitted thresholds as the file RAGAGENT loads at startup.
+
+    Args:
+        thresholds (dict): First output of `fit_thresholds`.
+        path (str, optional): Thresholds file. Defaults to HIT_THRESHOLDS_PATH.
+        **details: Extra information recorded next to the thresholds, e.g. the fit statistics.
+    """
+    config = {'thresholds': thresholds, 'calibrated_at': datetime.now().isoformat(), **details}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(config, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fit per-query-type hit thresholds of the RAGAGENT memory")
+    parser.add_argument('log', help="Lookup log written by RAGAGENT(lookup_log=...)")
+    parser.add_argument('--target-precision', type=float, default=0.9)
+    parser.add_argument('--min-samples', type=int, default=20)
+    parser.add_argument('--label', action='store_true',
+                        help="Replay lookups without an outcome through the LLM before fitting")
+    parser.add_argument('--max-label', type=int, help="Maximum number of lookups to replay")
+    parser.add_argument('--output', default=HIT_THRESHOLDS_PATH)
+    parser.add_argument('--dry-run', action='store_true', help="Print the thresholds without writing them")
+    args = parser.parse_args()
+
+    records = read_lookup_log(args.log)
+    if args.label:
+        print(f"Labelled {label_records(records, args.max_label)} lookups")
+    labelled = sum(record['sufficient'] is not None for record in records)
+    print(f"{len(records)} lookups, {labelled} with an outcome")
+
+    thresholds, fits = fit_thresholds(records, args.target_precision, args.min_samples)
+    print(f"\n{'path':<13}{'query type':<13}{'samples':>9}{'threshold':>11}{'precision':>11}{'hit rate':>10}")
+    for fit in fits:
+        precision = f"{fit['precision']:.3f}" if fit['precision'] is not None else '-'
+        print(f"{fit['path']:<13}{fit['query_type']:<13}{fit['samples']:>9}{fit['threshold']:>11.4f}"
+              f"{precision:>11}{fit['hit_rate']:>10.3f}")
+
+    if not fits:
+        print(f"\nNo path or query type has {args.min_samples} labelled lookups, nothing to write")
+    elif not args.dry_run:
+        write_thresholds(thresholds, args.output, target_precision=args.target_precision,
+                         min_samples=args.min_samples, log=args.log, fits=fits)
+        print(f"\nThresholds written to {args.output}")
@@ -3,6 +3,8 @@ import json
 import re
 import numpy as np
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import shared_embedding_cache
 
 def create_utility_query_prompt(template=None, number=3, data=None):
     """
@@ -46,9 +48,10 @@ class UtilityQueryGenerator:
         llm (object): Language model object used for generating queries.
         embedding_model (object): Model for calculating text embeddings.
         similarity_threshold (float): Threshold for determining query similarity.
+        embedding_cache (EmbeddingCache): Memo the query embeddings are looked up in.
     """
 
-    def __init__(self, llm, embedding_model, similarity_threshold=0.8):
+    def __init__(self, llm, embedding_model, similarity_threshold=0.8, embedding_cache=shared_embedding_cache):
         """
         Initialize the UtilityQueryGenerator with LLM and embedding model.
 
@@ -56,14 +59,18 @@ class UtilityQueryGenerator:
             llm (object): Language model instance.
             embedding_model (object): Embedding model instance.
             similarity_threshold (float): Similarity threshold for query filtering. Defaults to 0.8.
+            embedding_cache (EmbeddingCache, optional): Embedding memo. Defaults to the memo shared
+                                                        with RAGAGENT and DynamicCacheIndex.
         """
         self.llm = llm
         self.embedding_model = embedding_model
         self.similarity_threshold = similarity_threshold
+        self.embedding_cache = embedding_cache
 
     def generate_queries(self, chunk: str, max_retries: int = 1,
                          existing_graph_queries: List[str] = None,
-                         max_queries: int = 3) -> List[str]:
+                         max_queries: int = 3,
+                         query_index=None) -> List[str]:
         """
         Generate distinct and relevant queries based on the given data chunk.
 
@@ -72,6 +79,8 @@ class UtilityQueryGenerator:
             max_retries (int): Maximum number of retries for generating queries. Defaults to 3.
             existing_graph_queries (List[str], optional): Existing queries to filter against. Defaults to None.
             max_queries (int): Maximum number of queries to generate. Defaults to 3.
+            query_index (DynamicCacheIndex, optional): Index of existing query embeddings, passed on to
+                                                       `filter_queries`. Defaults to None.
 
         Returns:
             List[str]: Filtered list of generated queries.
@@ -105,7 +114,7 @@ class UtilityQueryGenerator:
                 if not potential_queries:
                     continue
 
-                filtered_queries = self.filter_queries(potential_queries, existing_graph_queries)
+                filtered_queries = self.filter_queries(potential_queries, existing_graph_queries, query_index)
 
                 print("Generated Queries:")
                 for q in filtered_queries:
@@ -119,6 +128,40 @@ class UtilityQueryGenerator:
         print("Failed to generate utility queries after max retries")
         return []
 
+    def generate_queries_batch(self, chunks: List[str], max_queries: int = 3, max_workers: int = 4,
+                               query_index=None) -> List[List[str]]:
+        """
+        Generate queries for many chunks at once, e.g. to prewarm the memory cache of a document.
+
+        The LLM calls of different chunks run concurrently. Queries similar to one kept for an
+        earlier chunk are then dropped, comparing embeddings that are already memoized.
+
+        Args:
+            chunks (List[str]): Data chunks.
+            max_queries (int): Maximum number of queries per chunk. Defaults to 3.
+            max_workers (int): Maximum number of concurrent LLM calls. Defaults to 4.
+            query_index (DynamicCacheIndex, optional): Index of existing query embeddings, see
+                                                       `filter_queries`. Defaults to None.
+
+        Returns:
+            List[List[str]]: Queries of every chunk, in the order of `chunks`.
+        """
+        if not chunks:
+            return []
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            chunk_queries = list(pool.map(
+                lambda chunk: self.generate_queries(chunk, max_queries=max_queries, query_index=query_index),
+                chunks))
+
+        kept = set(self.filter_queries([query for queries in chunk_queries for query in queries], []))
+        seen = set()
+        results = []
+        for queries in chunk_queries:
+            results.append([query for query in queries if query in kept and query not in seen])
+            seen.update(results[-1])
+        return results
+
     def parse_json_response(self, response):
         """
         Parse JSON response robustly with multiple fallback strategies.
@@ -162,8 +205,8 @@ class UtilityQueryGenerator:
             float: Cosine similarity between the two queries.
         """
         try:
-            emb1 = self.embedding_model.get_text_embedding(query1)
-            emb2 = self.embedding_model.get_text_embedding(query2)
+            emb1 = self.embedding_cache.get_text_embedding(self.embedding_model, query1)
+            emb2 = self.embedding_cache.get_text_embedding(self.embedding_model, query2)
 
             dot_product = np.dot(emb1, emb2)
             norm1 = np.linalg.norm(emb1)
@@ -174,40 +217,75 @@ class UtilityQueryGenerator:
             print(f"Similarity calculation error: {e}")
             return 0.0
 
-    def filter_queries(self, queries: List[str], existing_graph_queries: List[str]) -> List[str]:
+    def filter_queries(self, queries: List[str], existing_graph_queries: List[str],
+                       query_index=None) -> List[str]:
         """
         Filter queries to ensure uniqueness and relevance.
 
+        All candidate queries (and existing graph queries) are embedded with one batched request
+        and compared with matrix products instead of one embedding call per pair.
+
         Args:
             queries (List[str]): List of generated queries.
             existing_graph_queries (List[str]): Existing queries to filter against.
+            query_index (DynamicCacheIndex, optional): Index holding embeddings of the existing queries.
+                                                       When given, candidates are checked against it with
+                                                       one `search_batch` call and `existing_graph_queries`
+                                                       is not re-embedded. Defaults to None.
 
         Returns:
             List[str]: Filtered list of unique queries.
         """
         print("\nQuery Filtering Process:")
-        filtered_queries = []
+        queries = [query for query in queries if query]
+        if not queries:
+            return []
+
+        try:
+            candidates = self.embed_queries(queries)
+        except Exception as e:
+            print(f"Similarity calculation error: {e}")
+            return queries
+
+        is_unique = np.ones(len(queries), dtype=bool)
+        if query_index is not None:
+            # Cosine distance below 1 - threshold means similarity above the threshold
+            for i, results in enumerate(query_index.search_batch(candidates, k=1)):
+                if results and 1.0 - results[0][1] > self.similarity_threshold:
+                    is_unique[i] = False
+        elif existing_graph_queries:
+            try:
+                existing = self.embed_queries(existing_graph_queries)
+                is_unique &= (candidates @ existing.T).max(axis=1) <= self.similarity_threshold
+            except Exception as e:
+                print(f"Similarity calculation error: {e}")
 
-        for query in queries:
-            if not query:
+        filtered_queries = []
+        accepted = []
+        similarities = candidates @ candidates.T
+        for i, query in enumerate(queries):
+            if not is_unique[i]:
                 continue
+            if accepted and similarities[i, accepted].max() > self.similarity_threshold:
+                continue
+
+            accepted.append(i)
+            filtered_queries.append(query)
+            print(f"Accepted query: {query}")
+
+        return filtered_queries
 
-            is_unique = True
-            for graph_query in existing_graph_queries:
-                similarity = self.calculate_query_similarity(query, graph_query)
-                if similarity > self.similarity_threshold:
-                    is_unique = False
-                    break
-
-            if is_unique:
-                for filtered_query in filtered_queries:
-                    similarity = self.calculate_query_similarity(query, filtered_query)
-                    if similarity > self.similarity_threshold:
-                        is_unique = False
-                        break
-
-            if is_unique:
-                filtered_queries.append(query)
-                print(f"Accepted query: {query}")
-
-        return filtered_queries
\ No newline at end of file
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Embed queries with a single batched request for the ones not in the embedding memo.
+
+        Args:
+            queries (List[str]): Query texts.
+
+        Returns:
+            np.ndarray: Unit-norm embeddings, one row per query.
+        """
+        embeddings = np.asarray(self.embedding_cache.get_text_embedding_batch(self.embedding_model, list(queries)),
+                                dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, np.finfo(np.float32).tiny)
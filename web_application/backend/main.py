@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, BackgroundTasks
 from pydantic import BaseModel
 from typing import List , Optional
 import uvicorn
@@ -512,9 +512,22 @@ async def process_query(chat_id: str, query: Query, db: Session = Depends(db.get
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def prewarm_document_cache(chat_id: str, file_url: str):
+    # Lets the model service build the document's memory cache before the first question
+    try:
+        requests.post(
+            url=f"{backend_url}/1/{chat_id}/prewarm",
+            data=json.dumps({"url": file_url}),
+            headers=_get_request_headers(),
+            timeout=60
+        )
+    except Exception as e:
+        print(f"Error requesting cache prewarm: {str(e)}")
+
 @app.post("/chats/{chat_id}/upload")
 async def upload_file(
     chat_id: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: Session = Depends(db.get_db)
 ):
@@ -530,6 +543,8 @@ async def upload_file(
         
         # Upload to S3 and get URL
         file_url = upload_file_to_s3(file_content, unique_filename)
+        if file_url:
+            background_tasks.add_task(prewarm_document_cache, str(chat_uuid), file_url)
         
         return {
             "filename": unique_filename,
@@ -1,12 +1,15 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from rag_agent.supervisor import SUPERVISOR_AGENT
 from rag_agent.default_tools import TOOLS, TOOLS_AUX, TOOL_MAP
-from rag_agent.utils import chat_llm
+from rag_agent.utils import chat_llm, enrichment_drain_timeout
+from rag_agent.cache_prewarm import start_prewarm
+from rag_agent.cache_metrics import shared_cache_metrics
 import nltk
 import dill as pickle
 import os
 from io import BytesIO
 import requests
+import threading
 from flask_cors import CORS
 import fitz
 from copy import deepcopy
@@ -38,12 +41,37 @@ def query(id, chat_id):
         class_supervisors[id].append(supervisor)
         output = supervisor.run(data["query"])
         
-        return jsonify({ "response" : output }) 
+        response = jsonify({ "response" : output })
+        # The chat is idle once the answer is sent
+        response.call_on_close(lambda: supervisor.drain_enrichment(timeout=enrichment_drain_timeout))
+        return response
     
     
     output = supervisor.run(data["query"], True)
     
-    return jsonify({ "response" : output })
+    response = jsonify({ "response" : output })
+    response.call_on_close(lambda: supervisor.drain_enrichment(timeout=enrichment_drain_timeout))
+    return response
+
+@app.route('/<string:id>/<string:chat_id>/prewarm', methods=['POST'])
+def prewarm(id, chat_id):
+    #POST request with{
+    #   'url' : ''
+    # }
+    # Downloads the document and builds its memory cache in the background, loaded by the chat's supervisor
+    data = request.get_json()
+
+    def download_and_prewarm(url):
+        try:
+            response = requests.get(url, timeout=60)
+            response.raise_for_status()
+            start_prewarm(response.content)
+        except Exception:
+            app.logger.exception("Downloading %s to prewarm it failed", url)
+            shared_cache_metrics.increment('cache_prewarm_failures_total', stage='download')
+
+    threading.Thread(target=download_and_prewarm, args=(data["url"],), name="cache-prewarm-download", daemon=True).start()
+    return jsonify({ "status" : "accepted" }), 202
 
 @app.route('/<string:id>/<string:chat_id>/get_conversations', methods=['GET'])
 def get_conversations(id, chat_id):
@@ -145,5 +173,11 @@ def get_history(id):
     
     return jsonify({ "history" : history })
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if request.args.get("format") == "prometheus":
+        return Response(shared_cache_metrics.render_prometheus(), mimetype="text/plain")
+    return jsonify(shared_cache_metrics.snapshot())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
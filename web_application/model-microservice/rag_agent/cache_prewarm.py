@@ -0,0 +1,172 @@
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime
+from io import BytesIO
+from typing import Callable, Dict, List, Optional, Tuple
+import fitz
+from llama_index.core.node_parser import TokenTextSplitter
+from rag_agent.cache_metrics import shared_cache_metrics
+from rag_agent.cache_registry import document_key
+from rag_agent.dynamic_cache_index import DynamicCacheIndex
+from rag_agent.provider_limits import get_provider_limits
+from rag_agent.utility_query_generator import UtilityQueryGenerator
+from rag_agent.utils import chat_llm1, cache_prewarm_dir, cache_prewarm_max_chunks, cache_prewarm_queries_per_chunk, \
+    provider_concurrency
+
+logger = logging.getLogger(__name__)
+
+# Prewarms running in this process, by document key
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def snapshot_path(key: str) -> str:
+    """Directory of the prewarmed memory snapshot of a document."""
+    return os.path.join(cache_prewarm_dir, key)
+
+def document_chunks(pdf_content: bytes, max_chunks: Optional[int] = None) -> List[str]:
+    """
+    Split the text of a PDF into chunks of the size used by the retrievers.
+
+    Args:
+        pdf_content (bytes): The PDF file
+        max_chunks (int, optional): Only return the first chunks. Defaults to all of them.
+
+    Returns:
+        List[str]: Text chunks
+    """
+    pdf_document = fitz.open(stream=BytesIO(pdf_content), filetype="pdf")
+    text = "\n".join(page.get_text() for page in pdf_document)
+    pdf_document.close()
+
+    chunks = [chunk for chunk in TokenTextSplitter(chunk_size=900, chunk_overlap=200).split_text(text)
+              if chunk.strip()]
+    return chunks[:max_chunks] if max_chunks else chunks
+
+def prewarm_document(pdf_content: bytes,
+                     embedding_dim: int = 1024,
+                     max_chunks: int = cache_prewarm_max_chunks,
+                     queries_per_chunk: int = cache_prewarm_queries_per_chunk) -> Optional[str]:
+    """
+    Build the memory cache of a document before any question is asked and save it as a snapshot
+    that RAGAGENT loads when it is created for the document.
+
+    Utility queries are generated for the chunks of the document with concurrent LLM calls, and
+    every (query, chunk) pair is stored as RAGAGENT.add_to_memory would. Chunks and queries are
+    embedded in large batches when the indexes are flushed.
+
+    Args:
+        pdf_content (bytes): The uploaded PDF
+        embedding_dim (int, optional): Dimension of the embeddings. Defaults to 1024.
+        max_chunks (int, optional): Chunks to prewarm, from the start of the document.
+                                    Defaults to CACHE_PREWARM_MAX_CHUNKS.
+        queries_per_chunk (int, optional): Utility queries generated per chunk.
+                                           Defaults to CACHE_PREWARM_QUERIES_PER_CHUNK.
+
+    Returns:
+        Optional[str]: The snapshot directory, or None if the document has no text
+    """
+    key = document_key(pdf_content)
+    chunks = document_chunks(pdf_content, max_chunks)
+    if not chunks:
+        return None
+
+    # Embedding requests count against the same caps as the chats
+    provider_limits = get_provider_limits(provider_concurrency)
+    cache_index = DynamicCacheIndex(dim=embedding_dim, batch_size=64, dedup_mode='hash', name='prewarm',
+                                    provider_limits=provider_limits)
+    query_index = DynamicCacheIndex(dim=embedding_dim, batch_size=64, dedup_mode='hash', name='prewarm',
+                                    provider_limits=provider_limits)
+    generator = UtilityQueryGenerator(llm=chat_llm1, embedding_model=query_index.text_embed_model,
+                                      similarity_threshold=0.8)
+
+    timestamp = datetime.now().isoformat()
+    for chunk, queries in zip(chunks, generator.generate_queries_batch(chunks, max_queries=queries_per_chunk)):
+        for query in queries:
+            cache_index.add_chunk(chunk, {
+                'query': query,
+                'query_type': 'utility',
+                'original_query': query,
+                'chunk': chunk,
+                'timestamp': timestamp,
+                'prewarmed': True,
+            })
+            query_index.add_chunk(query, {'query': query, 'query_type': 'utility'})
+
+    cache_index.process_pending_additions(force=True)
+    query_index.process_pending_additions(force=True)
+
+    # Written next to the final directory and moved in place, so loaders never see half a snapshot
+    path = snapshot_path(key)
+    staging = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    cache_index.save_index(os.path.join(staging, 'cache'))
+    query_index.save_index(os.path.join(staging, 'queries'))
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging, path)
+    return path
+
+def load_prewarmed_memory(key: str,
+                          new_cache_index: Callable[[], DynamicCacheIndex],
+                          new_query_index: Callable[[], DynamicCacheIndex]) -> Optional[Tuple[DynamicCacheIndex, DynamicCacheIndex]]:
+    """
+    Load the prewarmed snapshot of a document into new memory indexes.
+
+    Both halves of the snapshot are loaded before the indexes are returned, so a failed load never
+    leaves a memory cache whose query index does not match it.
+
+    Args:
+        key (str): Document key, see cache_registry.document_key
+        new_cache_index (Callable): Creates the empty memory cache to load the chunks into
+        new_query_index (Callable): Creates the empty query index to load the queries into
+
+    Returns:
+        Optional[Tuple[DynamicCacheIndex, DynamicCacheIndex]]: (cache index, query index), or None
+        if the document has no snapshot or it could not be loaded
+    """
+    path = snapshot_path(key)
+    if not os.path.exists(os.path.join(path, 'cache', 'manifest.json')):
+        return None
+    cache_index, query_index = new_cache_index(), new_query_index()
+    try:
+        cache_index.load_index(os.path.join(path, 'cache'))
+        query_index.load_index(os.path.join(path, 'queries'))
+        return cache_index, query_index
+    except Exception:
+        for index in (cache_index, query_index):
+            index.stop_background_indexing(flush=False)
+        return None
+
+def start_prewarm(pdf_content: bytes) -> Dict:
+    """
+    Prewarm a document on a background thread, unless it is already prewarmed or being prewarmed.
+
+    Args:
+        pdf_content (bytes): The uploaded PDF
+
+    Returns:
+        Dict: Document key and status: 'ready', 'running' or 'started'
+    """
+    key = document_key(pdf_content)
+    with _jobs_lock:
+        if os.path.exists(os.path.join(snapshot_path(key), 'cache', 'manifest.json')):
+            return {'document_key': key, 'status': 'ready'}
+        job = _jobs.get(key)
+        if job is not None and job.is_alive():
+            return {'document_key': key, 'status': 'running'}
+
+        def run():
+            try:
+                prewarm_document(pdf_content)
+            except Exception:
+                logger.exception("Prewarming document %s failed", key)
+                shared_cache_metrics.increment('cache_prewarm_failures_total', stage='prewarm')
+            finally:
+                with _jobs_lock:
+                    _jobs.pop(key, None)
+
+        job = threading.Thread(target=run, name=f"cache-prewarm-{key[:8]}", daemon=True)
+        _jobs[key] = job
+        job.start()
+    return {'document_key': key, 'status': 'started'}
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+from rag_agent.exact_match_cache import ExactMatchCache
+from rag_agent.cache_metrics import shared_cache_metrics
+
+# Documents whose memory is kept once no agent uses it anymore, least recently used ones are dropped first
+DEFAULT_MAX_IDLE_DOCUMENTS = 16
+
+def document_key(content: bytes) -> str:
+    """Registry key of a document: SHA-256 of its raw bytes, so re-uploads of the same file share one key."""
+    return hashlib.sha256(content).hexdigest()
+
+class DocumentMemory:
+    def __init__(self, cache_index, query_index):
+        """
+            Semantic memory shared by every agent working on one document.
+
+            DynamicCacheIndex guards its own appends and searches with locks, so agents on different
+            threads add to and search the shared indexes directly.
+
+            Args:
+                cache_index (DynamicCacheIndex): Memory cache of retrieved chunks
+                query_index (DynamicCacheIndex): Index of the queries stored in the memory cache
+
+            Attributes:
+                exact_matches (ExactMatchCache): Normalized query texts of the memory cache entries
+                users (int): Number of agents currently attached
+        """
+        self.cache_index = cache_index
+        self.query_index = query_index
+        self.exact_matches = ExactMatchCache()
+        self.users = 0
+
+    def close(self) -> None:
+        """Stop the background indexers of both indexes."""
+        for index in (self.cache_index, self.query_index):
+            if index.background_indexing:
+                index.stop_background_indexing(flush=False)
+
+class CacheRegistry:
+    def __init__(self, max_idle_documents: int = DEFAULT_MAX_IDLE_DOCUMENTS):
+        """
+            Registry of the semantic memory of every document, keyed by `document_key`, so that
+            all chats over the same document share and warm one cache.
+
+            Args:
+                max_idle_documents (int, optional): Memories kept after their last agent detached,
+                                                    so that a new chat on a recent document still
+                                                    starts warm. Defaults to DEFAULT_MAX_IDLE_DOCUMENTS.
+        """
+        self.max_idle_documents = max_idle_documents
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, factory: Callable[[], Tuple]) -> DocumentMemory:
+        """
+        Attach to the memory of a document, creating it on first use.
+
+        Args:
+            key (str): Document key, see `document_key`
+            factory (Callable): Returns a new (cache_index, query_index) pair. The settings of the
+                                first agent on a document apply to every later one.
+
+        Returns:
+            DocumentMemory: The shared memory of the document
+        """
+        with self._lock:
+            memory = self._documents.get(key)
+            if memory is None:
+                memory = DocumentMemory(*factory())
+                self._documents[key] = memory
+            self._documents.move_to_end(key)
+            memory.users += 1
+            return memory
+
+    def release(self, key: str) -> None:
+        """
+        Detach from the memory of a document. Idle memories beyond `max_idle_documents` are dropped,
+        least recently used first.
+
+        Args:
+            key (str): Document key passed to `acquire`
+        """
+        with self._lock:
+            memory = self._documents.get(key)
+            if memory is None:
+                return
+            memory.users = max(memory.users - 1, 0)
+
+            idle = [idle_key for idle_key, idle_memory in self._documents.items() if idle_memory.users == 0]
+            for idle_key in idle[:max(len(idle) - self.max_idle_documents, 0)]:
+                self._documents.pop(idle_key).close()
+
+    def get_stats(self) -> Dict:
+        """
+        Size and usage of the memory of every registered document.
+
+        Returns:
+            Dict: Per document key, attached agents and cache statistics
+        """
+        with self._lock:
+            return {key: {'users': memory.users, **memory.cache_index.get_stats()}
+                    for key, memory in self._documents.items()}
+
+# Registry shared by every RAGAGENT of the process
+shared_cache_registry = CacheRegistry()
+shared_cache_metrics.register_collector('documents', shared_cache_registry.get_stats)
@@ -1,4 +1,3 @@
-from rag_agent.dynamic_cache_index import DynamicCacheIndex
 from rag_agent.prompt import CONFIDENCE_PROMPT, WEBSEARCH_PROMPT
 from llama_index.tools.tavily_research import TavilyToolSpec
 from PyPDF2 import PdfReader
@@ -29,7 +28,7 @@ def rag_agent(query, agent) -> str:
     if len(document_paths)>=2 and document_paths[-1] != document_paths[-2]:
         gc.collect()
         
-        agent.cache_index = DynamicCacheIndex(dim=agent.embedding_dim, batch_size=16)
+        agent.reset_memory()
         agent.previous_queries = {}
     
     if agent.reavaluate == True:
@@ -37,7 +36,7 @@ def rag_agent(query, agent) -> str:
     else :
         res, jargons = agent.run(query ,True)
         
-    score = chat_llm.invoke(CONFIDENCE_PROMPT.format(steps = agent.agent_input, answer = res)).content
+    score = chat_llm.invoke(CONFIDENCE_PROMPT.format(steps = agent.scratchpad_input('confidence'), answer = res)).content
     if agent.cache_index.process_pending_additions():
       pass
     return str(res) + ", Confidence Score : " + str(score), jargons, agent
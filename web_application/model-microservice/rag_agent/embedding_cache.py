@@ -0,0 +1,150 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import numpy as np
+from rag_agent.cache_metrics import shared_cache_metrics
+
+# Number of embeddings kept by the shared memo, about 4 MB per 1000 entries at 1024 dimensions
+DEFAULT_MAX_ENTRIES = 4096
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        """
+            In-process LRU memo of text embeddings, so that the same query is only sent to the
+            embedding API once.
+
+            Entries are keyed by (model name, task, embedding kind, hash of the text), so vectors
+            of different models or Jina tasks are never mixed up.
+
+            Args:
+                max_entries (int, optional): Maximum number of embeddings kept, least recently used
+                                             ones are dropped first. Defaults to DEFAULT_MAX_ENTRIES.
+
+            Attributes:
+                hits (int): Lookups answered from the memo
+                misses (int): Lookups that had to call the embedding model
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model, text: str, kind: str) -> Tuple:
+        """Memo key of `text` embedded by `model` as a 'text' or 'query' embedding."""
+        model_name = getattr(model, 'model', None) or getattr(model, 'model_name', None) or type(model).__name__
+        # JinaEmbedding keeps its task in a private attribute
+        task = getattr(model, 'task', None) or getattr(model, '_task', None)
+        return (str(model_name), str(task), kind, hashlib.sha1(str(text).encode('utf-8')).hexdigest())
+
+    def _lookup(self, key: Tuple):
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def _store(self, key: Tuple, embedding) -> np.ndarray:
+        embedding = np.array(embedding, dtype=np.float32)
+        # Cached vectors are shared between callers
+        embedding.flags.writeable = False
+        with self._lock:
+            self._entries[key] = embedding
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return embedding
+
+    def get_text_embedding(self, model, text: str) -> np.ndarray:
+        """
+        Embed `text` with `model.get_text_embedding`, or return the memoized vector.
+
+        Args:
+            model (object): Embedding model, e.g. a JinaEmbedding
+            text (str): Text to embed
+
+        Returns:
+            np.ndarray: Read-only float32 embedding
+        """
+        key = self._key(model, text, 'text')
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = self._store(key, model.get_text_embedding(text))
+        return embedding
+
+    def get_query_embedding(self, model, query: str) -> np.ndarray:
+        """
+        Embed `query` with `model.get_query_embedding`, or return the memoized vector.
+
+        Args:
+            model (object): Embedding model, e.g. a JinaEmbedding
+            query (str): Query to embed
+
+        Returns:
+            np.ndarray: Read-only float32 embedding
+        """
+        key = self._key(model, query, 'query')
+        embedding = self._lookup(key)
+        if embedding is None:
+            embedding = self._store(key, model.get_query_embedding(query))
+        return embedding
+
+    def get_text_embedding_batch(self, model, texts: List[str]) -> List[np.ndarray]:
+        """
+        Embed several texts, sending only the ones not memoized yet in a single batched request.
+
+        Args:
+            model (object): Embedding model, e.g. a JinaEmbedding
+            texts (List[str]): Texts to embed
+
+        Returns:
+            List[np.ndarray]: Read-only float32 embeddings, in the order of `texts`
+        """
+        keys = [self._key(model, text, 'text') for text in texts]
+        embeddings = [self._lookup(key) for key in keys]
+
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(keys[i], []).append(i)
+        if missing:
+            first = [positions[0] for positions in missing.values()]
+            computed = model.get_text_embedding_batch([texts[i] for i in first])
+            for (key, positions), embedding in zip(missing.items(), computed):
+                embedding = self._store(key, embedding)
+                for i in positions:
+                    embeddings[i] = embedding
+        return embeddings
+
+    def get_stats(self) -> Dict:
+        """
+        Memo size and hit-rate statistics.
+
+        Returns:
+            Dict: Entries, capacity, hits, misses and hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        """Drop every memoized embedding and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Memo shared by RAGAGENT, DynamicCacheIndex and UtilityQueryGenerator
+shared_embedding_cache = EmbeddingCache()
+shared_cache_metrics.register_collector('embedding_cache', shared_embedding_cache.get_stats)
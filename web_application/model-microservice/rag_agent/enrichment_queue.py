@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+from rag_agent.cache_metrics import shared_cache_metrics
+
+# What to do with a new job when the queue is full
+DROP_POLICIES = ('drop_oldest', 'drop_newest', 'block')
+
+class EnrichmentQueue:
+    def __init__(self,
+                 handler: Callable,
+                 max_pending: int = 64,
+                 drop_policy: str = 'drop_oldest',
+                 block_timeout: float = 5.0,
+                 idle_timeout: float = 30.0,
+                 name: str = 'enrichment'):
+        """
+            Bounded queue of memory enrichment jobs run by a background worker, so that work which
+            only benefits later questions, such as generating utility queries, is done after the
+            current answer instead of before it.
+
+            The worker thread is started by the first job and exits after `idle_timeout` seconds
+            without work, so idle chats hold no thread.
+
+            Args:
+                handler (Callable): Called with the arguments of every job, on the worker thread
+                max_pending (int, optional): Jobs waiting at most. Defaults to 64.
+                drop_policy (str, optional): When the queue is full, 'drop_oldest' discards the oldest
+                                             waiting job, 'drop_newest' discards the new one and
+                                             'block' makes `submit` wait for room, up to
+                                             `block_timeout`, before discarding the new one.
+                                             Defaults to 'drop_oldest'.
+                block_timeout (float, optional): Seconds `submit` waits under the 'block' policy.
+                                                 Defaults to 5.0.
+                idle_timeout (float, optional): Seconds the worker waits for a job before exiting.
+                                                Defaults to 30.0.
+                name (str, optional): Label of the queue in the cache metrics. Defaults to 'enrichment'.
+
+            Raises:
+                ValueError: If the drop policy is unknown or max_pending is not positive
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}, got {drop_policy!r}")
+        if max_pending < 1:
+            raise ValueError("max_pending must be at least 1")
+
+        self.handler = handler
+        self.max_pending = max_pending
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'dropped': 0}
+        self._jobs = deque()
+        self._running = 0
+        self._worker = None
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        """Number of jobs waiting or running."""
+        with self._condition:
+            return len(self._jobs) + self._running
+
+    def _count(self, outcome: str) -> None:
+        self.stats[outcome] += 1
+        shared_cache_metrics.increment('enrichment_jobs_total', queue=self.name, outcome=outcome)
+
+    def submit(self, *args) -> bool:
+        """
+        Queue a job, applying the drop policy if the queue is full.
+
+        Args:
+            *args: Arguments of the handler
+
+        Returns:
+            bool: True if the job was queued, False if it was dropped
+        """
+        with self._condition:
+            if len(self._jobs) >= self.max_pending:
+                if self.drop_policy == 'drop_oldest':
+                    self._jobs.popleft()
+                    self._count('dropped')
+                elif self.drop_policy == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._jobs) >= self.max_pending:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._condition.wait(remaining):
+                            break
+                if len(self._jobs) >= self.max_pending:
+                    self._count('dropped')
+                    return False
+
+            self._jobs.append(args)
+            self._count('submitted')
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"{self.name}-worker", daemon=True)
+                self._worker.start()
+            self._condition.notify_all()
+            return True
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                deadline = time.monotonic() + self.idle_timeout
+                while not self._jobs:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._worker = None
+                        return
+                    self._condition.wait(remaining)
+                args = self._jobs.popleft()
+                self._running += 1
+                # Room was made for a blocked submit
+                self._condition.notify_all()
+
+            outcome = 'completed'
+            try:
+                self.handler(*args)
+            except Exception:
+                outcome = 'failed'
+            finally:
+                with self._condition:
+                    self._running -= 1
+                    self._count(outcome)
+                    self._condition.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every queued job has run, e.g. when the chat goes idle.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+        Returns:
+            bool: True if the queue is empty, False if the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._jobs or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def get_stats(self) -> Dict:
+        """
+        Queue counters.
+
+        Returns:
+            Dict: Jobs submitted, completed, failed and dropped, and jobs pending now
+        """
+        with self._condition:
+            return {**self.stats, 'pending': len(self._jobs) + self._running}
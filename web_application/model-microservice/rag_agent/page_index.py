@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, List
+import faiss
+import fitz
+import numpy as np
+from rag_agent.cache_registry import document_key
+from rag_agent.embedding_cache import shared_embedding_cache
+
+# Documents whose page index is kept, least recently used ones are dropped first
+DEFAULT_MAX_DOCUMENTS = 32
+
+class PageIndex:
+    def __init__(self, pdf_content: bytes, text_embed_model, query_embed_model, dim: int = 1024):
+        """
+            Page-level vector index of a PDF, used to pick the pages worth partitioning before a
+            retriever is built or when a question is re-evaluated.
+
+            The text of every page is extracted once and embedded with one batched request. Pages
+            are searched with a flat L2 index, as the retrievers did with their own copy.
+
+            Args:
+                pdf_content (bytes): The PDF file
+                text_embed_model (object): Embedding model of the page texts
+                query_embed_model (object): Embedding model of the queries
+                dim (int, optional): Dimension of the embeddings. Defaults to 1024.
+        """
+        self.key = document_key(pdf_content)
+        self.query_embed_model = query_embed_model
+
+        pdf_document = fitz.open(stream=BytesIO(pdf_content), filetype="pdf")
+        self.pages = [{"page": str(page_num + 1), "text": pdf_document[page_num].get_text()}
+                      for page_num in range(len(pdf_document))]
+        pdf_document.close()
+
+        self.index = faiss.IndexFlatL2(dim)
+        if self.pages:
+            embeddings = text_embed_model.get_text_embedding_batch([page["text"] for page in self.pages])
+            self.index.add(np.asarray(embeddings, dtype="float32"))
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def search(self, query: str, top_k: int) -> List[Dict]:
+        """
+        Find the pages closest to a query.
+
+        Args:
+            query (str): The query
+            top_k (int): Number of pages to return at most
+
+        Returns:
+            List[Dict]: 'page' (1-based page number as a string), 'text' and 'distance' of every page
+                        found, closest first
+        """
+        if not self.pages or top_k <= 0:
+            return []
+        query_embedding = shared_embedding_cache.get_query_embedding(self.query_embed_model, str(query))
+        distances, indices = self.index.search(np.asarray([query_embedding], dtype="float32"), top_k)
+        return [{**self.pages[idx], "distance": distance}
+                for idx, distance in zip(indices[0], distances[0]) if idx != -1]
+
+# Page indexes by document key
+_page_indexes = OrderedDict()
+_build_locks = {}
+_page_indexes_lock = threading.Lock()
+
+def get_page_index(pdf_content: bytes, text_embed_model, query_embed_model,
+                   max_documents: int = DEFAULT_MAX_DOCUMENTS) -> PageIndex:
+    """
+    The page index of a document, built on first use and shared by every retriever and agent of the
+    process working on the same file.
+
+    Args:
+        pdf_content (bytes): The PDF file
+        text_embed_model (object): Embedding model of the page texts
+        query_embed_model (object): Embedding model of the queries
+        max_documents (int, optional): Page indexes kept. Defaults to DEFAULT_MAX_DOCUMENTS.
+
+    Returns:
+        PageIndex: The index of the document
+    """
+    key = document_key(pdf_content)
+    with _page_indexes_lock:
+        if key in _page_indexes:
+            _page_indexes.move_to_end(key)
+            return _page_indexes[key]
+        build_lock = _build_locks.setdefault(key, threading.Lock())
+
+    # Only one thread embeds a given document, the others wait for its index
+    with build_lock:
+        with _page_indexes_lock:
+            if key in _page_indexes:
+                _page_indexes.move_to_end(key)
+                return _page_indexes[key]
+        page_index = PageIndex(pdf_content, text_embed_model, query_embed_model)
+        with _page_indexes_lock:
+            _page_indexes[key] = page_index
+            _build_locks.pop(key, None)
+            while len(_page_indexes) > max_documents:
+                _page_indexes.popitem(last=False)
+        return page_index
@@ -169,6 +169,25 @@ Jargon Dictionary: {jargons}
 Output:
 """
 
+BATCHED_SYNTHESIS_PROMPT = """
+You will be provided with a retrieval query and {count} chunks of a document retrieved for it.
+Your task is to:
+1. Summarize every chunk in 2-4 sentences, keeping the facts, figures and names relevant to the query.
+2. Answer the query using ONLY the information in the chunks. If the chunks do not answer it, say what is missing.
+
+Respond STRICTLY in this EXACT JSON format, with exactly {count} summaries in the order of the chunks:
+{{
+    "summaries": ["Summary of chunk 1", "Summary of chunk 2"],
+    "answer": "Answer to the query"
+}}
+
+Query: {query}
+
+{chunks}
+
+Your Response:
+"""
+
 CONFIDENCE_PROMPT = """
 You will be provided with a series of interleaved reasoning and retrieval steps which have led to a FINAL ANSWER, that will also be provided to you.
 Based on the series of steps, you are to generate a CONFIDENCE SCORE for the FINAL ANSWER generated. The score must lie between 0 and 1 where a higher score means a greater confidence
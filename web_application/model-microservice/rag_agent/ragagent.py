@@ -2,18 +2,32 @@ import re
 import random
 from rag_agent.dynamic_cache_index import DynamicCacheIndex
 from rag_agent.utility_query_generator import UtilityQueryGenerator
+from rag_agent.embedding_cache import shared_embedding_cache
+from rag_agent.cache_registry import shared_cache_registry, document_key
+from rag_agent.exact_match_cache import ExactMatchCache
+from rag_agent.hit_thresholds import load_hit_thresholds, get_lookup_log
+from rag_agent.provider_limits import get_provider_limits
+from rag_agent.enrichment_queue import EnrichmentQueue
+from rag_agent.page_index import get_page_index
+from rag_agent.scratchpad import Scratchpad
+from rag_agent.cache_metrics import shared_cache_metrics, DISTANCE_BUCKETS
+from rag_agent.cache_prewarm import load_prewarmed_memory
 from datetime import datetime
 import numpy as np
 from tqdm import tqdm
 from rag_agent.utils import rephrase_prompt, jargon_prompt, text_embed_model, chat_llm1, llm
+from rag_agent.prompt import BATCHED_SYNTHESIS_PROMPT
+from rag_agent.utils import cache_max_entries, cache_eviction_policy, cache_ttl_seconds, cache_dedup_mode, \
+    cache_background_indexing, cache_storage, cache_share_memory, lookup_log_path, \
+    chunk_concurrency, provider_concurrency, enrichment_background, enrichment_max_pending, \
+    enrichment_drop_policy, synthesis_mode, scratchpad_token_budget, scratchpad_recent_steps
 import os
-import fitz
-import faiss
 import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from rag_agent.retriever import table_summary
 from llama_index.core import Document
-from rag_agent.utils import client_unstructured, query_embed_model, chat_llm1
+from rag_agent.utils import client_unstructured, query_embed_model, llm as query_engine_llm
 from unstructured_client.models import operations, shared
 import json
 from PyPDF2 import PdfReader, PdfWriter
@@ -32,7 +46,25 @@ class RAGAGENT:
                  retriever = None,
                  url = None,
                  pdf_content = None,
-                 raptor = False):
+                 raptor = False,
+                 cache_max_entries = cache_max_entries,
+                 cache_eviction_policy = cache_eviction_policy,
+                 cache_ttl_seconds = cache_ttl_seconds,
+                 cache_dedup_mode = cache_dedup_mode,
+                 cache_background_indexing = cache_background_indexing,
+                 cache_storage = cache_storage,
+                 share_memory = cache_share_memory,
+                 hit_thresholds = None,
+                 lookup_log = lookup_log_path,
+                 chunk_concurrency = chunk_concurrency,
+                 provider_concurrency = provider_concurrency,
+                 background_enrichment = enrichment_background,
+                 enrichment_max_pending = enrichment_max_pending,
+                 enrichment_drop_policy = enrichment_drop_policy,
+                 synthesis_mode = synthesis_mode,
+                 scratchpad_token_budget = scratchpad_token_budget,
+                 scratchpad_recent_steps = scratchpad_recent_steps,
+                 synthesis_llm = None):
 
         if url == None:
           raise ValueError("Value of url Is No provided")
@@ -48,9 +80,61 @@ class RAGAGENT:
             utility_query_template (str, optional): Template for generating utility queries.
             max_steps (int): Maximum steps for processing a query. Default is 15.
             similarity_threshold (float): Threshold for memory similarity. Default is 0.8.
+            cache_max_entries (int, optional): Capacity of the memory cache, unbounded if None.
+            cache_eviction_policy (str): Eviction policy of the memory cache ('lru', 'lfu' or 'ttl').
+            cache_ttl_seconds (float, optional): Age after which memory entries expire.
+            cache_dedup_mode (str, optional): Insert-time deduplication of the memory cache ('hash' or
+                                              'near'), None to store every chunk. Default is 'hash'.
+            cache_background_indexing (bool): Embed and index new memory entries on a background
+                                              thread instead of on the thread that adds them.
+            cache_storage (str): In-memory format of the cached vectors ('float32', 'float16', 'int8'
+                                 or 'pq'), compressed ones are rescored exactly.
+            share_memory (bool): Share the memory cache with every other chat over the same document,
+                                 identified by a hash of `pdf_content`.
+            hit_thresholds (dict, optional): Maximum distance of a memory hit per lookup path and query
+                                             type, as returned by load_hit_thresholds. Defaults to the
+                                             thresholds fitted by threshold_calibration.py, if any.
+            lookup_log (str, optional): File semantic memory lookups and their outcome are logged to,
+                                        for threshold_calibration.py. Defaults to LOOKUP_LOG_PATH.
+            chunk_concurrency (int): Retrieved chunks of a RETRIEVAL step processed at once, 1 to process
+                                     them one after the other. Defaults to CHUNK_CONCURRENCY.
+            provider_concurrency (dict): Maximum concurrent calls per provider ('synthesis',
+                                         'query_generation', 'embedding'), shared by the chats with
+                                         the same limits. A shared memory cache keeps the limits of
+                                         the chat that created it. Defaults to the *_CONCURRENCY
+                                         settings.
+            background_enrichment (bool): Generate the utility queries of retrieved chunks on a
+                                          background worker instead of before the step returns.
+                                          Defaults to ENRICHMENT_BACKGROUND.
+            enrichment_max_pending (int): Enrichment jobs waiting at most. Defaults to ENRICHMENT_MAX_PENDING.
+            enrichment_drop_policy (str): What to do with a job when the queue is full, see
+                                          EnrichmentQueue. Defaults to ENRICHMENT_DROP_POLICY.
+            synthesis_mode (str): 'batched' to summarize the retrieved chunks of a step and answer its
+                                  query with one LLM call, 'per_chunk' to run the query engine on
+                                  every chunk and on the query. Defaults to SYNTHESIS_MODE.
+            scratchpad_token_budget (int): Tokens of agent input aimed for per prompt, see
+                                           Scratchpad. Defaults to SCRATCHPAD_TOKEN_BUDGET.
+            scratchpad_recent_steps (int): Steps whose observations are sent verbatim.
+                                           Defaults to SCRATCHPAD_RECENT_STEPS.
+            synthesis_llm (object, optional): LLM of the batched synthesis, a llama-index LLM or a
+                                              chat model. Defaults to the LLM of the query engine.
         """
         self.embedding_dim = embedding_dim
-        self.cache_index = DynamicCacheIndex(dim=embedding_dim, batch_size=16)
+        self.cache_config = {
+            'max_entries': cache_max_entries,
+            'eviction_policy': cache_eviction_policy,
+            'ttl_seconds': cache_ttl_seconds,
+            'dedup_mode': cache_dedup_mode,
+            'background_indexing': cache_background_indexing,
+            'storage': cache_storage,
+        }
+        self.document_key = document_key(pdf_content) if pdf_content else None
+        self.memory_key = self.document_key if share_memory else None
+        self._attached_memory_key = None
+        # Set before the memory caches are created, they take an embedding slot per request
+        self.provider_limits = get_provider_limits(provider_concurrency)
+        self.reset_memory()
+        self.embedding_cache = shared_embedding_cache
         self.thought_agent_prompt = thought_agent_prompt
         self.retrieval_agent_prompt = retrieval_agent_prompt
         self.reasoning_agent_prompt = reasoning_agent_prompt
@@ -68,19 +152,44 @@ class RAGAGENT:
         self.feedback = ""
         self.similarity_threshold = similarity_threshold
         self.utility_query_template = utility_query_template
-        self.utility_query_generator = UtilityQueryGenerator(llm=chat_llm1, embedding_model=text_embed_model, similarity_threshold=0.8)
+        # Generated queries are compared with the stored ones in the query index's embedding space
+        self.utility_query_generator = UtilityQueryGenerator(llm=chat_llm1, embedding_model=self.query_index.text_embed_model, similarity_threshold=0.8)
         self.previous_queries = {} 
+        # Chunk lookups answered by the exact-match tier, by the semantic tier, or by neither
+        self.memory_stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0}
+        self.hit_thresholds = load_hit_thresholds() if hit_thresholds is None else hit_thresholds
+        self.lookup_log = get_lookup_log(lookup_log) if lookup_log else None
+        # Logged lookups of the chunk the supervisor is answering from, see record_lookup_outcome
+        self._pending_lookups = []
+        self.chunk_concurrency = max(1, chunk_concurrency or 1)
+        self.enrichment_queue = EnrichmentQueue(self._enrich_memory, max_pending=enrichment_max_pending,
+                                                drop_policy=enrichment_drop_policy) \
+            if background_enrichment else None
+        if synthesis_mode not in ('batched', 'per_chunk'):
+            raise ValueError(f"synthesis_mode must be 'batched' or 'per_chunk', got {synthesis_mode!r}")
+        self.synthesis_mode = synthesis_mode
+        # `llm` is the chat model of the thought and reasoning prompts, synthesis replaces the
+        # query engine so it uses the engine's LLM
+        self.synthesis_llm = synthesis_llm if synthesis_llm is not None else query_engine_llm
+        self.scratchpad = Scratchpad(token_budget=scratchpad_token_budget, recent_steps=scratchpad_recent_steps)
         self.__reset_agent()
         self.question = ""
         self.agent_input = ""
         self.text_embed_model = text_embed_model
         
-    def check_memory_and_retrieve(self, query):
+    def check_memory_and_retrieve(self, query, candidate_queries=None):
         """
         Check if a query exists in memory and retrieve the best match based on similarity.
 
+        Queries stored in memory verbatim, up to case and whitespace, are answered by the
+        exact-match tier without an embedding request. The others are embedded and searched in
+        the semantic cache.
+
         Args:
             query (str): The query string to search in memory.
+            candidate_queries (list, optional): Alternative phrasings of the query (rephrasings,
+                                                jargon-expanded questions). They are embedded and
+                                                searched together with `query` in one batch.
 
         Returns:
             str: The best matching chunk from memory, or None if no match is found.
@@ -94,28 +203,33 @@ class RAGAGENT:
             if self.previous_queries[query] > 2:
                 return "FORCE_REASONING"
 
-            query_embedding = self.get_embedding(query)
-            if query_embedding is None:
+            started = time.perf_counter()
+            queries = [query] + [q for q in (candidate_queries or []) if q and q != query]
+            exact_id, exact_match = self._exact_memory_match(queries)
+            if exact_match:
+                self.cache_index.record_hit(exact_id)
+                self._record_lookup('retrieve', 'exact_hits', started)
+                return exact_match
+
+            query_embeddings = self.get_embeddings(queries)
+            if query_embeddings is None:
+                self._record_lookup('retrieve', 'misses', started)
                 return None
 
-            results = self.cache_index.search(query_embedding, k=5)
-            if not results:
-                return None
-
-            best_match = None
-            best_distance = float('inf')
+            results = [hit for query_results in self.cache_index.search_batch(query_embeddings, k=5)
+                       for hit in query_results]
 
             MAX_DISTANCE = 0.3
 
-            for id, distance, metadata in results:
-                if distance < self.similarity_threshold and distance < best_distance and distance < MAX_DISTANCE:
-                    chunk = metadata.get('chunk', '')
-                    if chunk:
-                        best_match = chunk
-                        best_distance = distance
+            max_distance = min(self.similarity_threshold, MAX_DISTANCE)
+            best_id, best_match, best_distance = self._best_memory_match(results, max_distance, path='retrieve')
+            self._log_lookup('retrieve', query, results, best_id, max_distance)
             if best_match:
+                self.cache_index.record_hit(best_id)
+                self._record_lookup('retrieve', 'semantic_hits', started, best_distance)
                 return best_match
 
+            self._record_lookup('retrieve', 'misses', started, min((hit[1] for hit in results), default=None))
             return None
 
         except Exception as e:
@@ -135,26 +249,29 @@ class RAGAGENT:
             if not query:
                 return None
 
+            started = time.perf_counter()
+            exact_id, exact_match = self._exact_memory_match([query])
+            if exact_match:
+                self.cache_index.record_hit(exact_id)
+                self._record_lookup('supervisor', 'exact_hits', started)
+                return exact_match
+
             query_embedding = self.get_embedding(query)
             if query_embedding is None:
+                self._record_lookup('supervisor', 'misses', started)
                 return None
 
             results = self.cache_index.search(query_embedding, k=5)
-            if not results:
-                return None
-
-            best_match = None
-            best_distance = float('inf')
 
-            for id, distance, metadata in results:
-                if distance < self.similarity_threshold and distance < best_distance:
-                    chunk = metadata.get('chunk', '')
-                    if chunk:
-                        best_match = chunk
-                        best_distance = distance
+            best_id, best_match, best_distance = self._best_memory_match(results, self.similarity_threshold,
+                                                                          path='supervisor')
+            self._log_lookup('supervisor', query, results, best_id, self.similarity_threshold)
             if best_match:
+                self.cache_index.record_hit(best_id)
+                self._record_lookup('supervisor', 'semantic_hits', started, best_distance)
                 return best_match
 
+            self._record_lookup('supervisor', 'misses', started, min((hit[1] for hit in results), default=None))
             return None
 
         except Exception as e:
@@ -190,6 +307,8 @@ class RAGAGENT:
             chunk_id = self.cache_index.add_chunk(chunk, full_metadata)
 
             if chunk_id is not None:
+                self.exact_matches.add(query, chunk_id)
+                self.query_index.add_chunk(query, {'query': query, 'query_type': query_type})
                 return True
             else:
                 return False
@@ -197,17 +316,393 @@ class RAGAGENT:
         except Exception as e:
             return False
 
+    def _best_memory_match(self, results, max_distance, path=None):
+        """
+        Pick the closest cached chunk among search results.
+
+        Args:
+            results (list): (id, distance, metadata) tuples, possibly from several queries.
+            max_distance (float): Results at or beyond this distance are ignored.
+            path (str, optional): Lookup path. The threshold calibrated for the path and the query
+                                  type of a result replaces `max_distance` if there is one.
+
+        Returns:
+            tuple: (id, chunk, distance) of the best match, or (None, None, inf) if none qualifies.
+        """
+        best_id = None
+        best_match = None
+        best_distance = float('inf')
+
+        for id, distance, metadata in results:
+            limit = self._hit_threshold(path, metadata.get('query_type'), max_distance)
+            if distance < limit and distance < best_distance:
+                chunk = metadata.get('chunk', '')
+                if chunk:
+                    best_id = id
+                    best_match = chunk
+                    best_distance = distance
+
+        return best_id, best_match, best_distance
+
+    def _exact_memory_match(self, queries):
+        """
+        Look queries up in the exact-match tier, without embedding them.
+
+        Args:
+            queries (list): Query strings, compared after lowercasing and collapsing whitespace.
+
+        Returns:
+            tuple: (id, chunk) of the first cached chunk stored for one of the queries, or (None, None).
+        """
+        for query in queries:
+            chunk_ids = self.exact_matches.lookup(query)
+            removed = []
+            for chunk_id in chunk_ids:
+                metadata = self.cache_index.get_entry(chunk_id)
+                if metadata is None:
+                    removed.append(chunk_id)
+                elif metadata.get('chunk'):
+                    return chunk_id, metadata['chunk']
+            if removed:
+                # Entries evicted or expired from the cache index
+                self.exact_matches.discard(query, removed)
+        return None, None
+
+    def _record_lookup(self, path, outcome, started, distance=None):
+        """
+        Count a memory lookup and report it to the cache metrics.
+
+        Args:
+            path (str): 'retrieve', 'supervisor' or 'query_check'. Query checks only test whether a
+                        query is known, they are not counted in `memory_stats`.
+            outcome (str): 'exact_hits', 'semantic_hits' or 'misses'
+            started (float): `time.perf_counter()` when the lookup started
+            distance (float, optional): Distance of the hit, or of the nearest entry on a miss
+        """
+        if path != 'query_check':
+            self.memory_stats[outcome] += 1
+        shared_cache_metrics.increment('memory_lookups_total', path=path, outcome=outcome)
+        shared_cache_metrics.observe('memory_lookup_seconds', time.perf_counter() - started, path=path)
+        if distance is not None:
+            shared_cache_metrics.observe('memory_lookup_distance', distance, buckets=DISTANCE_BUCKETS,
+                                         path=path, outcome=outcome)
+
+    def _hit_threshold(self, path, query_type, default):
+        """
+        Maximum distance of a memory hit on an entry of a query type.
+
+        Args:
+            path (str): 'retrieve', 'supervisor' or 'query_check'.
+            query_type (str): Query type of the cache entry.
+            default (float): Threshold used when none was calibrated.
+
+        Returns:
+            float: The threshold calibrated for the query type, else for the path, else `default`.
+        """
+        thresholds = self.hit_thresholds.get(path) or {}
+        threshold = thresholds.get('query_types', {}).get(query_type, thresholds.get('default'))
+        return default if threshold is None else threshold
+
+    def _log_lookup(self, path, query, results, hit_id, default_threshold):
+        """
+        Write a semantic lookup to the lookup log, if there is one.
+
+        Args:
+            path (str): 'retrieve', 'supervisor' or 'query_check'.
+            query (str): The query looked up.
+            results (list): (id, distance, metadata) search results.
+            hit_id (int): Id of the returned entry, None on a miss.
+            default_threshold (float): Threshold of the lookup when none was calibrated.
+        """
+        if self.lookup_log is None or not results:
+            return
+        # The returned entry, or the one that came closest to being returned
+        entry_id, distance, metadata = min((hit for hit in results if hit_id is None or hit[0] == hit_id),
+                                           key=lambda hit: hit[1])
+        query_type = metadata.get('query_type')
+        chunk = metadata.get('chunk')
+        if path == 'query_check':
+            # Query index entries have no chunk, the supervisor then answers from one stored for the query
+            chunk = self._exact_memory_match([metadata.get('query', '')])[1]
+        record_id = self.lookup_log.record(path, query, metadata.get('query'), query_type, distance,
+                                           self._hit_threshold(path, query_type, default_threshold),
+                                           hit_id is not None, chunk)
+        if path != 'retrieve':
+            self._pending_lookups.append(record_id)
+
+    def record_lookup_outcome(self, sufficient):
+        """
+        Log whether the memory chunk the supervisor answered from was sufficient, for the lookups
+        that led to it since the last check_query_in_memory.
+
+        Args:
+            sufficient (bool): True if llm_response_if_memory_hit_found answered from the chunk.
+        """
+        if self.lookup_log is not None and self._pending_lookups:
+            self.lookup_log.record_outcome(self._pending_lookups, sufficient)
+        self._pending_lookups = []
+
+    def get_memory_stats(self):
+        """
+        Hit counters of the two memory tiers.
+
+        Returns:
+            dict: Exact-match hits, semantic hits, misses, their rates and the cache index statistics.
+        """
+        lookups = sum(self.memory_stats.values())
+        return {
+            **self.memory_stats,
+            'exact_hit_rate': self.memory_stats['exact_hits'] / lookups if lookups else 0.0,
+            'semantic_hit_rate': self.memory_stats['semantic_hits'] / lookups if lookups else 0.0,
+            'exact_match_queries': len(self.exact_matches),
+            'cache': self.cache_index.get_stats(),
+        }
+
+    def new_cache_index(self):
+        """
+        Create an empty memory cache with this agent's capacity and eviction settings.
+
+        Returns:
+            DynamicCacheIndex: The new cache index.
+        """
+        return DynamicCacheIndex(dim=self.embedding_dim, batch_size=16, name='memory',
+                                 provider_limits=self.provider_limits, **self.cache_config)
+
+    def new_query_index(self):
+        """
+        Create an empty index of the query strings stored in memory, one vector per distinct query.
+
+        Returns:
+            DynamicCacheIndex: The new query index.
+        """
+        return DynamicCacheIndex(dim=self.embedding_dim, batch_size=16, name='queries',
+                                 provider_limits=self.provider_limits,
+                                 **{**self.cache_config, 'dedup_mode': 'hash'})
+
+    def new_memory_indexes(self):
+        """
+        Create the memory cache and query index of this agent's document, loaded from the snapshot
+        prewarmed when the document was uploaded if there is one.
+
+        Returns:
+            tuple: (cache index, query index)
+        """
+        if self.document_key is not None:
+            prewarmed = load_prewarmed_memory(self.document_key, self.new_cache_index, self.new_query_index)
+            if prewarmed is not None:
+                return prewarmed
+        return self.new_cache_index(), self.new_query_index()
+
+    def index_exact_matches(self):
+        """
+        Add the queries of the entries already in the memory cache, e.g. loaded from a prewarmed
+        snapshot, to the exact-match tier.
+        """
+        for chunk_id, metadata in list(self.cache_index.metadata.items()):
+            for entry in [metadata] + metadata.get('aliases', []):
+                if entry.get('query'):
+                    self.exact_matches.add(entry['query'], chunk_id)
+
+    def reset_memory(self):
+        """
+        Replace the memory cache and its query index with new ones, prewarmed if the document was.
+        An agent with a `memory_key` attaches to the memory shared by every agent over the same
+        document instead.
+        """
+        previous_key = self._attached_memory_key
+        if self.memory_key is not None:
+            memory = shared_cache_registry.acquire(self.memory_key, self.new_memory_indexes)
+            self._attached_memory_key = self.memory_key
+        else:
+            memory = None
+            self._attached_memory_key = None
+
+        if previous_key is not None:
+            shared_cache_registry.release(previous_key)
+        else:
+            self._stop_private_indexers()
+
+        if memory is not None:
+            self.cache_index, self.query_index = memory.cache_index, memory.query_index
+            self.exact_matches = memory.exact_matches
+        else:
+            self.cache_index, self.query_index = self.new_memory_indexes()
+            self.exact_matches = ExactMatchCache()
+        if not len(self.exact_matches):
+            self.index_exact_matches()
+
+    def release_memory(self):
+        """
+        Detach from the shared document memory, or stop the background indexers of a private one.
+        Call this before discarding the agent.
+        """
+        if self._attached_memory_key is not None:
+            shared_cache_registry.release(self._attached_memory_key)
+            self._attached_memory_key = None
+        else:
+            self._stop_private_indexers()
+
+    def _stop_private_indexers(self):
+        for index in (getattr(self, 'cache_index', None), getattr(self, 'query_index', None)):
+            if index is not None and index.background_indexing:
+                index.stop_background_indexing(flush=False)
+
+    def _process_chunk(self, query, chunk_index, chunk_text, existing_graph_queries, chunk_summary=None):
+        """
+        Summarize a retrieved chunk, store it in memory and generate utility queries for it.
+
+        Args:
+            query (str): The retrieval query.
+            chunk_index (int): 1-based rank of the chunk in the retrieval results.
+            chunk_text (str): Text of the chunk.
+            existing_graph_queries (list): Queries already in memory, extended with the new utility queries.
+            chunk_summary (str, optional): Summary from synthesize_chunks. The query engine summarizes
+                                           the chunk if None.
+
+        Returns:
+            object: The summary of the chunk, added to the agent input as an observation.
+        """
+        if chunk_summary is not None:
+            chunk_result = chunk_summary
+        else:
+            with self.provider_limits.acquire('synthesis'):
+                chunk_result = self.engine.query(chunk_text)
+
+        # Add chunk and summary to memory, it is embedded when the memory cache flushes
+        self.add_to_memory(
+            query=query,
+            chunk=chunk_text,
+            query_type='retrieval',
+            metadata={
+                'chunk_index': chunk_index,
+                'summarized_chunk_text': chunk_result
+            }
+        )
+
+        # Utility queries only enrich the memory for later questions
+        if self.enrichment_queue is not None:
+            self.enrichment_queue.submit(query, str(chunk_result), existing_graph_queries)
+        else:
+            self._enrich_memory(query, str(chunk_result), existing_graph_queries)
+
+        return chunk_result
+
+    def _enrich_memory(self, query, chunk_summary, existing_graph_queries):
+        """
+        Generate utility queries for a chunk summary and store them in memory.
+
+        Args:
+            query (str): The retrieval query the chunk was found for.
+            chunk_summary (str): The engine's summary of the chunk.
+            existing_graph_queries (list): Queries already in memory, extended with the new utility queries.
+        """
+        try:
+            with self.provider_limits.acquire('query_generation'):
+                utility_queries = self.utility_query_generator.generate_queries(
+                    chunk=chunk_summary,
+                    max_queries=2,
+                    existing_graph_queries=existing_graph_queries,
+                    query_index=self.query_index
+                )
+
+            for utility_query in utility_queries:
+                if utility_query and utility_query != query:
+                    self.add_to_memory(
+                        query=utility_query,
+                        chunk=chunk_summary,
+                        original_query=query,
+                        query_type='utility'
+                    )
+                    existing_graph_queries.append(utility_query)
+
+        except Exception as e:
+            pass
+
+    def drain_enrichment(self, timeout=None):
+        """
+        Wait for the utility queries of earlier steps to be generated and stored.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Default is no limit.
+
+        Returns:
+            bool: True if no enrichment job is left.
+        """
+        if self.enrichment_queue is None:
+            return True
+        return self.enrichment_queue.drain(timeout)
+
+    def synthesize_chunks(self, query, chunk_texts):
+        """
+        Summarize the retrieved chunks and answer the retrieval query from them with one LLM call,
+        instead of one query engine call per chunk and another for the query.
+
+        Args:
+            query (str): The retrieval query.
+            chunk_texts (list): Texts of the retrieved chunks.
+
+        Returns:
+            tuple: (summaries, answer) with one summary per chunk, or None if the response could not
+                   be used, in which case the query engine is used instead.
+        """
+        MAX_CHUNK_CHARS = 4000
+
+        chunks = '\n\n'.join(f'CHUNK {i}:\n{text[:MAX_CHUNK_CHARS]}' for i, text in enumerate(chunk_texts, 1))
+        prompt = BATCHED_SYNTHESIS_PROMPT.format(count=len(chunk_texts), query=query, chunks=chunks)
+        try:
+            with self.provider_limits.acquire('synthesis'):
+                if hasattr(self.synthesis_llm, 'complete'):
+                    response = str(self.synthesis_llm.complete(prompt).text)
+                else:
+                    response = str(self.synthesis_llm.invoke(prompt).content)
+            json_match = re.search(r'\{.*\}', response, re.DOTALL)
+            parsed = json.loads(json_match.group(0) if json_match else response)
+            summaries = [str(summary).strip() for summary in parsed.get('summaries', [])]
+            answer = str(parsed.get('answer', '')).strip()
+        except Exception:
+            shared_cache_metrics.increment('synthesis_fallbacks_total', reason='error')
+            return None
+
+        if len(summaries) != len(chunk_texts) or not all(summaries) or not answer:
+            shared_cache_metrics.increment('synthesis_fallbacks_total', reason='mismatch')
+            return None
+        return summaries, answer
+
+    def _map_chunks(self, function, items):
+        """
+        Apply `function` to the retrieved chunks, up to `chunk_concurrency` of them at once.
+
+        Args:
+            function (callable): Work done for one chunk.
+            items (list): Argument of `function` for every chunk.
+
+        Yields:
+            object: The results of `function` in the order of `items`. An exception raised for a
+                    chunk is raised again once the results of the earlier chunks were yielded.
+        """
+        if self.chunk_concurrency <= 1 or len(items) <= 1:
+            for item in items:
+                yield function(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.chunk_concurrency, len(items))) as pool:
+            futures = [pool.submit(function, item) for item in items]
+            for future in futures:
+                yield future.result()
+
     def get_existing_graph_queries(self):
         """
-        Retrieve all existing graph queries from the memory cache.
+        Retrieve all existing graph queries from the memory cache, including the query aliases of
+        deduplicated chunks.
 
         Returns:
             list: A list of query strings stored in memory.
         """
         return [
-            metadata.get('query', '')
+            entry.get('query', '')
             for metadata in self.cache_index.metadata.values()
-            if 'query' in metadata
+            for entry in [metadata] + metadata.get('aliases', [])
+            if 'query' in entry
         ]
 
     def generate_utility_queries(self, chunk, max_queries,existing_graph_queries):
@@ -235,24 +730,44 @@ class RAGAGENT:
             np.ndarray: The generated embedding vector, or None if an error occurs.
         """
         try:
-            embedding = self.cache_index.text_embed_model.get_text_embedding(text)
-            if isinstance(embedding, list):
-                embedding = np.array(embedding)
+            with self.provider_limits.acquire('embedding'):
+                embedding = self.embedding_cache.get_text_embedding(self.cache_index.text_embed_model, text)
+            return self._fit_dimension(np.array(embedding))
 
-            # Ensure embedding matches cache index dimension
-            if embedding.shape[0] != self.embedding_dim:
+        except Exception as e:
+            return None
 
-                # Truncate or pad to match expected dimension
-                if embedding.shape[0] > self.embedding_dim:
-                    embedding = embedding[:self.embedding_dim]
-                else:
-                    embedding = np.pad(embedding, (0, self.embedding_dim - embedding.shape[0]), mode='constant')
+    def get_embeddings(self, texts):
+        """
+        Generate embedding vectors for several texts with a single batched request.
 
-            return embedding
+        Args:
+            texts (list): The input texts.
+
+        Returns:
+            np.ndarray: Matrix with one embedding per row, or None if an error occurs.
+        """
+        try:
+            with self.provider_limits.acquire('embedding'):
+                embeddings = self.embedding_cache.get_text_embedding_batch(self.cache_index.text_embed_model,
+                                                                           [str(text) for text in texts])
+            return np.vstack([self._fit_dimension(np.array(embedding)) for embedding in embeddings])
 
         except Exception as e:
             return None
 
+    def _fit_dimension(self, embedding):
+        """
+        Truncate or pad an embedding so that it matches the cache index dimension.
+        """
+        if embedding.shape[0] != self.embedding_dim:
+            if embedding.shape[0] > self.embedding_dim:
+                embedding = embedding[:self.embedding_dim]
+            else:
+                embedding = np.pad(embedding, (0, self.embedding_dim - embedding.shape[0]), mode='constant')
+
+        return embedding
+
     def print_memory_metadata(self):
       """
       Print metadata for all chunks in the memory cache
@@ -282,29 +797,41 @@ class RAGAGENT:
         """
         Check if a query exists in memory using similarity scores.
 
+        Queries stored verbatim are found in the exact-match tier. Others are looked up in
+        `query_index`, which holds one embedding per query stored in memory, instead of
+        re-embedding every cached query.
+
         Args:
             query (str): The query to check.
-            threshold (float, optional): Similarity threshold. Default is 0.9.
+            threshold (float, optional): Cosine similarity threshold, unless one was calibrated for the
+                                         query type of the nearest query. Default is 0.95.
 
         Returns:
             bool: True if a similar query exists, False otherwise.
         """
         try:
-            query_embedding = self.text_embed_model.get_text_embedding(str(query))
-
-            for metadata in self.cache_index.metadata.values():
-                cached_query = str(metadata.get('query', ''))
-
-                cached_query_embedding = self.text_embed_model.get_text_embedding(cached_query)
+            self._pending_lookups = []
+            started = time.perf_counter()
+            if self._exact_memory_match([str(query)])[1] is not None:
+                self._record_lookup('query_check', 'exact_hits', started)
+                return True
 
-                similarity = np.dot(query_embedding, cached_query_embedding) / (
-                    np.linalg.norm(query_embedding) * np.linalg.norm(cached_query_embedding)
-                )
+            query_embedding = self.get_embedding(str(query))
+            if query_embedding is None:
+                self._record_lookup('query_check', 'misses', started)
+                return False
 
-                if similarity >= threshold:
-                    return True
+            results = self.query_index.search(query_embedding, k=1)
+            if not results:
+                self._record_lookup('query_check', 'misses', started)
+                return False
 
-            return False
+            # The query index uses cosine distance, i.e. 1 - similarity
+            max_distance = self._hit_threshold('query_check', results[0][2].get('query_type'), 1.0 - threshold)
+            found = results[0][1] <= max_distance
+            self._log_lookup('query_check', str(query), results, results[0][0] if found else None, 1.0 - threshold)
+            self._record_lookup('query_check', 'semantic_hits' if found else 'misses', started, results[0][1])
+            return found
 
         except Exception as e:
             return False
@@ -406,58 +933,31 @@ class RAGAGENT:
             elif memory_result:
                 self.agent_input += f'\nOBSERVATION: {memory_result}'
                 return
+            synthesis = None
             try:
                 retrieved_chunks = self.retriever.retrieve(query)
                 if not retrieved_chunks:
                     return
                 
                 existing_graph_queries = self.get_existing_graph_queries()
-                for i, chunk in enumerate(retrieved_chunks, 1):
-
-                    if not chunk.text:
-                        continue
-                    chunk_result = self.engine.query(chunk.text)
-
-                    # Add chunk and summary to memory
-                    self.add_to_memory(
-                        query=query,
-                        chunk=str(chunk.text),
-                        query_type='retrieval',
-                        metadata={
-                            'chunk_index': i,
-                            'summarized_chunk_text': chunk_result
-                        }
-                    )
-
-                    # Generate utility queries
-                    try:
-                        utility_queries = self.utility_query_generator.generate_queries(
-                            chunk=str(chunk_result),
-                            max_queries=2,
-                            existing_graph_queries=existing_graph_queries
-                        )
-
-                        for utility_query in utility_queries:
-                            if utility_query and utility_query != query:
-                                self.add_to_memory(
-                                    query=utility_query,
-                                    chunk=str(chunk_result),
-                                    original_query=query,
-                                    query_type='utility'
-                                )
-                                existing_graph_queries.append(utility_query)
-
-                    except Exception as e:
-                        pass
-
+                chunks = [(i, str(chunk.text)) for i, chunk in enumerate(retrieved_chunks, 1) if chunk.text]
+                if self.synthesis_mode == 'batched' and chunks:
+                    synthesis = self.synthesize_chunks(query, [text for _, text in chunks])
+                summaries = synthesis[0] if synthesis else [None] * len(chunks)
+                for chunk_result in self._map_chunks(
+                        lambda item: self._process_chunk(query, *item[0], existing_graph_queries, item[1]),
+                        list(zip(chunks, summaries))):
                     self.agent_input += f'\nOBSERVATION: {chunk_result}'
 
             except Exception as e:
                 import traceback
                 traceback.print_exc()
 
-            query_result = self.engine.query(thought[20:])
-            query_conc = str(query_result)
+            if synthesis:
+                query_conc = synthesis[1]
+            else:
+                query_result = self.engine.query(thought[20:])
+                query_conc = str(query_result)
             self.agent_input += f'\nOBSERVATION: {query_conc}'
 
         elif "REASONING" in self.agent_input.split('\n')[-1]:
@@ -507,6 +1007,18 @@ class RAGAGENT:
         rephrase = self.llm.invoke(rephrase_prompt.format_messages(query = query, jargons = jargons))
         return rephrase.content
 
+    def scratchpad_input(self, prompt):
+        """
+        The agent input to send to a prompt, with the observations of older steps compacted.
+
+        Args:
+            prompt (str): Name of the prompt, used to report the tokens sent
+
+        Returns:
+            str: The compacted agent input
+        """
+        return self.scratchpad.render(self.agent_input, prompt, self.step_n)
+
     def prompt_thought_agent(self):
         """
         Generate a thought process for the agent using the thought agent prompt.
@@ -515,7 +1027,7 @@ class RAGAGENT:
             str: The generated thought response from the LLM.
         """
         expression = None
-        llm_input = self.thought_agent_prompt.format_messages(retriever=self.retriever, question=self.question, agent_input=self.agent_input)
+        llm_input = self.thought_agent_prompt.format_messages(retriever=self.retriever, question=self.question, agent_input=self.scratchpad_input('thought'))
         response = self.llm.invoke(llm_input).content
         return self.parse_llm_response(response, expression)
 
@@ -536,7 +1048,7 @@ class RAGAGENT:
             else:
                 prompt = self.reasoning_agent_prompt
 
-            llm_input = prompt.format_messages(retriever=self.retriever, question=self.question, agent_input=self.agent_input)
+            llm_input = prompt.format_messages(retriever=self.retriever, question=self.question, agent_input=self.scratchpad_input('reasoning'))
             response = self.llm.invoke(llm_input).content
             if force_completion and "FINAL ANSWER" not in response:
                 response = f"FINAL ANSWER: {response}"
@@ -603,43 +1115,8 @@ class RAGAGENT:
         return '\n'.join([f"{idx + 1}. {question}" for idx, question in enumerate(random_questions)])
 
     def retrieve_docs(self, query, top_k):
-      pdf_document = fitz.open(stream=BytesIO(self.pdf_content), filetype="pdf")
-      output_folder = "data"
-      metadata = {}
-      for page_num in range(len(pdf_document)):
-          page_metadata = {"text": ""}
-          page = pdf_document[page_num]
-          page_text = page.get_text()
-          page_metadata["text"] = page_text
-          metadata[f"page_{page_num + 1}"] = page_metadata
-      pdf_document.close()
-
-      dimension = 1024
-      index = faiss.IndexFlatL2(dimension)
-      faiss_metadata = []
-      count = 1
-      for page, content in metadata.items():
-          page_text = content["text"]
-          page_embedding = text_embed_model.get_text_embedding(page_text)
-          page_embedding = np.array([page_embedding], dtype="float32")
-          index.add(page_embedding)
-          faiss_metadata.append({
-              "page": page.split("_")[-1],
-              "text": page_text})
-          count += 1
-    
-      query = str(query)
-      query_embedding = query_embed_model.get_query_embedding(query)
-      query_embedding = np.array([query_embedding], dtype="float32")
-      distances, indices = index.search(query_embedding, top_k)
-
-      results = []
-      for idx, distance in zip(indices[0], distances[0]):
-          if idx == -1:
-              continue
-          result_metadata = faiss_metadata[idx]
-          result_metadata["distance"] = distance
-          results.append(result_metadata)
+      # Pages were embedded when the retriever was built, only the query is embedded here
+      results = get_page_index(self.pdf_content, text_embed_model, query_embed_model).search(str(query), top_k)
 
       gt_num=[]
       for result in results:
@@ -695,4 +1172,5 @@ class RAGAGENT:
         self.answer = ''
         self.finished = False
         self.agent_input = ''
+        self.scratchpad.reset()
         self.previous_queries.clear()
\ No newline at end of file
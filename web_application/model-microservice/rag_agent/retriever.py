@@ -1,8 +1,4 @@
 import faiss
-import json
-import os
-import fitz
-import numpy as np
 from llama_index.core import Document
 from llama_index.packs.raptor import RaptorRetriever
 from llama_index.core.node_parser import SentenceSplitter
@@ -15,18 +11,16 @@ from llama_index.core import (
     VectorStoreIndex,
     StorageContext,
 )
-from llama_index.core import Document
 from llama_index.vector_stores.faiss import FaissVectorStore
 from IPython.display import Markdown, display
 from llama_index.core.node_parser import TokenTextSplitter
-import fitz 
-import numpy as np
 from llama_index.core import Settings
 import re
 from io import BytesIO
 import time
 
 from rag_agent.utils import client_table, text_embed_model, query_embed_model, client_unstructured, llm
+from rag_agent.page_index import get_page_index
 
 def table_summary(html_code):
     """
@@ -63,49 +57,8 @@ def table_summary(html_code):
 
 def jina_retriever(pdf_content, query, top_k):
     # pass
-  pdf_document = fitz.open(stream=BytesIO(pdf_content), filetype="pdf")
-
-  metadata = {}
-  for page_num in range(len(pdf_document)):
-      page_metadata = {"text": ""}
-      page = pdf_document[page_num]
-
-      page_text = page.get_text()
-      page_metadata["text"] = page_text
-
-      metadata[f"page_{page_num + 1}"] = page_metadata
-
-  pdf_document.close()
-
-  #constructing a FAISS vector store for text-based doc level retrieval.
-  dimension = 1024
-  index = faiss.IndexFlatL2(dimension)
-  faiss_metadata = []
-  count = 1
-  for page, content in metadata.items():
-      page_text = content["text"]
-      page_embedding = text_embed_model.get_text_embedding(page_text)
-      page_embedding = np.array([page_embedding], dtype="float32")
-      index.add(page_embedding)
-      faiss_metadata.append({
-          "page": page.split("_")[-1],
-          "text": page_text
-      })
-      count += 1
-
-  query_embedding = query_embed_model.get_query_embedding(query)
-  query_embedding = np.array([query_embedding], dtype="float32")
-  distances, indices = index.search(query_embedding, top_k)
-
-  #doc level retrieval
-
-  results = []
-  for idx, distance in zip(indices[0], distances[0]):
-      if idx == -1:
-          continue
-      result_metadata = faiss_metadata[idx]
-      result_metadata["distance"] = distance
-      results.append(result_metadata)
+  #doc level retrieval over the page index shared with RAGAGENT.retrieve_docs.
+  results = get_page_index(pdf_content, text_embed_model, query_embed_model).search(query, top_k)
 
   gt_num=[]
   for result in results:
@@ -128,7 +81,7 @@ def jina_retriever(pdf_content, query, top_k):
   except Exception as e:
     pass
 
-  page_text = ""
+  pdf_text = ""
   for element in res.elements:
 
       if element['type'] == 'Table':
@@ -184,49 +137,8 @@ def raptor_retriever(pdf_content, query, top_k):
         >>> query_engine = retriever('document.pdf', 'research methodology', top_k=3)
         >>> response = query_engine.query("Summarize the key findings")
   """
-  pdf_document = fitz.open(stream=BytesIO(pdf_content), filetype="pdf")
-
-  metadata = {}
-  for page_num in range(len(pdf_document)):
-      page_metadata = {"text": ""}
-      page = pdf_document[page_num]
-
-      page_text = page.get_text()
-      page_metadata["text"] = page_text
-
-      metadata[f"page_{page_num + 1}"] = page_metadata
-
-  pdf_document.close()
-
-  #constructing a FAISS vector store for text-based doc level retrieval.
-  dimension = 1024
-  index = faiss.IndexFlatL2(dimension)
-  faiss_metadata = []
-  count = 1
-  for page, content in metadata.items():
-      page_text = content["text"]
-      page_embedding = text_embed_model.get_text_embedding(page_text)
-      page_embedding = np.array([page_embedding], dtype="float32")
-      index.add(page_embedding)
-      faiss_metadata.append({
-          "page": page.split("_")[-1],
-          "text": page_text
-      })
-      count += 1
-
-  query_embedding = query_embed_model.get_query_embedding(query)
-  query_embedding = np.array([query_embedding], dtype="float32")
-  distances, indices = index.search(query_embedding, top_k)
-
-  #doc level retrieval
-
-  results = []
-  for idx, distance in zip(indices[0], distances[0]):
-      if idx == -1:
-          continue
-      result_metadata = faiss_metadata[idx]
-      result_metadata["distance"] = distance
-      results.append(result_metadata)
+  #doc level retrieval over the page index shared with RAGAGENT.retrieve_docs.
+  results = get_page_index(pdf_content, text_embed_model, query_embed_model).search(query, top_k)
 
   gt_num=[]
   for result in results:
@@ -10,6 +10,9 @@ from llama_index.core.memory import VectorMemory
 from llama_index.core.llms import ChatMessage
 import traceback
 from rag_agent.ragagent import RAGAGENT
+from rag_agent.answer_cache import get_shared_answer_cache, tools_key
+from rag_agent.cache_registry import document_key
+from rag_agent.utils import answer_cache_enabled, answer_cache_similarity
 from rag_agent.retriever import jina_retriever, raptor_retriever
 from llama_index.embeddings.jinaai import JinaEmbedding
 import sys
@@ -32,7 +35,8 @@ class SUPERVISOR_AGENT:
     The supervisor agent can handle errors during code execution by utilizing mechanisms such as `api_reflection`, `code_reflection`, and `silent_reflection`.
     """
     
-    def __init__(self, tools, tools_aux, llm, tool_map, url, chat_id, rag_llm = chat_llm1 , reflextion_limit = 3, top_k = 5, max_steps = 10, raptor = True):
+    def __init__(self, tools, tools_aux, llm, tool_map, url, chat_id, rag_llm = chat_llm1 , reflextion_limit = 3, top_k = 5, max_steps = 10, raptor = True,
+                 use_answer_cache = answer_cache_enabled, answer_similarity = answer_cache_similarity):
     
         self.tools = tools
         self.llm = llm
@@ -54,6 +58,12 @@ class SUPERVISOR_AGENT:
         response = requests.get(self.url)
         response.raise_for_status()
         self.pdf_content = response.content
+        # Final answers of questions asked before on the same document with the same tools,
+        # returned when a new question is at least `answer_similarity` cosine-similar
+        self.answer_cache = get_shared_answer_cache() if use_answer_cache else None
+        self.answer_similarity = answer_similarity
+        self.document_key = document_key(self.pdf_content)
+        self.answer_cache_keys = None
         pdf_content_fitz = fitz.open(stream=BytesIO(response.content), filetype="pdf")
         
         first_two_page_content = pdf_content_fitz[0].get_text()
@@ -81,6 +91,15 @@ class SUPERVISOR_AGENT:
       self.query = query
       
       if is_follow_up_question is False and self.api_reflextion_flag is False and self.rag_response is False:
+          # Follow-up answers depend on the conversation, only standalone questions are cached
+          self.answer_cache_keys = self.current_answer_cache_keys()
+          if self.answer_cache_keys:
+            cached = self.answer_cache.lookup(query, *self.answer_cache_keys, similarity_threshold=self.answer_similarity)
+            if cached:
+              self.vector_memory.put(ChatMessage.from_str(cached['answer'], "user"))
+              self.logs.append([self.query, cached['answer']])
+              return {"API_REFLEXTION_FLAG" : False, "RAG_FLAG" : False , "Final_Answer" : cached['answer'], "Suggestions" : self.agent.get_random_questions_from_metadata()}
+
           if self.raptor:
             retriever_agent = raptor_retriever(self.pdf_content, query, self.top_k)
           else :
@@ -89,6 +108,15 @@ class SUPERVISOR_AGENT:
           self.agent.retriever = retriever_agent
       
       elif is_follow_up_question :
+          self.answer_cache_keys = None
+          # A follow-up to a cached answer has no retriever yet
+          if self.agent.retriever is None:
+            if self.raptor:
+              retriever_agent = raptor_retriever(self.pdf_content, query, self.top_k)
+            else :
+              retriever_agent = jina_retriever(self.pdf_content, query, self.top_k)
+            self.agent.engine = RetrieverQueryEngine.from_args(retriever_agent, llm=llm)
+            self.agent.retriever = retriever_agent
           facts = self.vector_memory.get(query)
           for i in range(len(facts)):
             self.responses.append(facts[i].content)
@@ -187,11 +215,40 @@ class SUPERVISOR_AGENT:
       final_response = self.llm.invoke(final_response_prompt.format_messages(query = self.query, code = self.scratchpad, responses = self.responses))
       self.vector_memory.put(ChatMessage.from_str(final_response.content, "user"))
       self.logs.append([self.query, final_response.content])
+      if self.answer_cache_keys:
+        # Tools may have been added while answering
+        self.answer_cache_keys = self.current_answer_cache_keys()
+        self.answer_cache.store(self.query, final_response.content, self.scratchpad, *self.answer_cache_keys)
+        self.answer_cache_keys = None
       
       self.scratchpad = ""
       self.responses = []
       return {"API_REFLEXTION_FLAG" : False, "RAG_FLAG" : False , "Final_Answer" : final_response.content, "Suggestions" : self.agent.get_random_questions_from_metadata()}
 
+    def drain_enrichment(self, timeout = None):
+      """
+      Wait for the memory enrichment queued by the RAG agent's steps, e.g. when the chat goes idle.
+
+      Args:
+          timeout (float, optional): Maximum seconds to wait. Defaults to no limit.
+
+      Returns:
+          bool: True if no enrichment job is left.
+      """
+      return self.agent.drain_enrichment(timeout)
+
+    def current_answer_cache_keys(self):
+      """
+      Keys of the answer cache for this agent's document and current tool set. Answers cached under
+      another tool set are left to the cache's eviction, lookups never match them.
+
+      Returns:
+          tuple: (document key, tool set fingerprint), or None if the answer cache is disabled.
+      """
+      if self.answer_cache is None:
+        return None
+      return self.document_key, tools_key(self.tools)
+
     def resolve_rag_jargon(self, clarification, feedback):
       agent_code = self.error_agent_code
       self.agent.clarification = clarification
@@ -372,6 +429,7 @@ class SUPERVISOR_AGENT:
                     if self.agent.check_query_in_memory(query):
                         chunk = self.agent.check_memory_and_retrieve_for_supervisor(query)
                         func_response = llm_response_if_memory_hit_found(query, chunk)
+                        self.agent.record_lookup_outcome(func_response is not None)
                         agent_code = AgentCode(content="rag__agent")
                     else:
                         func_response, jargon, agent = self.tool_map[func_name](*[args_list, self.agent])
@@ -446,6 +504,7 @@ class SUPERVISOR_AGENT:
                 if self.agent.check_query_in_memory(query):
                     chunk = self.agent.check_memory_and_retrieve_for_supervisor(query)
                     func_response = llm_response_if_memory_hit_found(query, chunk)
+                    self.agent.record_lookup_outcome(func_response is not None)
                     agent_code = AgentCode(content="rag__agent")
                 else:
                     func_response, jargon, agent = self.tool_map[func_name](*[args_list, self.agent])
@@ -21,6 +21,49 @@ unstructured_api_url = os.getenv("UNSTRUCTURED_API_URL")
 jina_api_key = os.getenv("JINAAI_API_KEY")
 embed_jina_api_key = os.getenv('EMBED_JINA_API_KEY')
 
+# Bounds of the per-chat memory cache, see DynamicCacheIndex
+cache_max_entries = int(os.getenv('CACHE_MAX_ENTRIES', 5000)) or None
+cache_eviction_policy = os.getenv('CACHE_EVICTION_POLICY', 'lru')
+cache_ttl_seconds = float(os.getenv('CACHE_TTL_SECONDS')) if os.getenv('CACHE_TTL_SECONDS') else None
+cache_dedup_mode = os.getenv('CACHE_DEDUP_MODE', 'hash') or None
+cache_background_indexing = os.getenv('CACHE_BACKGROUND_INDEXING', 'false').lower() in ('1', 'true', 'yes')
+cache_storage = os.getenv('CACHE_STORAGE', 'float32')
+cache_share_memory = os.getenv('CACHE_SHARE_MEMORY', 'true').lower() in ('1', 'true', 'yes')
+
+# Final-answer cache of SUPERVISOR_AGENT, see AnswerCache
+answer_cache_enabled = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+answer_cache_similarity = float(os.getenv('ANSWER_CACHE_SIMILARITY', 0.95))
+
+# Memory caches built when a document is uploaded, see cache_prewarm
+cache_prewarm_dir = os.getenv('CACHE_PREWARM_DIR', 'prewarmed_caches')
+cache_prewarm_max_chunks = int(os.getenv('CACHE_PREWARM_MAX_CHUNKS', 200))
+cache_prewarm_queries_per_chunk = int(os.getenv('CACHE_PREWARM_QUERIES_PER_CHUNK', 3))
+
+# Log of semantic memory lookups replayed by threshold_calibration.py, disabled when unset
+lookup_log_path = os.getenv('LOOKUP_LOG_PATH') or None
+
+# Concurrency of the per-chunk work of a RETRIEVAL step, see ProviderLimits
+chunk_concurrency = int(os.getenv('CHUNK_CONCURRENCY', 4))
+provider_concurrency = {
+    'synthesis': int(os.getenv('SYNTHESIS_CONCURRENCY', 4)),
+    'query_generation': int(os.getenv('QUERY_GENERATION_CONCURRENCY', 2)),
+    'embedding': int(os.getenv('EMBEDDING_CONCURRENCY', 4)),
+}
+
+# Background generation of utility queries, see EnrichmentQueue
+enrichment_background = os.getenv('ENRICHMENT_BACKGROUND', 'true').lower() in ('1', 'true', 'yes')
+enrichment_max_pending = int(os.getenv('ENRICHMENT_MAX_PENDING', 64))
+enrichment_drop_policy = os.getenv('ENRICHMENT_DROP_POLICY', 'drop_oldest')
+# Seconds a request thread waits for the queue after its response is sent, the worker finishes the rest
+enrichment_drain_timeout = float(os.getenv('ENRICHMENT_DRAIN_TIMEOUT', 5))
+
+# 'batched' for one LLM call per RETRIEVAL step, 'per_chunk' for one query engine call per chunk
+synthesis_mode = os.getenv('SYNTHESIS_MODE', 'batched')
+
+# Agent input sent to the thought and reasoning prompts, see Scratchpad
+scratchpad_token_budget = int(os.getenv('SCRATCHPAD_TOKEN_BUDGET', 3000))
+scratchpad_recent_steps = int(os.getenv('SCRATCHPAD_RECENT_STEPS', 2))
+
 chat_llm = ChatGroq(model="llama-3.1-70b-versatile", api_key = supervisor_groq_api, temperature=0.1,)
 chat_llm1 = ChatGroq(model="llama3-70b-8192", api_key = rag_agent_api)
 llm = groq_llama(model="llama3-70b-8192", api_key = raptor_api)